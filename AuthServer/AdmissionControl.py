@@ -0,0 +1,123 @@
+import os
+import time
+from collections import OrderedDict
+from threading import BoundedSemaphore, Lock
+
+# Protects the password hashing capacity from bursts of logins and registrations, whether legitimate or credential
+# stuffing. Hashing requests are limited per client IP and per email by token buckets (429 when exceeded), and share a
+# bounded concurrency budget (503 when exhausted, after a brief wait). Session-only requests skip both, so they are
+# never queued behind hashing work. A batch counts each of its password updates, up to the whole burst or budget.
+#
+# Configured through environment variables:
+#   AUTHSERVER_IP_RATE, AUTHSERVER_IP_BURST: hashing requests per second per client IP, and the burst allowed
+#   AUTHSERVER_EMAIL_RATE, AUTHSERVER_EMAIL_BURST: hashing requests per second per email, and the burst allowed
+#   AUTHSERVER_HASHING_BUDGET: the number of hashing requests handled at once
+class AdmissionController:
+
+    __hashingWait__ = 0.05 # 50 milliseconds
+
+    def __init__(self, hashingBudget, ipLimiter = None, emailLimiter = None):
+        # Requests go unlimited by IP or email when no limiter is given
+        self.ipLimiter = ipLimiter
+        self.emailLimiter = emailLimiter
+
+        self.hashingBudget = hashingBudget
+        self.hashingSlots = BoundedSemaphore(hashingBudget)
+        self.hashingCount = 0
+        self.hashingCountLock = Lock()
+
+
+    # Admission Methods
+
+    def admit(self, path, client, input):
+        # Returns None if the request is admitted, or the (status, message) to reject it with; admitted hashing requests
+        # hold slots of the budget until released
+        hashCount = get_hash_count(path, input)
+        if hashCount == 0:
+            return None
+
+        if self.ipLimiter is not None and client is not None and not self.ipLimiter.try_acquire(client, hashCount):
+            return (429, 'Too many requests from ' + client)
+
+        email = input.get('email') if isinstance(input, dict) else None
+        if self.emailLimiter is not None and isinstance(email, str) and not self.emailLimiter.try_acquire(email.lower()):
+            return (429, 'Too many requests for ' + email)
+
+        slotCount = min(hashCount, self.hashingBudget)
+        for acquiredCount in range(slotCount):
+            if not self.hashingSlots.acquire(timeout = self.__hashingWait__):
+                for _ in range(acquiredCount):
+                    self.hashingSlots.release()
+                return (503, 'Server is busy, try again later')
+
+        with self.hashingCountLock:
+            self.hashingCount += slotCount
+        return None
+
+    def release(self, path, input):
+        # Release the slots held by an admitted request
+        slotCount = min(get_hash_count(path, input), self.hashingBudget)
+        if slotCount > 0:
+            with self.hashingCountLock:
+                self.hashingCount -= slotCount
+            for _ in range(slotCount):
+                self.hashingSlots.release()
+
+    def get_hashing_count(self):
+        # Number of budget slots held by the hashing requests being handled
+        return self.hashingCount
+
+
+# Token buckets for many keys, e.g. client IPs; the least recently used buckets are dropped beyond the key limit
+class RateLimiter:
+
+    def __init__(self, rate, burst, maxKeys = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.maxKeys = maxKeys
+        self.buckets = OrderedDict() # key to [tokens, last refill time]
+        self.lock = Lock()
+
+    def try_acquire(self, key, count = 1):
+        # Take the given number of tokens from the key's bucket, up to the whole burst, returning False if it holds too
+        # few
+        count = min(count, self.burst)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = [self.burst, now]
+                self.buckets[key] = bucket
+                if len(self.buckets) > self.maxKeys:
+                    self.buckets.popitem(last = False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] < count:
+                return False
+            bucket[0] -= count
+            return True
+
+
+# Whether handling the request hashes a password: registrations, logins, and password updates, alone or in a batch
+def requires_hashing(path, input):
+    return get_hash_count(path, input) > 0
+
+def get_hash_count(path, input):
+    # The number of passwords the request hashes; the input isn't validated yet
+    if path == '/register' or path == '/login':
+        return 1
+    if path == '/update':
+        return 1 if isinstance(input, dict) and 'password' in input else 0
+    if path == '/batch' and isinstance(input, dict) and isinstance(input.get('operations'), list):
+        return sum(1 for operation in input['operations'] if isinstance(operation, dict) and 'password' in operation)
+    return 0
+
+def create_admission_controller_from_env(workerCount, environ = os.environ):
+    # By default, half the worker threads can hash at once, so the rest are left for session requests
+    return AdmissionController(
+        int(environ.get('AUTHSERVER_HASHING_BUDGET', max(1, workerCount // 2))),
+        RateLimiter(float(environ.get('AUTHSERVER_IP_RATE', 50)), float(environ.get('AUTHSERVER_IP_BURST', 100))),
+        RateLimiter(float(environ.get('AUTHSERVER_EMAIL_RATE', 1)), float(environ.get('AUTHSERVER_EMAIL_BURST', 10))))
@@ -0,0 +1,199 @@
+import sys
+import json
+import signal
+import ssl
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from AuthServer.AdmissionControl import requires_hashing
+from AuthServer.Metrics import metrics
+from AuthServer.ServerSetup import ServerComponents, parse_server_args
+
+# asyncio-based HTTP/1.1 server implementation for token-based authentication; idle connections cost no threads,
+# while the blocking request handling (SQLite queries, password hashing) runs in an executor
+class AsyncAuthServer:
+
+    __maxHeaderSize__ = 16384 # 16 KB
+    __maxBodySize__ = 65536 # 64 KB
+
+    def __init__(self, requestRouter, executor, idleTimeout = 60, maxRequestsPerConnection = 1000, sessionExecutor = None):
+        self.requestRouter = requestRouter
+        self.executor = executor
+
+        # Priority lane for session requests, so they never queue behind password hashing; shares the executor when not given
+        self.sessionExecutor = sessionExecutor or executor
+        self.idleTimeout = idleTimeout
+        self.maxRequestsPerConnection = maxRequestsPerConnection
+        self.openConnections = 0
+
+
+    # Server Methods
+
+    async def start(self, hostaddr, hostport, sslContext = None, backlog = 4096, reusePort = False):
+        # With port reuse, several worker processes can accept on the same address
+        return await asyncio.start_server(
+            self.handle_connection,
+            hostaddr,
+            hostport,
+            ssl = sslContext,
+            backlog = backlog,
+            reuse_port = reusePort,
+            limit = self.__maxHeaderSize__,
+            ssl_handshake_timeout = self.idleTimeout if sslContext is not None else None)
+
+    async def handle_connection(self, reader, writer):
+        self.openConnections += 1
+        try:
+            # Serve requests on the connection until the client closes it, it goes idle, or it reaches the request cap
+            keepAlive = True
+            requestCount = 0
+            while keepAlive:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+
+                (method, path, version, headers, body) = request
+                requestCount += 1
+                keepAlive = self.is_keep_alive(version, headers) and requestCount < self.maxRequestsPerConnection
+
+                # Run the blocking request handling off the event loop
+                input = self.parse_input(body)
+                executor = self.executor if requires_hashing(path, input) else self.sessionExecutor
+                (status, result) = await asyncio.get_running_loop().run_in_executor(
+                    executor, self.requestRouter.route, method, path, input, self.get_client(writer))
+
+                writer.write(self.build_response(status, result, keepAlive))
+                await writer.drain()
+
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ssl.SSLError):
+            pass
+
+        except Exception as e:
+            # Malformed request; reply, then drop the connection
+            try:
+                writer.write(self.build_response(400, e.args[0] if e.args else 'Malformed request', False))
+                await writer.drain()
+            except (ConnectionError, ssl.SSLError):
+                pass
+
+        finally:
+            self.openConnections -= 1
+            writer.close()
+
+
+    # Utility Methods
+
+    async def read_request(self, reader):
+        # Read the request line and headers, giving up on idle connections
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idleTimeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None
+
+        lines = head.decode('latin-1').split('\r\n')
+        requestLine = lines[0].split()
+        if len(requestLine) != 3:
+            raise Exception('Malformed request line')
+        (method, path, version) = requestLine
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                (key, value) = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+
+        # Read the body
+        contentLength = int(headers.get('content-length', 0))
+        if contentLength < 0 or contentLength > self.__maxBodySize__:
+            raise Exception('Invalid Content-Length')
+        body = await asyncio.wait_for(reader.readexactly(contentLength), self.idleTimeout)
+
+        return (method, path, version, headers, body)
+
+    def get_client(self, writer):
+        peername = writer.get_extra_info('peername')
+        return peername[0] if peername else None
+
+    def is_keep_alive(self, version, headers):
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            return connection != 'close'
+        else:
+            return connection == 'keep-alive'
+
+    def parse_input(self, body):
+        try:
+            return json.loads(body)
+        except:
+            return {}
+
+    def build_response(self, status, result, keepAlive):
+        contentType = 'application/json'
+        if status == 200 and isinstance(result, str):
+            # Plain text replies, e.g. metrics
+            contentType = 'text/plain; version=0.0.4'
+            body = bytes(result, 'utf8')
+        elif status == 200:
+            body = b'' if result is None else bytes(json.dumps(result), 'utf8')
+        else:
+            body = bytes(json.dumps({ 'error' : result }), 'utf8')
+
+        head = 'HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' % (
+            status,
+            HTTPStatus(status).phrase,
+            contentType,
+            len(body),
+            'keep-alive' if keepAlive else 'close')
+
+        return bytes(head, 'latin-1') + body
+
+
+# Raise the open file limit as far as allowed, so that many concurrent connections can be held
+def raise_file_limit():
+    try:
+        import resource
+        (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+# Main application loop
+
+def main():
+    (hostaddr, hostport, dbfile, keyfile, certfile, workerCount) = parse_server_args(sys.argv)
+
+    raise_file_limit()
+
+    # TLS handshakes run on the event loop alongside other connections
+    components = ServerComponents(dbfile, keyfile, certfile, workerCount)
+    asyncio.run(serve(hostaddr, hostport, workerCount, components))
+
+async def serve(hostaddr, hostport, workerCount, components):
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, components.requestProfiler.toggle)
+    if components.clusterRouter is not None:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, components.clusterRouter.reload)
+
+    executor = ThreadPoolExecutor(max_workers = workerCount, thread_name_prefix = 'AuthServerWorker')
+    sessionExecutor = ThreadPoolExecutor(max_workers = workerCount, thread_name_prefix = 'AuthServerSessionWorker')
+
+    # Launch the server; worker processes share the port
+    authServer = AsyncAuthServer(components.requestRouter, executor, sessionExecutor = sessionExecutor)
+    metrics.gauge('authserver_open_connections', 'Client connections currently open', lambda: authServer.openConnections)
+    server = await authServer.start(hostaddr, hostport, components.sslContext, reusePort = components.processCount > 1)
+    # Stop on SIGTERM as on an interrupt, so the shutdown below runs either way
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        # The server has stopped accepting connections; wait for the requests running in the executors, then shut down
+        # the rest
+        executor.shutdown(wait = True)
+        sessionExecutor.shutdown(wait = True)
+        components.shutdown()
+
+if __name__ == '__main__':
+    main()
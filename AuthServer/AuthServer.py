@@ -1,214 +1,130 @@
 import sys
 import json
-import re
-import sqlite3
-import ssl
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from AuthServer.TokenManager import TokenManager
-from AuthServer.UserManager import UserManager
-from AuthServer.RequestHandler import RequestHandler
-
-# Simple HTTP server implementation for token-based authentication
+import signal
+from http.server import BaseHTTPRequestHandler
+from AuthServer.ServerSetup import ServerComponents, parse_server_args
+from AuthServer.ThreadPoolHTTPServer import ThreadPoolHTTPServer
+
+# Simple threaded HTTP/1.1 server implementation for token-based authentication; connections are kept alive across
+# requests, until they go idle or reach the request cap
 class AuthServer(BaseHTTPRequestHandler):
 
+    protocol_version = 'HTTP/1.1'
+    timeout = 15 # Idle timeout, in seconds; each open connection holds a worker thread
+    __maxRequestsPerConnection__ = 1000
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.requestCount = 0
+
+
     # Request Handler Methods
 
     def do_POST(self):
-        input = self.parse_input()
+        self.handle_request('POST')
 
-        # Handle the given command
-        if self.path == '/register':
-            try:
-                # Get, validate the input
-                name = self.get_name(input)
-                email = self.get_email(input)
-                password = self.get_password(input)
-
-                # Create a new user
-                print('Registering user ' + email)
-                requestHandler.registration_handler(name, email, password)
-                
-                # Generate reply
-                self.reply_200()
-
-            except Exception as e:
-                self.reply_400(e.args[0])
-
-        elif self.path == '/login':
-            try:
-                # Get, validate the input
-                email = self.get_email(input)
-                password = self.get_password(input)
-
-                # Login the user
-                print('Logging in user ' + email)
-                token = requestHandler.login_handler(email, password)
-
-                # Generate reply
-                self.reply_200_with_token(token)
-
-            except Exception as e:
-                self.reply_400(e.args[0])
-
-        elif self.path == '/logout':
-            try:
-                # Get, validate the input
-                token = self.get_token(input)
-
-                # Logout the user
-                print('Logging out user with token ' + token)
-                requestHandler.logout_handler(token)
-
-                # Generate reply
-                self.reply_200()
-
-            except Exception as e:
-                self.reply_400(e.args[0])
-        
-        elif self.path == '/update':
-            try:
-                # Get, validate the input
-                name = self.get_name(input, False)
-                email = self.get_email(input, False)
-                password = self.get_password(input, False)
-                token = self.get_token(input)
-
-                # Update the user
-                print('Updating user with token ' + token)
-                token = requestHandler.update_handler(name, email, password, token)
-                
-                # Generate reply
-                self.reply_200_with_token(token)
-
-            except Exception as e:
-                self.reply_400(e.args[0])
-            
     def do_DELETE(self):
-        input = self.parse_input()
-
-        # Handle the given command
-        if self.path == '/delete':
-            try:
-                # Get, validate the input
-                token = self.get_token(input)
+        self.handle_request('DELETE')
 
-                # Delete the user
-                print('Deleting user with token ' + token)
-                requestHandler.deletetion_handler(token)
+    def do_GET(self):
+        self.handle_request('GET')
 
-                # Generate reply
-                self.reply_200()
+    def handle_request(self, method):
+        input = self.parse_input()
 
-            except Exception as e:
-                self.reply_400(e.args[0])
+        # Handle the given command
+        (status, result) = requestRouter.route(method, self.path, input, self.client_address[0])
+
+        # Generate reply
+        if status == 200 and isinstance(result, str):
+            self.reply_200_with_text(result)
+        elif status == 200 and result is not None:
+            self.reply_200_with_json(result)
+        elif status == 200:
+            self.reply_200()
+        elif status == 400:
+            self.reply_400(result)
+        else:
+            self.reply_error(status, result)
 
     
     # Response Methods
 
     def reply_200(self):
-        self.send_response(200)
-        self.end_headers
+        self.reply(200)
 
-    def reply_200_with_token(self, token):
-        self.reply_200
-        self.wfile.write(bytes(json.dumps({ 'token' : token }), 'utf8'))
+    def reply_200_with_json(self, result):
+        self.reply(200, bytes(json.dumps(result), 'utf8'))
+
+    def reply_200_with_text(self, text):
+        self.reply(200, bytes(text, 'utf8'), 'text/plain; version=0.0.4')
 
     def reply_400(self, message):
-        self.send_error(400, message)
+        self.reply_error(400, message)
+
+    def reply_error(self, status, message):
+        # Errors carry a JSON body rather than send_error's HTML page, which would also close the connection
+        self.reply(status, bytes(json.dumps({ 'error' : message }), 'utf8'))
+
+    def reply(self, status, body = b'', contentType = 'application/json'):
+        # Every reply is framed by its Content-Length, so the connection can carry the next request
+        self.requestCount += 1
+        if self.requestCount >= self.__maxRequestsPerConnection__:
+            self.close_connection = True
+
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close' if self.close_connection else 'keep-alive')
+        self.end_headers()
+        self.wfile.write(body)
 
     
+    # Logging Methods
+
+    def log_request(self, code = '-', size = '-'):
+        # Requests are already logged by the router
+        pass
+
+    def log_message(self, format, *args):
+        requestLogger.log('server', client = self.address_string(), message = format % args)
+
+
     # Utility Methods
 
     def parse_input(self):
-        raw_data = self.rfile.read(int(self.headers['Content-Length']))
-        print("Received from client: " + str(raw_data))
+        # Bodyless requests (e.g. GET) carry no Content-Length
+        raw_data = self.rfile.read(int(self.headers['Content-Length'] or 0))
         
         try: 
             return json.loads(raw_data)
         except:
             return {}
 
-    def get_name(self, input, required = True):
-        if 'name' in input:
-            return input['name']
-        elif required:
-            raise Exception('Unable to retrieve name from input')
-        else:
-            return None
-
-    def get_email(self, input, required = True):
-        if 'email' in input:
-            email = input['email']
-
-            # Regex pattern taken from https://emailregex.com
-            if not re.match("^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$", email):
-                raise Exception('Unable to retrieve email from input')
-
-            return email
-        elif required:
-            raise Exception('Unable to retrieve email from input')
-        else:
-            return None
-
-    def get_password(self, input, required = True):
-        if 'password' in input:
-            password = input['password']
-
-            # Password should be mimimum of 16 characters
-            if len(password) < 16:
-                raise Exception('Unable to retrieve password from input')
-
-            # Password should contain at least one lowercase letter
-            if len(re.findall("[a-z]", password)) < 1:
-                raise Exception('Unable to retrieve password from input')
-
-            # Password should contain at least one uppercase letter
-            if len(re.findall("[A-Z]", password)) < 1:
-                raise Exception('Unable to retrieve password from input')
-
-            # Password should contain at least one (unicode) digit
-            if len(re.findall("[\d]", password)) < 1:
-                raise Exception('Unable to retrieve password from input')
-
-            # Password should contain at least one special character
-            if len(re.findall("[,.:;?!@#$%&-_+=]", password)) < 1:
-                raise Exception('Unable to retrieve password from input')
-
-            return password
-        elif required:
-            raise Exception('Unable to retrieve password from input')
-        else:
-            return None
-
-    def get_token(self, input):
-        if 'token' in input:
-            return input['token']
-        else:
-            raise Exception('Unable to retrieve token from input')
-
 
 # Main application loop
 
-# Validate args
-if len(sys.argv) < 6:
-    print('Required Args: <host address> <host port> <sqlite file> <SSL key file> <SSL cert file>')
-    exit()
-
-hostaddr = sys.argv[1]
-hostport = sys.argv[2]
-dbfile = sys.argv[3]
-keyfile = sys.argv[4]
-certfile = sys.argv[5]
-
-# Setup DB connection
-db = sqlite3.connect(dbfile)
-
-# Create necessary handler objects
-tokenManager = TokenManager()
-userManager = UserManager(db)
-requestHandler = RequestHandler(tokenManager, userManager)
-
-# Launch the server
-server = HTTPServer((hostaddr, int(hostport)), AuthServer)
-server.socket = ssl.wrap_socket(server.socket, keyfile = keyfile, certfile = certfile, server_side = True)
-server.serve_forever()
\ No newline at end of file
+# Guarded, since the password hashing processes re-import this module
+if __name__ == '__main__':
+    (hostaddr, hostport, dbfile, keyfile, certfile, workerCount) = parse_server_args(sys.argv)
+    components = ServerComponents(dbfile, keyfile, certfile, workerCount)
+    requestRouter = components.requestRouter
+
+    requestProfiler = components.requestProfiler
+    signal.signal(signal.SIGUSR1, lambda signum, frame: requestProfiler.toggle())
+    clusterRouter = components.clusterRouter
+    if clusterRouter is not None:
+        signal.signal(signal.SIGHUP, lambda signum, frame: clusterRouter.reload())
+
+    # Launch the server; worker processes share the port
+    server = ThreadPoolHTTPServer((hostaddr, hostport), AuthServer, workerCount, components.processCount > 1)
+    # Handshakes are deferred to the worker threads, under the idle timeout, so a slow client can't stall the accept loop
+    server.socket = components.sslContext.wrap_socket(server.socket, server_side = True, do_handshake_on_connect = False)
+    # Stop on SIGTERM as on an interrupt, so the shutdown below runs either way
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        # Stop accepting connections, and wait for the worker threads to finish those open, before shutting down the rest
+        server.server_close()
+        components.shutdown()
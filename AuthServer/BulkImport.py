@@ -0,0 +1,188 @@
+import sys
+import json
+import os
+import sqlite3
+import time
+from AuthServer.HashingExecutor import HashingExecutor
+from AuthServer.RequestSchema import registerSchema
+from AuthServer.SchemaMigrator import SchemaMigrator
+from AuthServer.UserManager import UserManager
+
+# Imports users in bulk from a JSONL file of registration payloads ({ "name", "email", "password" } per line),
+# validating them with the same rules as the server, hashing the passwords across all cores, and inserting them in large
+# transactions; progress is checkpointed after every transaction, so an interrupted import picks up where it left off
+class BulkImporter:
+
+    __chunkSize__ = 10000 # Rows hashed at a time
+    __transactionSize__ = 50000 # Rows per committed transaction
+
+    def __init__(self, db, hashingExecutor, checkpointFile = None, chunkSize = None, transactionSize = None):
+        self.db = db
+        self.hashingExecutor = hashingExecutor
+        self.checkpointFile = checkpointFile
+        self.chunkSize = chunkSize or self.__chunkSize__
+        self.transactionSize = transactionSize or self.__transactionSize__
+
+        # Only used for salts
+        self.userManager = UserManager(None)
+
+        self.offset = 0
+        self.lineNumber = 0
+        self.importedCount = 0
+        self.duplicateCount = 0
+        self.invalidCount = 0
+
+
+    # Import Methods
+
+    def run(self, importFile):
+        self.load_checkpoint()
+        startTime = time.perf_counter()
+        startLineNumber = self.lineNumber
+
+        with open(importFile, 'rb') as input:
+            input.seek(self.offset)
+
+            pendingCount = 0
+            while True:
+                # Read, validate, and hash the next chunk
+                (users, offset, lineNumber) = self.read_chunk(input)
+                if not users and offset == self.offset:
+                    break
+
+                self.insert_users(users)
+                pendingCount += len(users)
+                self.offset = offset
+                self.lineNumber = lineNumber
+
+                # Commit and checkpoint once the transaction is large enough
+                if pendingCount >= self.transactionSize:
+                    self.commit()
+                    pendingCount = 0
+
+                self.report_progress(startTime, startLineNumber)
+
+            self.commit()
+
+        return {
+            'imported' : self.importedCount,
+            'duplicates' : self.duplicateCount,
+            'invalid' : self.invalidCount
+        }
+
+    def read_chunk(self, input):
+        # Read and validate up to a chunk of rows, returning them hashed, along with the position after the chunk
+        names = []
+        emails = []
+        passwords = []
+        offset = self.offset
+        lineNumber = self.lineNumber
+
+        while len(emails) < self.chunkSize:
+            line = input.readline()
+            if not line:
+                break
+            offset += len(line)
+            lineNumber += 1
+
+            if not line.strip():
+                continue
+
+            try:
+                (name, email, password) = registerSchema.validate(json.loads(line))
+            except Exception as e:
+                self.invalidCount += 1
+                print('Skipping line %d: %s' % (lineNumber, e.args[0] if e.args else 'Malformed row'))
+                continue
+
+            names.append(name)
+            emails.append(email)
+            passwords.append(password)
+
+        salts = [self.userManager.get_new_salt() for _ in emails]
+        hashedPasswords = self.hashingExecutor.hash_passwords(passwords, salts) if emails else []
+
+        return (list(zip(names, emails, hashedPasswords, salts)), offset, lineNumber)
+
+    def insert_users(self, users):
+        # Users already present are left as they are
+        cursor = self.db.cursor()
+        changesBefore = self.db.total_changes
+        cursor.executemany('INSERT OR IGNORE INTO Users VALUES (?, ?, ?, ?)', users)
+
+        insertedCount = self.db.total_changes - changesBefore
+        self.importedCount += insertedCount
+        self.duplicateCount += len(users) - insertedCount
+
+    def commit(self):
+        self.db.commit()
+        self.save_checkpoint()
+
+
+    # Checkpoint Methods
+
+    def load_checkpoint(self):
+        if self.checkpointFile is None or not os.path.exists(self.checkpointFile):
+            return
+
+        with open(self.checkpointFile) as checkpoint:
+            state = json.load(checkpoint)
+
+        self.offset = state['offset']
+        self.lineNumber = state['lineNumber']
+        self.importedCount = state['imported']
+        self.duplicateCount = state['duplicates']
+        self.invalidCount = state['invalid']
+        print('Resuming from line %d' % self.lineNumber)
+
+    def save_checkpoint(self):
+        if self.checkpointFile is None:
+            return
+
+        # Written aside then swapped in, so a crash can't leave a partial checkpoint
+        state = {
+            'offset' : self.offset,
+            'lineNumber' : self.lineNumber,
+            'imported' : self.importedCount,
+            'duplicates' : self.duplicateCount,
+            'invalid' : self.invalidCount
+        }
+        with open(self.checkpointFile + '.tmp', 'w') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(self.checkpointFile + '.tmp', self.checkpointFile)
+
+
+    # Utility Methods
+
+    def report_progress(self, startTime, startLineNumber):
+        elapsed = time.perf_counter() - startTime
+        rate = (self.lineNumber - startLineNumber) / elapsed if elapsed > 0 else 0
+        print('Line %d: %d imported, %d duplicates, %d invalid (%.0f rows/s)' % (
+            self.lineNumber, self.importedCount, self.duplicateCount, self.invalidCount, rate))
+
+
+# Main application
+
+if __name__ == '__main__':
+    # Validate args
+    if len(sys.argv) < 3:
+        print('Required Args: <sqlite file> <JSONL file> [checkpoint file]')
+        exit()
+
+    dbfile = sys.argv[1]
+    importFile = sys.argv[2]
+    checkpointFile = sys.argv[3] if len(sys.argv) > 3 else importFile + '.checkpoint'
+
+    # Setup the DB connection, bringing the schema up to date
+    db = sqlite3.connect(dbfile)
+    SchemaMigrator(db).migrate()
+
+    # Setup the password hashing processes
+    hashingExecutor = HashingExecutor()
+
+    # Run the import
+    result = BulkImporter(db, hashingExecutor, checkpointFile).run(importFile)
+    print(json.dumps(result))
+
+    hashingExecutor.shutdown()
+    db.close()
@@ -0,0 +1,317 @@
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import ssl
+import time
+import uuid
+import zlib
+from threading import Lock, Thread, local
+from AuthServer.Metrics import metrics
+from AuthServer.RequestSchema import FieldSpec, RequestSchema
+
+# Routes requests between the nodes of a cluster, each of which owns a partition of the sessions
+#
+# Sessions are partitioned into a fixed number of shards by the user's email, and each token carries the shard of its
+# user in its first two bytes, so the owner of a request is found from its email (registrations and logins) or its token
+# (everything else) without a lookup. Shards are assigned to nodes by rendezvous hashing of the node names, so every node
+# derives the same assignment from the same membership, and adding a node only moves the shards it takes over. A request
+# landing on a node that doesn't own its shard is forwarded to the owner through an internal endpoint, authenticated by
+# a secret shared by the cluster, and the owner's reply is relayed back; batches are split between the owners of their
+# operations.
+#
+# Rebalancing: the membership file is re-read on SIGHUP. Each node then forwards requests for the shards it no longer
+# owns to their new owners, and hands the sessions of those shards over to them in chunks, through another internal
+# endpoint. Requests for sessions still in transit fail as unknown tokens for a moment. To add a node, start it with the
+# new membership, then update the file on the other nodes and signal them; a node left out of the membership hands off
+# all of its sessions.
+#
+# Users aren't partitioned, only their sessions, so every node must use the same user database. Registrations and logins
+# are routed to the owner of the email all the same, so a user's cached row is only held by one node.
+#
+# Configured through environment variables:
+#   AUTHSERVER_CLUSTER_FILE: a JSON file mapping each node's name to its "host:port"; the server runs alone when unset
+#   AUTHSERVER_CLUSTER_NODE: this node's name in the file
+#   AUTHSERVER_CLUSTER_SECRET: the secret authenticating requests between nodes
+#   AUTHSERVER_CLUSTER_CA_FILE: the certificate the nodes' certificates are verified against; this node's by default
+
+shardCount = 4096
+
+
+class ClusterRouter:
+
+    __maxHops__ = 2 # A request is handled where it lands after this many forwards, should nodes disagree mid-rebalance
+    __forwardTimeout__ = 30 # 30 seconds
+    __handoffChunkSize__ = 256
+    __emailPaths__ = frozenset(['/register', '/login'])
+    __tokenPaths__ = frozenset(['/logout', '/revoke', '/update', '/delete', '/introspect'])
+    __forwardSchema__ = RequestSchema(
+        FieldSpec('secret'),
+        FieldSpec('method', lambda method: isinstance(method, str)),
+        FieldSpec('path', lambda path: isinstance(path, str)),
+        FieldSpec('input'),
+        FieldSpec('client', required = False),
+        FieldSpec('hops', lambda hops: isinstance(hops, int)))
+
+    def __init__(self, tokenManager, nodeName, nodes, secret, sslContext = None, clusterFile = None):
+        self.tokenManager = tokenManager
+        self.nodeName = nodeName
+        self.secret = secret
+
+        # Nodes are reached over TLS, unless no context is given
+        self.sslContext = sslContext
+
+        # The membership file, re-read on reload
+        self.clusterFile = clusterFile
+
+        # The nodes' addresses and the owner of each shard, replaced together on rebalancing
+        self.membership = (dict(nodes), assign_shards(nodes))
+        self.rebalanceLock = Lock()
+
+        # Each thread keeps its connections to the other nodes alive across requests
+        self.connections = local()
+
+        # New tokens carry the shard of their user
+        tokenManager.get_shard = get_email_shard
+
+
+    # Routing Methods
+
+    def get_owner(self, path, input):
+        # Returns the node owning the request's sessions, or None if it's handled by this node
+        if not isinstance(input, dict):
+            return None
+
+        if path in self.__emailPaths__ and isinstance(input.get('email'), str):
+            return self.get_shard_owner(get_email_shard(input['email']))
+        elif path in self.__tokenPaths__:
+            return self.get_token_owner(input.get('token'))
+        return None
+
+    def get_token_owner(self, token):
+        try:
+            key = uuid.UUID(token).bytes
+        except (ValueError, TypeError, AttributeError):
+            # Malformed tokens are rejected wherever they land
+            return None
+        return self.get_shard_owner(get_key_shard(key))
+
+    def get_shard_owner(self, shard):
+        owner = self.membership[1][shard]
+        return owner if owner != self.nodeName else None
+
+    def forward(self, method, path, input, client, hops):
+        # Forwards the request to the owner of its sessions, returning the owner's (status, result), or None if it's
+        # handled by this node
+        owner = self.get_owner(path, input)
+        if owner is None or hops >= self.__maxHops__:
+            return None
+        return self.forward_request(owner, method, path, input, client, hops)
+
+    def forward_request(self, owner, method, path, input, client, hops):
+        metrics.counter('authserver_forwarded_requests_total', 'Requests forwarded to the node owning their sessions', node = owner).increment()
+        return self.send(owner, '/internal/forward', {
+            'secret' : self.secret,
+            'method' : method,
+            'path' : path,
+            'input' : input,
+            'client' : client,
+            'hops' : hops + 1
+        })
+
+    def unwrap(self, envelope):
+        # Returns the (method, path, input, client, hops) of a request forwarded by another node
+        (secret, method, path, input, client, hops) = self.__forwardSchema__.validate(envelope)
+        if not self.is_authentic(secret):
+            raise Exception('Forwarded request not authenticated')
+        return (method, path, input, client, hops)
+
+    def group_batch(self, operations, hops):
+        # Returns the indices of the batch operations owned by each node, where None is this node
+        groups = {}
+        for (index, operation) in enumerate(operations):
+            owner = None
+            if isinstance(operation, dict) and hops < self.__maxHops__:
+                owner = self.get_token_owner(operation.get('token'))
+            groups.setdefault(owner, []).append(index)
+        return groups
+
+
+    # Rebalancing Methods
+
+    def reload(self):
+        # Re-read the membership file and rebalance, on a background thread so a signal handler can call it
+        Thread(target = self.run_reload, name = 'ClusterRebalancer', daemon = True).start()
+
+    def run_reload(self):
+        try:
+            print('Handed off %d sessions' % self.rebalance(read_cluster_file(self.clusterFile)))
+        except Exception as e:
+            print('Unable to rebalance the cluster: ' + str(e))
+
+    def rebalance(self, nodes):
+        # Switch to the given membership, then hand the sessions this node no longer owns over to their owners; returns
+        # how many were handed off
+        with self.rebalanceLock:
+            self.membership = (dict(nodes), assign_shards(nodes))
+            owners = self.membership[1]
+
+            # Requests for the moved sessions are forwarded from now on, so they only change through the handoff
+            movedKeys = {}
+            for (key, _, _, _) in self.tokenManager.store.get_tokens():
+                owner = owners[get_key_shard(key)]
+                if owner != self.nodeName:
+                    movedKeys.setdefault(owner, []).append(key)
+
+            handedOffCount = 0
+            for (owner, keys) in movedKeys.items():
+                for start in range(0, len(keys), self.__handoffChunkSize__):
+                    tokens = self.tokenManager.remove_tokens(keys[start:start + self.__handoffChunkSize__])
+                    (status, result) = self.send(owner, '/internal/sessions', { 'secret' : self.secret, 'sessions' : self.encode_sessions(tokens) })
+                    if status != 200:
+                        # Keep the sessions for the next rebalance; they're unreachable meanwhile, as requests for them
+                        # are forwarded
+                        self.tokenManager.add_tokens(tokens)
+                        raise Exception('Unable to hand sessions off to node ' + owner + ': ' + str(result))
+                    handedOffCount += len(tokens)
+
+            return handedOffCount
+
+    def accept_sessions(self, secret, sessions):
+        # Add the sessions handed over by another node, returning how many were added
+        if not self.is_authentic(secret):
+            raise Exception('Handoff not authenticated')
+
+        # Times are sent as wall-clock seconds, since nodes' monotonic clocks differ
+        offset = time.time() - time.monotonic()
+        return self.tokenManager.add_tokens(
+            (self.tokenManager.get_token_key(session['token']), session['email'], session['created'] - offset, session['lastAccessed'] - offset)
+            for session in sessions)
+
+    def encode_sessions(self, tokens):
+        offset = time.time() - time.monotonic()
+        return [{
+            'token' : self.tokenManager.get_token_for_key(key),
+            'email' : email,
+            'created' : created + offset,
+            'lastAccessed' : lastAccessed + offset
+        } for (key, email, created, lastAccessed) in tokens]
+
+
+    # Utility Methods
+
+    def is_authentic(self, secret):
+        return isinstance(secret, str) and hmac.compare_digest(secret.encode('utf8'), self.secret.encode('utf8'))
+
+    def send(self, node, path, body):
+        # POST the body to the node, returning its (status, result), where the result is the reply body on success, or
+        # the error message otherwise
+        address = self.membership[0].get(node)
+        if address is None:
+            return (503, 'Node ' + node + ' not in the cluster')
+
+        payload = bytes(json.dumps(body), 'utf8')
+        while True:
+            (connection, reused) = self.get_connection(address)
+            try:
+                connection.request('POST', path, payload, { 'Content-Type' : 'application/json' })
+                response = connection.getresponse()
+                replyBody = response.read()
+                break
+            except (ConnectionResetError, BrokenPipeError):
+                # The node may have closed a kept-alive connection while it was idle, before reading the request; retry
+                # once, on a new connection
+                self.close_connection(address)
+                if not reused:
+                    return (503, 'Node ' + node + ' unavailable')
+            except (http.client.HTTPException, OSError):
+                self.close_connection(address)
+                return (503, 'Node ' + node + ' unavailable')
+
+        if response.will_close:
+            self.close_connection(address)
+
+        try:
+            result = json.loads(replyBody) if replyBody else None
+        except ValueError:
+            return (502, 'Node ' + node + ' sent a malformed reply')
+        if response.status != 200:
+            result = result.get('error') if isinstance(result, dict) else None
+        return (response.status, result)
+
+    def get_connection(self, address):
+        # Returns a connection to the address, and whether it was kept alive from an earlier request
+        connections = self.connections.__dict__.setdefault('byAddress', {})
+        connection = connections.get(address)
+        if connection is not None:
+            return (connection, True)
+
+        (host, port) = address.rsplit(':', 1)
+        if self.sslContext is not None:
+            connection = http.client.HTTPSConnection(host, int(port), timeout = self.__forwardTimeout__, context = self.sslContext)
+        else:
+            connection = http.client.HTTPConnection(host, int(port), timeout = self.__forwardTimeout__)
+        connections[address] = connection
+        return (connection, False)
+
+    def close_connection(self, address):
+        connection = self.connections.__dict__.get('byAddress', {}).pop(address, None)
+        if connection is not None:
+            connection.close()
+
+
+# Shards
+
+def get_email_shard(email):
+    return zlib.crc32(email.encode('utf8')) % shardCount
+
+def get_key_shard(key):
+    return int.from_bytes(key[:2], 'big') % shardCount
+
+def assign_shards(nodeNames):
+    # Rendezvous hashing: each shard goes to the node with the highest hash of the pair, so membership changes only move
+    # the shards gained or lost by the nodes that changed
+    def get_weight(nodeName, shard):
+        return hashlib.blake2b(b'%s:%d' % (nodeName.encode('utf8'), shard), digest_size = 8).digest()
+
+    nodeNames = sorted(nodeNames)
+    return [max(nodeNames, key = lambda nodeName: get_weight(nodeName, shard)) for shard in range(shardCount)]
+
+
+def read_cluster_file(clusterFile):
+    with open(clusterFile) as clusterInput:
+        nodes = json.load(clusterInput)
+
+    if not isinstance(nodes, dict) or not nodes or not all(isinstance(address, str) and ':' in address for address in nodes.values()):
+        raise Exception('Cluster file must map node names to host:port addresses')
+    return nodes
+
+def create_cluster_ssl_context(caFile):
+    sslContext = ssl.create_default_context(cafile = caFile)
+    # Nodes are addressed by IP, and trusted through the cluster's certificate rather than by name
+    sslContext.check_hostname = False
+    return sslContext
+
+def create_cluster_router_from_env(tokenManager, certfile, environ = os.environ):
+    # Returns the router for this node of the cluster, or None if the server runs alone
+    clusterFile = environ.get('AUTHSERVER_CLUSTER_FILE')
+    if clusterFile is None:
+        return None
+
+    nodeName = environ.get('AUTHSERVER_CLUSTER_NODE')
+    secret = environ.get('AUTHSERVER_CLUSTER_SECRET')
+    if not nodeName or not secret:
+        raise Exception('AUTHSERVER_CLUSTER_NODE and AUTHSERVER_CLUSTER_SECRET are required in a cluster')
+
+    nodes = read_cluster_file(clusterFile)
+    if nodeName not in nodes:
+        raise Exception('Node ' + nodeName + ' not in the cluster file')
+
+    return ClusterRouter(
+        tokenManager,
+        nodeName,
+        nodes,
+        secret,
+        create_cluster_ssl_context(environ.get('AUTHSERVER_CLUSTER_CA_FILE', certfile)),
+        clusterFile)
@@ -0,0 +1,44 @@
+import sqlite3
+from threading import Lock, local
+
+# Hands out one SQLite connection per thread, since sqlite3 connections may not be shared across threads
+class ConnectionPool:
+
+    # Applied to each new connection; with write-ahead logging, NORMAL sync is durable against application crashes
+    __pragmas__ = [
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA temp_store = MEMORY',
+        'PRAGMA cache_size = -16384' # 16 MB
+    ]
+
+    def __init__(self, dbfile, timeout = 5):
+        self.dbfile = dbfile
+        self.timeout = timeout
+        self.local = local()
+        self.connections = []
+        self.connectionsLock = Lock()
+
+
+    # Connection Methods
+
+    def get_connection(self):
+        # Reuse the connection already opened by this thread, if any
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # Only the owning thread uses the connection; the check is relaxed so close_all() can run from any thread
+            connection = sqlite3.connect(self.dbfile, timeout = self.timeout, check_same_thread = False)
+            for pragma in self.__pragmas__:
+                connection.execute(pragma)
+            self.local.connection = connection
+
+            # Track the connection so it can be closed on shutdown
+            with self.connectionsLock:
+                self.connections.append(connection)
+
+        return connection
+
+    def close_all(self):
+        with self.connectionsLock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
@@ -0,0 +1,59 @@
+import codecs
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+# Derives the password hash; a module-level function so it can be sent to the worker processes
+def hash_password(password, salt):
+    passwordBytes = password.encode('utf-8')
+    saltBytes = codecs.decode(salt, 'hex')
+    derived_key = hashlib.pbkdf2_hmac('sha256', passwordBytes, saltBytes, 100000)
+    return codecs.encode(derived_key, 'hex').decode('ascii')
+
+
+# Runs the CPU-bound password hashing on a pool of processes sized to the cores, with a bounded queue of pending work
+class HashingExecutor:
+
+    __submitTimeout__ = 5 # 5 seconds
+
+    def __init__(self, workerCount = None, maxQueueDepth = None):
+        self.workerCount = workerCount or os.cpu_count() or 1
+        self.maxQueueDepth = maxQueueDepth or self.workerCount * 4
+
+        # Workers are spawned rather than forked, since the server process is multi-threaded
+        self.executor = ProcessPoolExecutor(max_workers = self.workerCount, mp_context = multiprocessing.get_context('spawn'))
+        self.slots = BoundedSemaphore(self.maxQueueDepth)
+        self.queueDepth = 0
+        self.queueDepthLock = Lock()
+
+
+    # Hashing Methods
+
+    def hash_password(self, password, salt):
+        # Wait for room in the queue
+        if not self.slots.acquire(timeout = self.__submitTimeout__):
+            raise Exception('Password hashing queue is full')
+
+        with self.queueDepthLock:
+            self.queueDepth += 1
+
+        try:
+            return self.executor.submit(hash_password, password, salt).result()
+        finally:
+            with self.queueDepthLock:
+                self.queueDepth -= 1
+            self.slots.release()
+
+    def hash_passwords(self, passwords, salts):
+        # Hash many passwords at once, in chunks per worker; for bulk work, so it bypasses the request queue
+        chunkSize = max(1, len(passwords) // (self.workerCount * 4))
+        return list(self.executor.map(hash_password, passwords, salts, chunksize = chunkSize))
+
+    def get_queue_depth(self):
+        # Number of hashes queued or running
+        return self.queueDepth
+
+    def shutdown(self):
+        self.executor.shutdown(wait = True)
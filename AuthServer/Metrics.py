@@ -0,0 +1,150 @@
+import bisect
+from threading import Lock
+
+# Low-overhead counters, gauges and latency histograms, exposed in the Prometheus text format
+#
+# Histograms use fixed, exponentially sized buckets, so recording a value is a binary search and an increment
+
+
+# Counts events
+class Counter:
+
+    def __init__(self):
+        self.value = 0
+        self.lock = Lock()
+
+    def increment(self, amount = 1):
+        with self.lock:
+            self.value += amount
+
+
+# Distribution of durations, in seconds
+class Histogram:
+
+    # 50 microseconds to ~52 seconds, doubling
+    __bucketBounds__ = [0.00005 * (2 ** i) for i in range(21)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.__bucketBounds__) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.__bucketBounds__, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def get_cumulative_counts(self):
+        with self.lock:
+            counts = list(self.counts)
+        cumulative = []
+        total = 0
+        for count in counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+# Holds the metrics of each name and set of labels, rendering them on request
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.descriptions = {}
+        self.gauges = {}
+        self.lock = Lock()
+
+
+    # Metric Methods
+
+    def counter(self, name, description, **labels):
+        return self.get_metric(name, description, 'counter', Counter, labels)
+
+    def histogram(self, name, description, **labels):
+        return self.get_metric(name, description, 'histogram', Histogram, labels)
+
+    def gauge(self, name, description, getValue):
+        # Gauges are read when rendered; registering a name again replaces the earlier gauge
+        with self.lock:
+            self.descriptions[name] = (description, 'gauge')
+            self.gauges[name] = getValue
+
+
+    # Rendering Methods
+
+    def render(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+            descriptions = dict(self.descriptions)
+            gauges = dict(self.gauges)
+
+        lines = []
+        for name in sorted(descriptions):
+            (description, metricType) = descriptions[name]
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, metricType))
+
+            if metricType == 'gauge':
+                lines.append('%s %s' % (name, format_value(gauges[name]())))
+                continue
+
+            for ((metricName, labels), metric) in sorted(metrics.items(), key = lambda item: item[0]):
+                if metricName != name:
+                    continue
+
+                if metricType == 'counter':
+                    lines.append('%s%s %s' % (name, format_labels(labels), format_value(metric.value)))
+                else:
+                    cumulative = metric.get_cumulative_counts()
+                    for (bound, count) in zip(Histogram.__bucketBounds__ + ['+Inf'], cumulative):
+                        bucketLabels = labels + (('le', format_value(bound) if bound != '+Inf' else bound), )
+                        lines.append('%s_bucket%s %d' % (name, format_labels(bucketLabels), count))
+                    lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(metric.sum)))
+                    lines.append('%s_count%s %d' % (name, format_labels(labels), metric.count))
+
+        return '\n'.join(lines) + '\n'
+
+
+    # Utility Methods
+
+    def get_metric(self, name, description, metricType, metricClass, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = metricClass()
+                    self.metrics[key] = metric
+                    self.descriptions[name] = (description, metricType)
+        return metric
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for (key, value) in labels) + '}'
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Shared registry for the process
+metrics = MetricsRegistry()
+
+
+# Registers the gauges reporting on a running server's components
+def register_server_gauges(tokenManager, hashingExecutor, requestLogger):
+    metrics.gauge('authserver_live_tokens', 'Tokens currently held', lambda: tokenManager.get_expiry_stats()['liveTokens'])
+    metrics.gauge('authserver_live_users', 'Users currently holding tokens', lambda: tokenManager.get_expiry_stats()['liveUsers'])
+    metrics.gauge('authserver_evicted_tokens', 'Expired tokens evicted by the reaper', lambda: tokenManager.evictedTokenCount)
+    metrics.gauge('authserver_hashing_queue_depth', 'Password hashes queued or running', hashingExecutor.get_queue_depth)
+    metrics.gauge('authserver_dropped_log_records', 'Log records dropped while the log queue was full', lambda: requestLogger.droppedCount)
+
+def register_user_cache_gauges(userCache):
+    metrics.gauge('authserver_user_cache_hits', 'User cache lookups answered from the cache', lambda: userCache.hitCount)
+    metrics.gauge('authserver_user_cache_misses', 'User cache lookups that read the database', lambda: userCache.missCount)
+    metrics.gauge('authserver_user_cache_size', 'Users held in the user cache', lambda: len(userCache.entries))
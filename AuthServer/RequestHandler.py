@@ -23,11 +23,132 @@ class RequestHandler:
 
     def update_handler(self, name, email, password, token):
         self.tokenManager.lock_on_token(token)
-        self.userManager.update_user(name, email, password)
-        return self.tokenManager.release_update_token(token)
+        try:
+            self.userManager.update_user(name, email, password)
+        except:
+            # Don't leave the user locked if the update fails
+            self.tokenManager.release_token(token)
+            raise
+        # A password change signs the user out everywhere else
+        return self.tokenManager.release_update_token(token, password is not None)
+
+    def revocation_handler(self, token):
+        self.tokenManager.lock_on_token(token)
+        self.tokenManager.release_revoke_tokens(token)
+
+    def introspection_handler(self, token):
+        return self.tokenManager.introspect_token(token)
 
     def deletetion_handler(self, token):
         self.tokenManager.lock_on_token(token)
-        email = self.tokenManager.get_user_for_token(token)
-        self.userManager.delete_user(email)
-        self.tokenManager.delete_user(email)
\ No newline at end of file
+        try:
+            email = self.tokenManager.get_user_for_token(token)
+            self.userManager.delete_user(email)
+        except:
+            # Don't leave the user locked if the deletion fails
+            self.tokenManager.release_token(token)
+            raise
+        self.tokenManager.delete_user(email)
+
+    def batch_handler(self, operations):
+        # Operations are (verb, name, password, token) tuples, for the logout, update, and delete verbs; returns a
+        # (result, error) pair for each, where the result is the new token for updates
+        results = [(None, None)] * len(operations)
+
+        # Group the operations by user
+        userOperations = {}
+        for (index, (_, _, _, token)) in enumerate(operations):
+            try:
+                userOperations.setdefault(self.tokenManager.get_user_for_token(token), []).append(index)
+            except Exception as e:
+                results[index] = (None, e)
+
+        # Hash the new passwords in parallel, before locking any user, so the users aren't held for the hashing
+        passwordIndices = [index for indices in userOperations.values() for index in indices if operations[index][0] == 'update' and operations[index][2] is not None]
+        passwordHashes = {}
+        if passwordIndices:
+            try:
+                passwordHashes = dict(zip(passwordIndices, self.userManager.hash_new_passwords([operations[index][2] for index in passwordIndices])))
+            except Exception as e:
+                # The password updates fail, leaving the other operations
+                for index in passwordIndices:
+                    results[index] = (None, e)
+                userOperations = dict((email, [index for index in indices if index not in passwordIndices]) for (email, indices) in userOperations.items())
+
+        lockedUsers = []
+        try:
+            # Lock each user once, in a consistent order so concurrent batches can't deadlock, then verify their tokens
+            # and queue their changes
+            userBatch = self.userManager.begin_batch()
+            changes = []
+            for email in sorted(userOperations):
+                try:
+                    self.tokenManager.lock_on_user(email)
+                except Exception as e:
+                    for index in userOperations[email]:
+                        results[index] = (None, e)
+                    continue
+                lockedUsers.append(email)
+
+                # Once the user is deleted, or their password changed, which revokes their other tokens, their later
+                # operations fail before any of their changes are written; so do later operations on a token an earlier
+                # one closed or rotated
+                deleted = False
+                revoked = False
+                usedTokens = set()
+                for index in userOperations[email]:
+                    (verb, name, password, token) = operations[index]
+                    try:
+                        if deleted or revoked or token in usedTokens:
+                            raise Exception('Token ' + token + ' not found')
+                        self.tokenManager.verify_locked_token(email, token)
+                    except Exception as e:
+                        results[index] = (None, e)
+                        continue
+
+                    usedTokens.add(token)
+                    if verb == 'update':
+                        changes.append((index, email, userBatch.update_user(name, email, password, passwordHashes.get(index))))
+                        revoked = password is not None
+                    elif verb == 'delete':
+                        changes.append((index, email, userBatch.delete_user(email)))
+                        deleted = True
+                    else:
+                        changes.append((index, email, None))
+
+            # Commit the user changes in one transaction; if that fails, every change fails
+            try:
+                errors = userBatch.commit()
+                commitError = None
+            except Exception as e:
+                commitError = e
+
+            # Apply the token changes, where the user changes succeeded
+            for (index, email, change) in changes:
+                (verb, _, password, token) = operations[index]
+                error = None
+                if change is not None:
+                    error = commitError or errors[change]
+
+                if error is not None:
+                    results[index] = (None, error)
+                    continue
+
+                # Each change fails on its own, as its token may have been rotated or closed by an earlier operation
+                try:
+                    if verb == 'update':
+                        results[index] = (self.tokenManager.update_locked_token(token, password is not None), None)
+                    elif verb == 'delete':
+                        # Deleting the user releases the lock on them, even if it fails
+                        lockedUsers.remove(email)
+                        self.tokenManager.delete_user(email)
+                    else:
+                        self.tokenManager.close_locked_token(token)
+                except Exception as e:
+                    results[index] = (None, e)
+
+        finally:
+            for email in lockedUsers:
+                self.tokenManager.release_on_user(email)
+
+        return results
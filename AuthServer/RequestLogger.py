@@ -0,0 +1,120 @@
+import sys
+import json
+import queue
+import random
+import re
+import time
+from threading import Thread
+
+# Structured request logging off the request path; request threads enqueue records, and a background writer thread
+# batches them out as JSON lines, to a file or stdout
+class RequestLogger:
+
+    __redactedFields__ = frozenset(['password', 'token', 'secret'])
+    # Session tokens are UUIDs; signed tokens are unpadded urlsafe base64, of at least 71 characters
+    __tokenPattern__ = re.compile('[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[A-Za-z0-9_-]{64,}')
+    __maxQueueSize__ = 65536
+    __maxBatchSize__ = 512
+
+    def __init__(self, logfile = None, sampleRates = None, defaultSampleRate = 1.0):
+        # Requests to each endpoint are logged at its sample rate (0 to 1); failed requests are always logged
+        self.logfile = logfile
+        self.sampleRates = sampleRates or {}
+        self.defaultSampleRate = defaultSampleRate
+        self.records = queue.Queue(self.__maxQueueSize__)
+        self.droppedCount = 0
+
+        self.writerThread = Thread(target = self.run_writer, name = 'RequestLogger', daemon = True)
+        self.writerThread.start()
+
+
+    # Logging Methods
+
+    def log_request(self, method, path, status, duration, input = None, error = None):
+        # Successful requests are sampled
+        if status == 200:
+            sampleRate = self.sampleRates.get(path, self.defaultSampleRate)
+            if sampleRate < 1 and random.random() >= sampleRate:
+                return
+
+        record = {
+            'event' : 'request',
+            'method' : method,
+            'path' : path,
+            'status' : status,
+            'durationMs' : round(duration * 1000, 3)
+        }
+        if isinstance(input, dict):
+            record['input'] = self.redact(input)
+        if error is not None:
+            # Error messages may quote the token
+            record['error'] = self.__tokenPattern__.sub('[REDACTED]', str(error))
+
+        self.enqueue(record)
+
+    def log(self, event, **fields):
+        # Unsampled records, for events outside of requests
+        record = { 'event' : event }
+        record.update(self.redact(fields))
+        self.enqueue(record)
+
+    def shutdown(self):
+        # Flush the queued records, then stop the writer
+        self.records.put(None)
+        self.writerThread.join()
+
+
+    # Writer Thread Methods
+
+    def run_writer(self):
+        output = open(self.logfile, 'a') if self.logfile is not None else sys.stdout
+        try:
+            while True:
+                # Wait for a record, then drain whatever else is queued, up to a batch
+                batch = [self.records.get()]
+                while len(batch) < self.__maxBatchSize__ and batch[-1] is not None:
+                    try:
+                        batch.append(self.records.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stopping = batch[-1] is None
+                lines = [json.dumps(record) for record in batch if record is not None]
+                if lines:
+                    output.write('\n'.join(lines) + '\n')
+                    output.flush()
+
+                if stopping:
+                    return
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+
+    # Utility Methods
+
+    def enqueue(self, record):
+        # Never block a request on logging; when the writer falls behind, records are dropped and counted
+        record['time'] = time.time()
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.droppedCount += 1
+
+    def redact(self, fields):
+        # Nested inputs, e.g. batch operations, are redacted too
+        if isinstance(fields, list):
+            return [self.redact(value) for value in fields]
+        if not isinstance(fields, dict):
+            return fields
+        return { key : ('[REDACTED]' if key in self.__redactedFields__ else self.redact(value)) for (key, value) in fields.items() }
+
+
+# Parses sample rates given as comma-separated <path>=<rate> pairs, e.g. "/login=0.1,/update=0.01"
+def parse_sample_rates(text):
+    sampleRates = {}
+    for pair in (text or '').split(','):
+        if '=' in pair:
+            (path, rate) = pair.split('=', 1)
+            sampleRates[path.strip()] = float(rate)
+    return sampleRates
@@ -0,0 +1,133 @@
+import os
+import random
+import sys
+from threading import Event, Lock, Thread, get_ident
+
+# Opt-in stack sampling profiler for live requests; toggled at runtime, so latency spikes can be looked into without a
+# restart. While enabled, a fraction of requests are sampled: a background thread periodically records the stacks of
+# the threads handling them, collapsed into flamegraph-ready lines of "<endpoint>;<category>;<frames...> <count>".
+#
+# Each sample is attributed to the innermost category on its stack: hashing, sql, UserManager, TokenManager, or
+# RequestHandler (or other, for the routing and validation around them)
+class RequestProfiler:
+
+    __defaultSampleRate__ = 0.1
+    __sampleInterval__ = 0.005 # 5 milliseconds
+
+    # Categories of the innermost frames, by module; the SQL-issuing UserManager methods are told apart by name
+    __moduleCategories__ = {
+        'HashingExecutor' : 'hashing',
+        'UserWriter' : 'sql',
+        'UserManager' : 'UserManager',
+        'TokenManager' : 'TokenManager',
+        'RequestHandler' : 'RequestHandler'
+    }
+    __sqlFunctions__ = frozenset(['UserManager.write', 'UserManager.write_many', 'UserManager.get_user_count', 'UserManager.get_user_row'])
+
+    def __init__(self, sampleRate = None, profileFile = None):
+        self.sampleRate = sampleRate if sampleRate is not None else self.__defaultSampleRate__
+        self.enabled = False
+
+        # File the stacks are written to when toggled off; not written when not given
+        self.profileFile = profileFile
+
+        # Thread ID to endpoint, for each request being sampled
+        self.activeRequests = {}
+        self.stackCounts = {}
+        self.lock = Lock()
+        self.samplerThread = None
+        self.samplerStopped = Event()
+
+
+    # Control Methods
+
+    def start(self, sampleRate = None):
+        # Start sampling, discarding the stacks from any earlier run
+        self.stop()
+        if sampleRate is not None:
+            self.sampleRate = sampleRate
+        with self.lock:
+            self.stackCounts = {}
+
+        self.samplerStopped.clear()
+        self.samplerThread = Thread(target = self.run_sampler, name = 'RequestProfiler', daemon = True)
+        self.samplerThread.start()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+        self.samplerStopped.set()
+        if self.samplerThread is not None:
+            self.samplerThread.join()
+            self.samplerThread = None
+        self.activeRequests.clear()
+
+    def toggle(self):
+        # For signal handlers; writes the stacks out when stopping
+        if self.enabled:
+            self.stop()
+            if self.profileFile is not None:
+                with open(self.profileFile, 'w') as output:
+                    output.write(self.render())
+        else:
+            self.start()
+
+
+    # Request Methods
+
+    def begin_request(self, endpoint):
+        # Returns whether the request is sampled, in which case end_request must follow
+        if not self.enabled or random.random() >= self.sampleRate:
+            return False
+        self.activeRequests[get_ident()] = endpoint
+        return True
+
+    def end_request(self):
+        self.activeRequests.pop(get_ident(), None)
+
+
+    # Sampling Methods
+
+    def run_sampler(self):
+        while not self.samplerStopped.wait(self.__sampleInterval__):
+            self.take_sample()
+
+    def take_sample(self):
+        frames = sys._current_frames()
+        for (threadId, endpoint) in list(self.activeRequests.items()):
+            frame = frames.get(threadId)
+            if frame is None:
+                continue
+
+            stack = self.collapse_stack(endpoint, frame)
+            with self.lock:
+                self.stackCounts[stack] = self.stackCounts.get(stack, 0) + 1
+
+    def collapse_stack(self, endpoint, frame):
+        # Frames from the router's dispatch inwards, outermost first
+        names = []
+        category = None
+        while frame is not None:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            name = module + '.' + code.co_qualname if module != code.co_qualname.split('.')[0] else code.co_qualname
+            names.append(name)
+
+            if category is None:
+                if name in self.__sqlFunctions__:
+                    category = 'sql'
+                else:
+                    category = self.__moduleCategories__.get(module)
+
+            if name == 'RequestRouter.dispatch':
+                break
+            frame = frame.f_back
+
+        names.reverse()
+        return ';'.join([endpoint, category or 'other'] + names)
+
+    def render(self):
+        # Collapsed stacks, as taken by flamegraph.pl or speedscope
+        with self.lock:
+            stackCounts = dict(self.stackCounts)
+        return ''.join('%s %d\n' % (stack, count) for (stack, count) in sorted(stackCounts.items()))
@@ -0,0 +1,238 @@
+import time
+from AuthServer.Metrics import metrics
+from AuthServer.RequestSchema import FieldSpec, RequestSchema, registerSchema, validate_batch_operations, validate_email, validate_password
+
+# Routes parsed requests to the request handler, validating the input for each endpoint; shared by the server engines
+class RequestRouter:
+
+    # Input schemas for each endpoint
+    __registerSchema__ = registerSchema
+    __loginSchema__ = RequestSchema(FieldSpec('email', validate_email), FieldSpec('password', validate_password))
+    __tokenSchema__ = RequestSchema(FieldSpec('token'))
+    __emptySchema__ = RequestSchema()
+    __localClients__ = frozenset(['127.0.0.1', '::1'])
+    __updateSchema__ = RequestSchema(
+        FieldSpec('name', required = False),
+        FieldSpec('email', validate_email, required = False),
+        FieldSpec('password', validate_password, required = False),
+        FieldSpec('token'))
+    __profileSchema__ = RequestSchema(
+        FieldSpec('enabled', lambda enabled: isinstance(enabled, bool)),
+        FieldSpec('sampleRate', lambda sampleRate: isinstance(sampleRate, (int, float)) and 0 < sampleRate <= 1, required = False))
+    __batchSchema__ = RequestSchema(FieldSpec('operations', validate_batch_operations))
+    __batchOperationSchema__ = RequestSchema(
+        FieldSpec('op', lambda verb: verb in ('logout', 'update', 'delete')),
+        FieldSpec('name', required = False),
+        FieldSpec('password', validate_password, required = False),
+        FieldSpec('token'))
+    __sessionsSchema__ = RequestSchema(FieldSpec('secret'), FieldSpec('sessions', lambda sessions: isinstance(sessions, list)))
+
+    def __init__(self, requestHandler, requestLogger = None, admissionController = None, requestProfiler = None, clusterRouter = None):
+        self.requestHandler = requestHandler
+
+        # Requests go unlogged when no logger is given
+        self.requestLogger = requestLogger
+
+        # Requests are all admitted when no admission controller is given
+        self.admissionController = admissionController
+
+        # Profiling is unavailable when no profiler is given
+        self.requestProfiler = requestProfiler
+
+        # Every request is handled here when not in a cluster
+        self.clusterRouter = clusterRouter
+
+        # Route table of (method, path) to (input schema, handler); handlers take the validated input values in schema
+        # order, and return the reply body
+        self.routes = {
+            ('POST', '/register') : (self.__registerSchema__, self.handle_register),
+            ('POST', '/login') : (self.__loginSchema__, self.handle_login),
+            ('POST', '/logout') : (self.__tokenSchema__, self.handle_logout),
+            ('POST', '/revoke') : (self.__tokenSchema__, self.handle_revoke),
+            ('POST', '/update') : (self.__updateSchema__, self.handle_update),
+            ('DELETE', '/delete') : (self.__tokenSchema__, self.handle_delete),
+            ('POST', '/batch') : (self.__batchSchema__, self.handle_batch),
+            ('POST', '/introspect') : (self.__tokenSchema__, self.handle_introspect),
+            ('GET', '/metrics') : (self.__emptySchema__, self.handle_metrics),
+            ('GET', '/admin/profile') : (self.__emptySchema__, self.handle_get_profile),
+            ('POST', '/admin/profile') : (self.__profileSchema__, self.handle_set_profile)
+        }
+
+        # Sessions handed over by other nodes when the cluster is rebalanced
+        if clusterRouter is not None:
+            self.routes[('POST', '/internal/sessions')] = (self.__sessionsSchema__, self.handle_sessions)
+
+        # Request metrics for each route; unknown requests share one set, so arbitrary paths can't create new series
+        self.requestTimes = {}
+        for (method, path) in list(self.routes) + [('', 'unknown')]:
+            self.requestTimes[(method, path)] = metrics.histogram('authserver_request_seconds', 'Time spent handling requests', method = method, path = path)
+
+
+    # Routing Methods
+
+    def route(self, method, path, input, client = None):
+        # Returns a (status, result) pair; the result is a reply body on success, or an error message otherwise
+
+        # Requests forwarded by another node of the cluster are handled as if they were received directly
+        hops = 0
+        if self.clusterRouter is not None and (method, path) == ('POST', '/internal/forward'):
+            try:
+                (method, path, input, client, hops) = self.clusterRouter.unwrap(input)
+            except Exception as e:
+                return (403, e.args[0])
+
+        routeKey = (method, path) if (method, path) in self.routes else ('', 'unknown')
+        profiled = self.requestProfiler is not None and self.requestProfiler.begin_request(routeKey[1])
+
+        startTime = time.perf_counter()
+        try:
+            (status, result) = self.dispatch(method, path, input, client, hops)
+        finally:
+            if profiled:
+                self.requestProfiler.end_request()
+        duration = time.perf_counter() - startTime
+
+        # Record the request
+        self.requestTimes[routeKey].observe(duration)
+        metrics.counter('authserver_requests_total', 'Requests handled', method = routeKey[0], path = routeKey[1], status = status).increment()
+
+        if self.requestLogger is not None:
+            self.requestLogger.log_request(method, path, status, duration, input, result if status != 200 else None)
+
+        return (status, result)
+
+    def dispatch(self, method, path, input, client = None, hops = 0):
+        route = self.routes.get((method, path))
+        if route is None:
+            return (404, 'Unknown request ' + method + ' ' + path)
+
+        # Admin endpoints are only served to local clients
+        if path.startswith('/admin/') and client is not None and client not in self.__localClients__:
+            return (403, 'Admin requests are only accepted locally')
+
+        # In a cluster, requests for sessions owned by another node are forwarded to it, leaving admission control to
+        # the owner, and batches are split between the owners of their operations
+        if self.clusterRouter is not None:
+            if path == '/batch':
+                forwarded = self.dispatch_batch(input, client, hops)
+            else:
+                forwarded = self.clusterRouter.forward(method, path, input, client, hops)
+            if forwarded is not None:
+                return forwarded
+
+        # Shed requests over their rate limits, or beyond the hashing budget
+        if self.admissionController is not None:
+            rejection = self.admissionController.admit(path, client, input)
+            if rejection is not None:
+                return rejection
+
+        (schema, handler) = route
+        try:
+            return (200, handler(*schema.validate(input)))
+        except Exception as e:
+            return (400, e.args[0] if e.args else 'Unable to handle request')
+        finally:
+            if self.admissionController is not None:
+                self.admissionController.release(path, input)
+
+    def dispatch_batch(self, input, client, hops):
+        # Returns the results of a batch spanning several nodes, or None if this node owns every operation; the whole
+        # batch is validated first, as each of its groups is within the size limit
+        try:
+            (operations, ) = self.__batchSchema__.validate(input)
+        except Exception as e:
+            return (400, e.args[0] if e.args else 'Unable to handle request')
+
+        groups = self.clusterRouter.group_batch(operations, hops)
+        if list(groups) == [None]:
+            return None
+
+        results = [None] * len(operations)
+        for (owner, indices) in groups.items():
+            groupInput = { 'operations' : [operations[index] for index in indices] }
+            if owner is None:
+                (status, result) = self.dispatch('POST', '/batch', groupInput, client, hops)
+            else:
+                (status, result) = self.clusterRouter.forward_request(owner, 'POST', '/batch', groupInput, client, hops)
+
+            # A failed group fails each of its operations
+            groupResults = result['results'] if status == 200 else [{ 'error' : result }] * len(indices)
+            for (index, groupResult) in zip(indices, groupResults):
+                results[index] = groupResult
+
+        return (200, { 'results' : results })
+
+
+    # Endpoint Handler Methods
+
+    def handle_register(self, name, email, password):
+        self.requestHandler.registration_handler(name, email, password)
+
+    def handle_login(self, email, password):
+        return { 'token' : self.requestHandler.login_handler(email, password) }
+
+    def handle_logout(self, token):
+        self.requestHandler.logout_handler(token)
+
+    def handle_revoke(self, token):
+        self.requestHandler.revocation_handler(token)
+
+    def handle_update(self, name, email, password, token):
+        return { 'token' : self.requestHandler.update_handler(name, email, password, token) }
+
+    def handle_delete(self, token):
+        self.requestHandler.deletetion_handler(token)
+
+    def handle_introspect(self, token):
+        # Invalid tokens aren't an error, just inactive
+        introspection = self.requestHandler.introspection_handler(token)
+        if introspection is None:
+            return { 'active' : False }
+
+        (email, expiresIn) = introspection
+        return { 'active' : True, 'email' : email, 'expiresIn' : int(expiresIn) }
+
+    def handle_batch(self, operations):
+        # Each operation is validated and handled on its own, so one bad operation doesn't fail the rest
+        results = [None] * len(operations)
+        indices = []
+        validOperations = []
+        for (index, operation) in enumerate(operations):
+            try:
+                validOperations.append(self.__batchOperationSchema__.validate(operation))
+                indices.append(index)
+            except Exception as e:
+                results[index] = { 'error' : e.args[0] }
+
+        for (index, (result, error)) in zip(indices, self.requestHandler.batch_handler(validOperations)):
+            if error is not None:
+                results[index] = { 'error' : error.args[0] if error.args else 'Unable to handle operation' }
+            elif result is not None:
+                results[index] = { 'token' : result }
+            else:
+                results[index] = {}
+
+        return { 'results' : results }
+
+    def handle_sessions(self, secret, sessions):
+        return { 'added' : self.clusterRouter.accept_sessions(secret, sessions) }
+
+    def handle_metrics(self):
+        # Plain text, in the Prometheus exposition format
+        return metrics.render()
+
+    def handle_get_profile(self):
+        # Plain text, as collapsed stacks
+        if self.requestProfiler is None:
+            raise Exception('Profiling is not available')
+        return self.requestProfiler.render()
+
+    def handle_set_profile(self, enabled, sampleRate):
+        if self.requestProfiler is None:
+            raise Exception('Profiling is not available')
+
+        if enabled:
+            self.requestProfiler.start(sampleRate)
+        else:
+            self.requestProfiler.stop()
+        return { 'enabled' : self.requestProfiler.enabled, 'sampleRate' : self.requestProfiler.sampleRate }
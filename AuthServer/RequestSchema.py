@@ -0,0 +1,82 @@
+import re
+
+# Declarative input validation for requests; schemas and their patterns are built once, then applied to each request
+
+
+# A single input field, with an optional validator applied to its value
+class FieldSpec:
+
+    def __init__(self, name, validator = None, required = True):
+        self.name = name
+        self.validator = validator
+        self.required = required
+        self.errorMessage = 'Unable to retrieve ' + name + ' from input'
+
+    def validate(self, input):
+        if self.name in input:
+            value = input[self.name]
+            if self.validator is not None and not self.validator(value):
+                raise Exception(self.errorMessage)
+            return value
+        elif self.required:
+            raise Exception(self.errorMessage)
+        else:
+            return None
+
+
+# The fields of a request, validated together into a tuple of values in field order
+class RequestSchema:
+
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def validate(self, input):
+        if not isinstance(input, dict):
+            input = {}
+        return tuple(field.validate(input) for field in self.fields)
+
+
+# Validators
+
+maxBatchOperations = 100
+
+# Regex pattern taken from https://emailregex.com
+emailPattern = re.compile("^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\\.[a-zA-Z0-9-.]+$")
+
+lowercaseCharacters = frozenset('abcdefghijklmnopqrstuvwxyz')
+uppercaseCharacters = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+# Same set as the original [,.:;?!@#$%&-_+=] class, in which &-_ is a range (so it also spans digits and uppercase letters)
+specialCharacters = frozenset(',.:;?!@#$%+=' + ''.join(chr(c) for c in range(ord('&'), ord('_') + 1)))
+
+def validate_email(email):
+    return isinstance(email, str) and emailPattern.match(email) is not None
+
+def validate_batch_operations(operations):
+    return isinstance(operations, list) and 0 < len(operations) <= maxBatchOperations
+
+def validate_password(password):
+    # Password should be mimimum of 16 characters
+    if not isinstance(password, str) or len(password) < 16:
+        return False
+
+    # Password should contain at least one lowercase letter, one uppercase letter, one (unicode) digit, and one special
+    # character; checked in a single pass
+    hasLowercase = hasUppercase = hasDigit = hasSpecial = False
+    for character in password:
+        if character in lowercaseCharacters:
+            hasLowercase = True
+        elif character in uppercaseCharacters:
+            hasUppercase = True
+        elif character.isdecimal():
+            hasDigit = True
+
+        if character in specialCharacters:
+            hasSpecial = True
+
+    return hasLowercase and hasUppercase and hasDigit and hasSpecial
+
+
+# Schemas shared outside the router; registrations are also validated by the bulk importer
+
+registerSchema = RequestSchema(FieldSpec('name'), FieldSpec('email', validate_email), FieldSpec('password', validate_password))
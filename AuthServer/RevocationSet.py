@@ -0,0 +1,214 @@
+import heapq
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+from threading import Lock
+
+# Revocations of signed tokens, which are otherwise valid until they expire; see SignedTokenManager
+#
+# Each entry maps a 16 byte key to a value, until the entry's expiry: once every token it could reject has expired, the
+# entry is dropped. Entries are dropped by the reaper, and only need to outlive the tokens they reject, so an expired
+# entry may still be read meanwhile. Times are wall-clock seconds, as signed tokens carry them.
+class RevocationSet:
+
+    def __init__(self):
+        self.entries = {}
+
+        # Expiries of the entries, as (expiry, key), oldest first; an entry replaced with a later expiry leaves its old
+        # one queued, which is skipped
+        self.expiries = []
+        self.lock = Lock()
+
+    def close(self):
+        pass
+
+    def revoke(self, key, value, expiry):
+        with self.lock:
+            self.entries[key] = (value, expiry)
+            heapq.heappush(self.expiries, (expiry, key))
+
+    def get(self, key):
+        # Returns the value of the key's entry, or None; dict lookups are atomic, so no lock is needed
+        entry = self.entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def purge(self, now, maxCount):
+        # Drop up to the given number of expired entries, returning how many were dropped
+        purgedCount = 0
+        with self.lock:
+            while self.expiries and self.expiries[0][0] <= now and purgedCount < maxCount:
+                (expiry, key) = heapq.heappop(self.expiries)
+                entry = self.entries.get(key)
+                if entry is not None and entry[1] == expiry:
+                    del self.entries[key]
+                    purgedCount += 1
+
+        return purgedCount
+
+    def get_count(self):
+        return len(self.entries)
+
+
+# Revocations held in shared memory, for worker processes forked from the one creating the set; see SharedSessionStore,
+# whose table layout this follows, in a single open-addressing table of entries split into segments. Entries are read
+# and written under their segment's lock.
+
+entrySlot = struct.Struct('<B7x16sdd') # state, key, value, expiry
+uint32 = struct.Struct('<I')
+
+# Offsets of the entry slot fields
+entryStateOffset = 0
+entryKeyOffset = 8
+
+# Slot states; freed slots are marked deleted, so probes for other entries continue past them
+emptySlot = 0
+usedSlot = 1
+deletedSlot = 2
+
+
+class SharedRevocationSet:
+
+    __purgeScanSize__ = 16384 # Entry slots scanned for expired entries per call
+
+    def __init__(self, capacity = 1 << 18, segmentCount = 64):
+        self.segmentCount = segmentCount
+        self.segmentSize = -(-capacity // segmentCount)
+        self.capacity = self.segmentSize * segmentCount
+
+        # Laid out as the entry count of each segment, then the entry slots
+        self.segmentCounts = struct.Struct('<%dI' % segmentCount)
+        self.entriesOffset = (self.segmentCounts.size + 7) // 8 * 8
+
+        # New shared memory is zeroed, i.e. all the slots are empty
+        self.memory = shared_memory.SharedMemory(create = True, size = self.entriesOffset + self.capacity * entrySlot.size)
+        self.buffer = self.memory.buf
+        self.creatorProcess = os.getpid()
+
+        # Inherited by the worker processes, which must be forked
+        self.locks = [multiprocessing.get_context('fork').Lock() for _ in range(segmentCount)]
+
+        # Per process
+        self.purgeCursor = 0
+
+    def close(self):
+        # Detach from the shared memory, which the creating process then frees
+        self.buffer = None
+        self.memory.close()
+        if os.getpid() == self.creatorProcess:
+            self.memory.unlink()
+
+    def revoke(self, key, value, expiry):
+        # When the segment is full, an expired entry the reaper hasn't dropped yet is replaced
+        (segment, start) = self.get_position(key)
+        now = time.time()
+        with self.locks[segment]:
+            freeIndex = None
+            expiredIndex = None
+            for index in self.probe(segment, start):
+                offset = self.get_entry_offset(index)
+                state = self.buffer[offset + entryStateOffset]
+                if state == emptySlot:
+                    if freeIndex is None:
+                        freeIndex = index
+                    break
+                if state == deletedSlot:
+                    if freeIndex is None:
+                        freeIndex = index
+                elif self.buffer[offset + entryKeyOffset:offset + entryKeyOffset + 16] == key:
+                    entrySlot.pack_into(self.buffer, offset, usedSlot, key, value, expiry)
+                    return
+                elif expiredIndex is None and entrySlot.unpack_from(self.buffer, offset)[3] <= now:
+                    expiredIndex = index
+
+            if freeIndex is not None:
+                entrySlot.pack_into(self.buffer, self.get_entry_offset(freeIndex), usedSlot, key, value, expiry)
+                self.add_segment_count(segment, 1)
+            elif expiredIndex is not None:
+                entrySlot.pack_into(self.buffer, self.get_entry_offset(expiredIndex), usedSlot, key, value, expiry)
+            else:
+                raise Exception('Revocation set is full')
+
+    def get(self, key):
+        (segment, start) = self.get_position(key)
+        with self.locks[segment]:
+            index = self.find_entry(key, segment, start)
+            if index is None:
+                return None
+            return entrySlot.unpack_from(self.buffer, self.get_entry_offset(index))[2]
+
+    def purge(self, now, maxCount):
+        # Scan the next part of the table; an entry is dropped within a full pass of the reaper over the table
+        purgedCount = 0
+        for _ in range(min(self.__purgeScanSize__, self.capacity)):
+            index = self.purgeCursor
+            self.purgeCursor = (self.purgeCursor + 1) % self.capacity
+
+            segment = index // self.segmentSize
+            offset = self.get_entry_offset(index)
+            with self.locks[segment]:
+                (state, _, _, expiry) = entrySlot.unpack_from(self.buffer, offset)
+                if state != usedSlot or expiry > now:
+                    continue
+
+                self.buffer[offset + entryStateOffset] = deletedSlot
+                self.clear_deleted_slots(index, segment)
+                self.add_segment_count(segment, -1)
+
+            purgedCount += 1
+            if purgedCount >= maxCount:
+                break
+
+        return purgedCount
+
+    def get_count(self):
+        return sum(self.segmentCounts.unpack_from(self.buffer, 0))
+
+
+    # Entry Slot Methods; called under the segment's lock
+
+    def find_entry(self, key, segment, start):
+        for index in self.probe(segment, start):
+            offset = self.get_entry_offset(index)
+            state = self.buffer[offset + entryStateOffset]
+            if state == emptySlot:
+                return None
+            if state == usedSlot and self.buffer[offset + entryKeyOffset:offset + entryKeyOffset + 16] == key:
+                return index
+
+        return None
+
+    def clear_deleted_slots(self, index, segment):
+        # As in SharedSessionStore: a deleted slot followed by an empty one ends every probe through it, so it can be
+        # emptied, along with any deleted slots before it
+        segmentStart = segment * self.segmentSize
+        position = index - segmentStart
+        if self.buffer[self.get_entry_offset(segmentStart + (position + 1) % self.segmentSize) + entryStateOffset] != emptySlot:
+            return
+
+        for _ in range(self.segmentSize):
+            offset = self.get_entry_offset(segmentStart + position)
+            if self.buffer[offset + entryStateOffset] != deletedSlot:
+                break
+            self.buffer[offset + entryStateOffset] = emptySlot
+            position = (position - 1) % self.segmentSize
+
+    def add_segment_count(self, segment, change):
+        offset = segment * uint32.size
+        uint32.pack_into(self.buffer, offset, uint32.unpack_from(self.buffer, offset)[0] + change)
+
+
+    # Utility Methods
+
+    def get_position(self, key):
+        # Returns the segment of the key, and the slot its probe starts from
+        hash = int.from_bytes(key, 'little')
+        return (hash % self.segmentCount, (hash // self.segmentCount) % self.segmentSize)
+
+    def probe(self, segment, start):
+        for probe in range(self.segmentSize):
+            yield segment * self.segmentSize + (start + probe) % self.segmentSize
+
+    def get_entry_offset(self, index):
+        return self.entriesOffset + index * entrySlot.size
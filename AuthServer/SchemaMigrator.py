@@ -0,0 +1,61 @@
+# Owns the database schema; brings the database up to the latest schema version at startup, migrating it in place
+class SchemaMigrator:
+
+    # Migrations are applied in order, each in its own transaction; the schema version is kept in PRAGMA user_version
+    __migrations__ = [
+        (1, 'Create the Users table', [
+            'CREATE TABLE IF NOT EXISTS Users (Name TEXT, Email TEXT, PasswordHash TEXT, PasswordSalt TEXT)'
+        ]),
+        (2, 'Index the Users table by email, moving any duplicate users to UsersDuplicates first', [
+            'CREATE TABLE IF NOT EXISTS UsersDuplicates (Name TEXT, Email TEXT, PasswordHash TEXT, PasswordSalt TEXT)',
+            'INSERT INTO UsersDuplicates SELECT * FROM Users WHERE rowid NOT IN (SELECT MIN(rowid) FROM Users GROUP BY Email)',
+            'DELETE FROM Users WHERE rowid NOT IN (SELECT MIN(rowid) FROM Users GROUP BY Email)',
+            'CREATE UNIQUE INDEX IF NOT EXISTS UsersEmailIndex ON Users (Email)'
+        ])
+    ]
+
+    def __init__(self, db):
+        self.db = db
+
+
+    # Migration Methods
+
+    def migrate(self):
+        # Write-ahead logging lets readers proceed alongside the writer; the mode persists in the database file
+        self.db.execute('PRAGMA journal_mode = WAL')
+
+        # Apply the pending migrations, returning the ones applied
+        applied = []
+        for (version, description, statements) in self.__migrations__:
+            if version <= self.get_version():
+                continue
+
+            # Take the write lock up front, so concurrent servers starting up don't both apply the migration. Migrations
+            # only delete rows they've copied aside, which are counted, so the move is reported
+            self.db.execute('BEGIN IMMEDIATE')
+            deletedCount = 0
+            try:
+                if version > self.get_version():
+                    for statement in statements:
+                        cursor = self.db.execute(statement)
+                        if statement.startswith('DELETE'):
+                            deletedCount += cursor.rowcount
+                    self.db.execute('PRAGMA user_version = %d' % version)
+                self.db.execute('COMMIT')
+            except:
+                self.db.execute('ROLLBACK')
+                raise
+
+            print('Applied schema migration %d: %s' % (version, description))
+            if deletedCount > 0:
+                print('Schema migration %d moved %d row(s) aside' % (version, deletedCount))
+            applied.append(version)
+
+        return applied
+
+    def get_version(self):
+        (version, ) = self.db.execute('PRAGMA user_version').fetchone()
+        return version
+
+    def get_latest_version(self):
+        return self.__migrations__[-1][0]
@@ -0,0 +1,54 @@
+import os
+import ssl
+
+# Builds the server's TLS context: TLS 1.2 or later, forward-secret (ECDHE) ciphers only, and session resumption
+# through tickets and the session cache, so reconnecting clients skip the full handshake
+#
+# Configured through environment variables:
+#   AUTHSERVER_SSL_KEY_PASSWORD: the SSL key file password
+#   AUTHSERVER_SSL_KEY_PASSWORD_FILE: a file holding the SSL key file password, used when the password isn't set directly
+#   AUTHSERVER_SSL_CIPHERS: the TLS 1.2 cipher list, in OpenSSL format
+#   AUTHSERVER_SSL_TICKET_COUNT: the number of TLS 1.3 session tickets issued per handshake
+
+defaultCiphers = 'ECDHE+AESGCM:ECDHE+CHACHA20'
+defaultTicketCount = 2
+
+
+def create_ssl_context(certfile, keyfile, password = None, ciphers = None, ticketCount = None):
+    sslContext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    sslContext.minimum_version = ssl.TLSVersion.TLSv1_2
+
+    # Prefer the server's cipher order, and only allow ECDHE key exchange; TLS 1.3 suites are all forward-secret
+    sslContext.set_ciphers(ciphers or defaultCiphers)
+    sslContext.options |= ssl.OP_CIPHER_SERVER_PREFERENCE | ssl.OP_NO_COMPRESSION
+
+    # Enable resumption, through session tickets and the server-side session cache
+    sslContext.options &= ~ssl.OP_NO_TICKET
+    sslContext.num_tickets = defaultTicketCount if ticketCount is None else ticketCount
+
+    # Without a password, OpenSSL prompts for one if the key is encrypted
+    sslContext.load_cert_chain(certfile, keyfile, password)
+
+    return sslContext
+
+def create_ssl_context_from_env(certfile, keyfile, environ = os.environ):
+    ticketCount = environ.get('AUTHSERVER_SSL_TICKET_COUNT')
+    return create_ssl_context(
+        certfile,
+        keyfile,
+        read_key_password(environ),
+        environ.get('AUTHSERVER_SSL_CIPHERS'),
+        int(ticketCount) if ticketCount else None)
+
+def read_key_password(environ = os.environ):
+    # Returns the key password from the environment, or None when it isn't configured
+    password = environ.get('AUTHSERVER_SSL_KEY_PASSWORD')
+    if password is not None:
+        return password
+
+    passwordFile = environ.get('AUTHSERVER_SSL_KEY_PASSWORD_FILE')
+    if passwordFile is not None:
+        with open(passwordFile) as passwordInput:
+            return passwordInput.read().rstrip('\r\n')
+
+    return None
@@ -0,0 +1,120 @@
+import sys
+import os
+from AuthServer.AdmissionControl import create_admission_controller_from_env
+from AuthServer.ClusterRouter import create_cluster_router_from_env
+from AuthServer.ConnectionPool import ConnectionPool
+from AuthServer.HashingExecutor import HashingExecutor
+from AuthServer.Metrics import metrics, register_server_gauges, register_user_cache_gauges
+from AuthServer.RequestLogger import RequestLogger, parse_sample_rates
+from AuthServer.RequestProfiler import RequestProfiler
+from AuthServer.SchemaMigrator import SchemaMigrator
+from AuthServer.ServerSSLContext import create_ssl_context_from_env
+from AuthServer.SessionSnapshot import create_session_snapshotter_from_env
+from AuthServer.SignedTokenManager import create_signed_token_manager_from_env
+from AuthServer.TokenManager import TokenManager
+from AuthServer.UserCache import UserCache
+from AuthServer.UserManager import UserManager
+from AuthServer.UserWriter import UserWriter
+from AuthServer.WorkerProcesses import create_session_store_from_env, get_process_count, run_worker_processes
+from AuthServer.RequestHandler import RequestHandler
+from AuthServer.RequestRouter import RequestRouter
+
+# Server setup shared by the engines: the sessions, the worker processes, the user database, and the request router with
+# everything it relies on. The engines add their own listening socket and signal handling.
+class ServerComponents:
+
+    def __init__(self, dbfile, keyfile, certfile, workerCount):
+        # Setup TLS; before any worker processes are forked, so the password of an encrypted key is only prompted for
+        # once
+        self.sslContext = create_ssl_context_from_env(certfile, keyfile)
+
+        # Setup the sessions, shared between the worker processes when serving from several; each user's concurrent
+        # sessions are limited, unless the limit is set to 0. Tokens are signed and validated from their contents
+        # instead, if configured
+        self.processCount = get_process_count()
+        self.tokenManager = create_signed_token_manager_from_env(self.processCount)
+        if self.tokenManager is None:
+            maxUserTokens = int(os.environ.get('AUTHSERVER_USER_SESSION_LIMIT', 100)) or None
+            self.tokenManager = TokenManager(store = create_session_store_from_env(self.processCount), maxUserTokens = maxUserTokens)
+        # Restore the sessions persisted before the last shutdown, and keep persisting them, unless disabled
+        self.sessionSnapshotter = create_session_snapshotter_from_env(self.tokenManager)
+        if self.sessionSnapshotter is not None:
+            print('Restored %d sessions' % self.sessionSnapshotter.restore())
+
+        if self.processCount > 1:
+            # Fork the workers before any threads, or an event loop, are started; only the workers return, while this
+            # process evicts and persists the sessions for them
+            run_worker_processes(self.processCount, self.tokenManager, self.sessionSnapshotter)
+            self.sessionSnapshotter = None
+        else:
+            if self.sessionSnapshotter is not None:
+                self.sessionSnapshotter.start()
+            self.tokenManager.start_reaper()
+
+        # Setup DB connection pool; each worker thread gets its own connection
+        self.db = ConnectionPool(dbfile)
+
+        # Bring the schema up to date
+        SchemaMigrator(self.db.get_connection()).migrate()
+
+        # Setup the password hashing processes
+        self.hashingExecutor = HashingExecutor()
+
+        # Setup the writer thread, which batches writes into shared commits
+        self.userWriter = UserWriter(self.db)
+
+        # Setup request logging
+        self.requestLogger = RequestLogger(
+            os.environ.get('AUTHSERVER_LOG_FILE'),
+            parse_sample_rates(os.environ.get('AUTHSERVER_LOG_SAMPLING')),
+            float(os.environ.get('AUTHSERVER_LOG_SAMPLE_RATE', 1.0)))
+
+        # Setup the user row cache, unless disabled with a size of 0; rows cached by one worker process would go stale on
+        # writes through another, so it's only used when serving from a single process
+        cacheSize = int(os.environ.get('AUTHSERVER_USER_CACHE_SIZE', 100000)) if self.processCount == 1 else 0
+        self.userCache = UserCache(cacheSize, float(os.environ.get('AUTHSERVER_USER_CACHE_TTL', 60))) if cacheSize > 0 else None
+
+        # Create necessary handler objects
+        userManager = UserManager(self.db, self.hashingExecutor, self.userWriter, self.userCache)
+        requestHandler = RequestHandler(self.tokenManager, userManager)
+        # Setup admission control; hashing requests may only take part of the worker threads, leaving the rest for
+        # session requests
+        self.admissionController = create_admission_controller_from_env(workerCount)
+
+        # Setup profiling, toggled through the admin endpoint or SIGUSR1; toggling off with the signal writes out the
+        # stacks
+        self.requestProfiler = RequestProfiler(
+            float(os.environ.get('AUTHSERVER_PROFILE_SAMPLE_RATE', 0.1)),
+            os.environ.get('AUTHSERVER_PROFILE_FILE', 'AuthServer.profile.txt'))
+
+        # Join the cluster, if configured, forwarding requests for sessions owned by other nodes to them; the membership
+        # is reloaded on SIGHUP
+        self.clusterRouter = create_cluster_router_from_env(self.tokenManager, certfile)
+
+        self.requestRouter = RequestRouter(requestHandler, self.requestLogger, self.admissionController, self.requestProfiler, self.clusterRouter)
+        register_server_gauges(self.tokenManager, self.hashingExecutor, self.requestLogger)
+        metrics.gauge('authserver_hashing_requests', 'Hashing requests being handled', self.admissionController.get_hashing_count)
+        if self.userCache is not None:
+            register_user_cache_gauges(self.userCache)
+
+    def shutdown(self):
+        # Called once the engine has stopped taking requests and finished those in flight: commit the pending writes,
+        # flush the queued log records, then stop the hashing processes
+        self.userWriter.shutdown()
+        self.db.close_all()
+        self.requestLogger.shutdown()
+        self.hashingExecutor.shutdown()
+
+        # Snapshot the sessions on shutdown, so the next start has no log to replay
+        if self.sessionSnapshotter is not None:
+            self.sessionSnapshotter.stop()
+
+
+def parse_server_args(argv):
+    # Returns the (host address, host port, sqlite file, SSL key file, SSL cert file, worker count), or exits with the
+    # usage
+    if len(argv) < 6:
+        print('Required Args: <host address> <host port> <sqlite file> <SSL key file> <SSL cert file> [worker count]')
+        sys.exit()
+
+    return (argv[1], int(argv[2]), argv[3], argv[4], argv[5], int(argv[6]) if len(argv) > 6 else 8)
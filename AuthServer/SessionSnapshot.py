@@ -0,0 +1,323 @@
+import gc
+import mmap
+import os
+import queue
+import struct
+import sys
+import time
+from threading import Event, Thread
+
+# Persists the sessions held by a TokenManager, so a restart doesn't log every user out
+#
+# Sessions are periodically written to a compact binary snapshot, without holding any locks, and every change since is
+# appended to a change log. On startup the snapshot is memory-mapped and its fixed-size token records unpacked in bulk,
+# the change log is replayed over it, and expired sessions are dropped along the way.
+#
+# Snapshot file: a header, then the user table (a length-prefixed UTF-8 email per user), then one fixed-size record per
+# token referencing its user by index. Change log: PUT (token key, email, times), DEL (token key) and DELUSER (email)
+# records. Times are stored as wall-clock seconds, since the TokenManager's monotonic times don't survive a restart.
+#
+# Token accesses that don't rotate the token aren't logged, so a restored session may expire from inactivity a little
+# sooner than it otherwise would have.
+#
+# Configured through environment variables:
+#   AUTHSERVER_SESSION_SNAPSHOT: the snapshot file, with the change log alongside it; sessions aren't persisted when unset
+#   AUTHSERVER_SESSION_SNAPSHOT_INTERVAL: the seconds between snapshots
+
+__snapshotMagic__ = b'AUTHSNAP'
+__snapshotVersion__ = 1
+
+snapshotHeader = struct.Struct('<8sIIQd') # magic, version, user count, token count, snapshot time
+snapshotUser = struct.Struct('<H') # email length, followed by the email
+snapshotToken = struct.Struct('<16sIdd') # token key, user index, created, last accessed
+
+logPut = struct.Struct('<c16sddH') # 'P', token key, created, last accessed, email length, followed by the email
+logDelete = struct.Struct('<c16s') # 'D', token key
+logDeleteUser = struct.Struct('<cH') # 'U', email length, followed by the email
+
+
+# Snapshots a TokenManager periodically, and logs its changes in between
+class SessionSnapshotter:
+
+    __defaultInterval__ = 300 # 5 minutes
+
+    def __init__(self, tokenManager, snapshotFile, interval = None):
+        self.tokenManager = tokenManager
+        self.snapshotFile = snapshotFile
+        self.logFile = snapshotFile + '.log'
+        self.previousLogFile = snapshotFile + '.log.1'
+        self.interval = interval or self.__defaultInterval__
+        self.changeLog = None
+        self.snapshotThread = None
+        self.snapshotStopped = Event()
+
+
+    # Control Methods
+
+    def restore(self):
+        # Load the sessions from the snapshot and change logs into the token manager, returning how many were restored;
+        # the cyclic garbage collector is paused meanwhile, since it would otherwise rescan the growing session table
+        # over and over while millions of records are allocated, none of which hold cycles
+        gcEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.restore_sessions()
+        finally:
+            if gcEnabled:
+                gc.enable()
+
+    def restore_sessions(self):
+        sessions = {}
+        deletedUsers = {}
+        sequence = 1
+
+        if os.path.exists(self.snapshotFile):
+            read_snapshot(self.snapshotFile, sessions)
+        for logFile in (self.previousLogFile, self.logFile):
+            if os.path.exists(logFile):
+                sequence = replay_log(logFile, sessions, deletedUsers, sequence)
+
+        # Drop the sessions of deleted users, and expired ones, converting their times back to monotonic ones
+        offset = time.time() - time.monotonic()
+        now = time.monotonic()
+        (maxTokenLifespan, maxTokenInactiveDuration) = (self.tokenManager.maxTokenLifespan, self.tokenManager.maxTokenInactiveDuration)
+
+        def get_live_sessions():
+            for (key, (email, created, lastAccessed, putSequence)) in sessions.items():
+                if putSequence < deletedUsers.get(email, 0):
+                    continue
+                created -= offset
+                lastAccessed -= offset
+                if min(created + maxTokenLifespan, lastAccessed + maxTokenInactiveDuration) > now:
+                    yield (key, email, created, lastAccessed)
+
+        return self.tokenManager.load_tokens(get_live_sessions())
+
+    def start(self, logChanges = True):
+        # Snapshot periodically, logging changes in between; without the log, as when the sessions are changed by other
+        # processes, changes since the last snapshot are lost on a crash
+        if logChanges:
+            self.changeLog = SessionChangeLog(self.logFile)
+            self.tokenManager.changeLog = self.changeLog
+
+        self.snapshotStopped.clear()
+        self.snapshotThread = Thread(target = self.run_snapshots, name = 'SessionSnapshotter', daemon = True)
+        self.snapshotThread.start()
+
+    def stop(self):
+        # Take a final snapshot, so the next start has no log to replay; if it fails, the logs are kept for the next
+        # start instead
+        self.snapshotStopped.set()
+        if self.snapshotThread is not None:
+            self.snapshotThread.join()
+            self.snapshotThread = None
+        try:
+            self.take_snapshot()
+        except Exception as e:
+            print('Unable to snapshot the sessions: ' + str(e))
+
+        if self.changeLog is not None:
+            self.tokenManager.changeLog = None
+            self.changeLog.shutdown()
+            self.changeLog = None
+
+    def run_snapshots(self):
+        # A failed snapshot is reported, and retried at the next interval; the logs cover the sessions meanwhile
+        while not self.snapshotStopped.wait(self.interval):
+            try:
+                self.take_snapshot()
+            except Exception as e:
+                print('Unable to snapshot the sessions: ' + str(e))
+
+    def take_snapshot(self):
+        # Start a new log first, so every change after the copy below is in it; changes made between the two are in
+        # both the copy and the log, which replays to the same state. The previous log is only replaced once a snapshot
+        # covers it, so after a failed snapshot, or on the first after a restart, the current log is kept going instead:
+        # replaying it whole over the snapshot also reaches the same state
+        if self.changeLog is not None and not os.path.exists(self.previousLogFile):
+            self.changeLog.rotate(self.previousLogFile)
+        write_snapshot(self.snapshotFile, self.tokenManager.store.get_tokens())
+
+        # The snapshot covers the logs before it; without a log of its own, any left from an earlier run are dropped
+        # too, since they'd otherwise be replayed over this snapshot on restore
+        coveredLogFiles = [self.previousLogFile] if self.changeLog is not None else [self.previousLogFile, self.logFile]
+        for logFile in coveredLogFiles:
+            if os.path.exists(logFile):
+                os.remove(logFile)
+
+
+# Appends session changes to the log from a writer thread, so the token manager only enqueues them
+class SessionChangeLog:
+
+    __flushInterval__ = 0.1 # 100 milliseconds
+
+    def __init__(self, logFile):
+        self.logFile = logFile
+        self.offset = time.time() - time.monotonic()
+        self.pendingChanges = queue.SimpleQueue()
+        self.writerThread = Thread(target = self.run_writer, name = 'SessionChangeLog', daemon = True)
+        self.writerThread.start()
+
+
+    # Change Methods; times are the token manager's monotonic ones
+
+    def log_put(self, key, email, created, lastAccessed):
+        self.pendingChanges.put((b'P', key, email, created, lastAccessed))
+
+    def log_delete(self, key):
+        self.pendingChanges.put((b'D', key))
+
+    def log_delete_user(self, email):
+        self.pendingChanges.put((b'U', email))
+
+    def rotate(self, previousLogFile):
+        # Move the log written so far aside, then start a new one; returns once done, raising if the log couldn't be
+        # moved, in which case it's kept going
+        done = Event()
+        errors = []
+        self.pendingChanges.put((b'R', previousLogFile, done, errors))
+        done.wait()
+        if errors:
+            raise errors[0]
+
+    def shutdown(self):
+        self.pendingChanges.put(None)
+        self.writerThread.join()
+
+
+    # Writer Thread Methods
+
+    def run_writer(self):
+        output = open(self.logFile, 'ab')
+        while True:
+            try:
+                change = self.pendingChanges.get(timeout = self.__flushInterval__)
+            except queue.Empty:
+                output.flush()
+                continue
+
+            if change is None:
+                output.close()
+                return
+
+            if change[0] == b'R':
+                (_, previousLogFile, done, errors) = change
+                output.close()
+                try:
+                    os.replace(self.logFile, previousLogFile)
+                except OSError as e:
+                    errors.append(e)
+                output = open(self.logFile, 'ab')
+                done.set()
+            else:
+                output.write(self.encode(change))
+
+    def encode(self, change):
+        if change[0] == b'P':
+            (_, key, email, created, lastAccessed) = change
+            emailBytes = email.encode('utf8')
+            return logPut.pack(b'P', key, created + self.offset, lastAccessed + self.offset, len(emailBytes)) + emailBytes
+        elif change[0] == b'D':
+            return logDelete.pack(b'D', change[1])
+        else:
+            emailBytes = change[1].encode('utf8')
+            return logDeleteUser.pack(b'U', len(emailBytes)) + emailBytes
+
+
+# Snapshot Functions
+
+def write_snapshot(snapshotFile, tokens):
+    # Written to a temporary file, then moved into place, so a crash never leaves a partial snapshot
+    offset = time.time() - time.monotonic()
+    userIndexes = {}
+    userTable = bytearray()
+    tokenTable = bytearray()
+
+    for (key, email, created, lastAccessed) in tokens:
+        userIndex = userIndexes.get(email)
+        if userIndex is None:
+            userIndex = userIndexes[email] = len(userIndexes)
+            emailBytes = email.encode('utf8')
+            userTable += snapshotUser.pack(len(emailBytes)) + emailBytes
+        tokenTable += snapshotToken.pack(key, userIndex, created + offset, lastAccessed + offset)
+
+    temporaryFile = snapshotFile + '.tmp'
+    with open(temporaryFile, 'wb') as output:
+        output.write(snapshotHeader.pack(__snapshotMagic__, __snapshotVersion__, len(userIndexes), len(tokenTable) // snapshotToken.size, time.time()))
+        output.write(userTable)
+        output.write(tokenTable)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporaryFile, snapshotFile)
+
+def read_snapshot(snapshotFile, sessions):
+    # Adds the snapshot's sessions to the given dict of key to (email, created, last accessed, sequence)
+    with open(snapshotFile, 'rb') as input:
+        if os.fstat(input.fileno()).st_size < snapshotHeader.size:
+            return
+        with mmap.mmap(input.fileno(), 0, access = mmap.ACCESS_READ) as snapshot:
+            (magic, version, userCount, tokenCount, _) = snapshotHeader.unpack_from(snapshot, 0)
+            if magic != __snapshotMagic__ or version != __snapshotVersion__:
+                raise Exception('Unrecognised session snapshot ' + snapshotFile)
+
+            # Read the user table
+            users = []
+            position = snapshotHeader.size
+            for _ in range(userCount):
+                (length, ) = snapshotUser.unpack_from(snapshot, position)
+                position += snapshotUser.size
+                users.append(sys.intern(str(snapshot[position:position + length], 'utf8')))
+                position += length
+
+            # Unpack the token records in bulk
+            view = memoryview(snapshot)
+            try:
+                tokenTable = view[position:position + tokenCount * snapshotToken.size]
+                for (key, userIndex, created, lastAccessed) in snapshotToken.iter_unpack(tokenTable):
+                    sessions[key] = (users[userIndex], created, lastAccessed, 0)
+                tokenTable.release()
+            finally:
+                view.release()
+
+def replay_log(logFile, sessions, deletedUsers, sequence):
+    # Applies the log's changes to the sessions, stopping at a partially written record; deleted users are noted with
+    # the sequence of their deletion, so only their sessions put before it are dropped. Returns the next sequence.
+    with open(logFile, 'rb') as input:
+        data = input.read()
+
+    position = 0
+    while position < len(data):
+        changeType = data[position:position + 1]
+        if changeType == b'P' and position + logPut.size <= len(data):
+            (_, key, created, lastAccessed, length) = logPut.unpack_from(data, position)
+            position += logPut.size
+            if position + length > len(data):
+                break
+            sessions[key] = (sys.intern(data[position:position + length].decode('utf8')), created, lastAccessed, sequence)
+            position += length
+        elif changeType == b'D' and position + logDelete.size <= len(data):
+            (_, key) = logDelete.unpack_from(data, position)
+            position += logDelete.size
+            sessions.pop(key, None)
+        elif changeType == b'U' and position + logDeleteUser.size <= len(data):
+            (_, length) = logDeleteUser.unpack_from(data, position)
+            position += logDeleteUser.size
+            if position + length > len(data):
+                break
+            deletedUsers[data[position:position + length].decode('utf8')] = sequence
+            position += length
+        else:
+            break
+        sequence += 1
+
+    return sequence
+
+
+def create_session_snapshotter_from_env(tokenManager, environ = os.environ):
+    # Returns None when sessions aren't persisted
+    snapshotFile = environ.get('AUTHSERVER_SESSION_SNAPSHOT')
+    if not snapshotFile:
+        return None
+
+    interval = environ.get('AUTHSERVER_SESSION_SNAPSHOT_INTERVAL')
+    return SessionSnapshotter(tokenManager, snapshotFile, float(interval) if interval else None)
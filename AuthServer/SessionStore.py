@@ -0,0 +1,322 @@
+import heapq
+from threading import Lock
+
+# Storage for the sessions of a TokenManager: the tokens, the users holding them, and the per-user locks serializing
+# changes to a user's tokens. The TokenManager holds the session policy (lifespans, token formats, change logging); a
+# store only keeps and locks the data.
+#
+# Keys are a token's 16 raw bytes, and times are monotonic floats. Changes to a user's tokens are made with the user
+# locked; get_token is safe to call without the lock, returning a consistent view of the token.
+#
+# Each user has a generation, which every token of the user is stamped with when created or rotated. Revoking a user's
+# tokens bumps the generation, invalidating all of them at once; revoked tokens are reported as missing, but held (and
+# counted in the stats) until the reaper removes them, or the user's tokens are trimmed.
+class SessionStore:
+
+    def close(self):
+        # Release any resources shared with other processes
+        pass
+
+
+    # User Lock Methods
+
+    def lock_user(self, email, timeout):
+        # Returns whether the user was locked within the timeout, in seconds; 0 doesn't wait
+        raise NotImplementedError()
+
+    def release_user(self, email):
+        # Release the lock on the user, dropping the user once it holds no tokens
+        raise NotImplementedError()
+
+    def is_user_locked(self, email):
+        raise NotImplementedError()
+
+
+    # Token Methods
+
+    def get_token(self, key):
+        # Returns (email, created, last accessed), or None if there's no such token
+        raise NotImplementedError()
+
+    def add_token(self, key, email, created, lastAccessed):
+        raise NotImplementedError()
+
+    def touch_token(self, key, lastAccessed):
+        raise NotImplementedError()
+
+    def replace_token(self, oldKey, newKey):
+        raise NotImplementedError()
+
+    def remove_token(self, key):
+        raise NotImplementedError()
+
+    def revoke_user_tokens(self, email):
+        raise NotImplementedError()
+
+    def count_user_tokens(self, email):
+        # Returns the number of tokens held for the user, including revoked ones
+        raise NotImplementedError()
+
+    def trim_user_tokens(self, email, maxCount):
+        # Remove the user's revoked tokens, then the least recently accessed ones until at most the given number remain;
+        # returns the keys of the tokens removed, other than the revoked ones
+        raise NotImplementedError()
+
+
+    # Expiry Methods
+
+    def queue_expiry(self, key, deadline):
+        # Have the token checked for expiry once the deadline passes
+        raise NotImplementedError()
+
+    def get_expired_tokens(self, now, maxCount, get_deadline):
+        # Returns up to the given number of (key, email) for tokens which may have expired, per the given function of
+        # (created, last accessed), or been revoked; they're checked again under the user lock before being evicted
+        raise NotImplementedError()
+
+    def remove_revoked_token(self, key):
+        # Remove the token if it was revoked, returning whether it was
+        raise NotImplementedError()
+
+
+    # Bulk Methods
+
+    def get_tokens(self):
+        # Returns (key, email, created, last accessed) for every token not revoked, without locking
+        raise NotImplementedError()
+
+    def load_tokens(self, tokens, get_deadline):
+        # Add the given (key, email, created, last accessed) before serving, returning how many were added
+        raise NotImplementedError()
+
+    def get_stats(self):
+        # Returns the live tokens and users, the tokens queued for expiry, and the users dropped
+        raise NotImplementedError()
+
+
+# Sessions held in the process's own memory; the default store
+#
+# Sessions are kept compact, since a node may hold tens of millions of them: emails are interned by the TokenManager, so
+# all the records for a user share one string, and records use slots
+class LocalSessionStore(SessionStore):
+
+    def __init__(self):
+        self.tokens = {}
+        self.users = {}
+        self.usersLock = Lock()
+
+        # Expiry index; a heap of (deadline, token record), where the deadline may be stale if the token was accessed
+        # since it was queued, in which case it's requeued
+        self.expiryQueue = []
+        self.expiryLock = Lock()
+        self.evictedUserCount = 0
+
+
+    # User Lock Methods
+
+    def lock_user(self, email, timeout):
+        while True:
+            # Get or create the user record; guarded so concurrent threads agree on a single record
+            with self.usersLock:
+                userRecord = self.users.get(email)
+
+                if userRecord is None:
+                    userRecord = UserRecord()
+                    self.users[email] = userRecord
+
+            if not userRecord.lock.acquire(timeout = timeout):
+                return False
+
+            # Revalidate the user record is current, in case it was dropped while waiting for the lock; if so, start over
+            if self.users.get(email) is userRecord:
+                return True
+
+            userRecord.lock.release()
+
+    def release_user(self, email):
+        userRecord = self.users[email]
+        if not userRecord.tokens:
+            with self.usersLock:
+                if self.users.get(email) is userRecord:
+                    del self.users[email]
+                    self.evictedUserCount += 1
+
+        userRecord.lock.release()
+
+    def is_user_locked(self, email):
+        userRecord = self.users.get(email)
+        return userRecord is not None and userRecord.lock.locked()
+
+
+    # Token Methods
+
+    def get_token(self, key):
+        # Dict lookups and attribute reads are atomic, so the record can be read optimistically, then confirmed to still
+        # be current under the key; a token rotated, closed or revoked meanwhile is reported as missing
+        tokenRecord = self.tokens.get(key)
+        if tokenRecord is None:
+            return None
+
+        token = (tokenRecord.user, tokenRecord.created, tokenRecord.lastAccessed)
+        if tokenRecord.key != key or self.tokens.get(key) is not tokenRecord or self.is_revoked(tokenRecord):
+            return None
+        return token
+
+    def add_token(self, key, email, created, lastAccessed):
+        userRecord = self.users[email]
+        self.tokens[key] = TokenRecord(key, email, created, lastAccessed, userRecord.generation)
+        userRecord.tokens.add(key)
+
+    def touch_token(self, key, lastAccessed):
+        self.tokens[key].lastAccessed = lastAccessed
+
+    def replace_token(self, oldKey, newKey):
+        # The record is kept, so its queued expiry follows it to the new key; it takes the user's current generation
+        tokenRecord = self.tokens[oldKey]
+        userRecord = self.users[tokenRecord.user]
+        tokenRecord.key = newKey
+        tokenRecord.generation = userRecord.generation
+        del self.tokens[oldKey]
+        self.tokens[newKey] = tokenRecord
+
+        userRecord.tokens.remove(oldKey)
+        userRecord.tokens.add(newKey)
+
+    def remove_token(self, key):
+        tokenRecord = self.tokens.pop(key)
+        self.users[tokenRecord.user].tokens.remove(key)
+
+    def revoke_user_tokens(self, email):
+        self.users[email].generation += 1
+
+    def count_user_tokens(self, email):
+        return len(self.users[email].tokens)
+
+    def trim_user_tokens(self, email, maxCount):
+        userRecord = self.users[email]
+        tokenRecords = []
+        for key in list(userRecord.tokens):
+            tokenRecord = self.tokens[key]
+            if tokenRecord.generation != userRecord.generation:
+                self.remove_token(key)
+            else:
+                tokenRecords.append(tokenRecord)
+
+        # Evict the least recently accessed
+        tokenRecords.sort(key = lambda tokenRecord: tokenRecord.lastAccessed)
+        evictedKeys = [tokenRecord.key for tokenRecord in tokenRecords[:max(len(tokenRecords) - maxCount, 0)]]
+        for key in evictedKeys:
+            self.remove_token(key)
+        return evictedKeys
+
+
+    # Expiry Methods
+
+    def queue_expiry(self, key, deadline):
+        tokenRecord = self.tokens.get(key)
+        if tokenRecord is not None:
+            with self.expiryLock:
+                heapq.heappush(self.expiryQueue, (deadline, tokenRecord))
+
+    def get_expired_tokens(self, now, maxCount, get_deadline):
+        expiredTokens = []
+        while len(expiredTokens) < maxCount:
+            # Pop the next token due to expire
+            with self.expiryLock:
+                if not self.expiryQueue or self.expiryQueue[0][0] > now:
+                    break
+                (_, tokenRecord) = heapq.heappop(self.expiryQueue)
+
+            # Skip tokens already closed or removed; revoked ones are removed once due, like expired ones
+            if self.tokens.get(tokenRecord.key) is not tokenRecord:
+                continue
+
+            # Requeue tokens accessed since they were queued
+            deadline = get_deadline(tokenRecord.created, tokenRecord.lastAccessed)
+            if deadline > now:
+                with self.expiryLock:
+                    heapq.heappush(self.expiryQueue, (deadline, tokenRecord))
+                continue
+
+            expiredTokens.append((tokenRecord.key, tokenRecord.user))
+
+        return expiredTokens
+
+    def remove_revoked_token(self, key):
+        tokenRecord = self.tokens.get(key)
+        if tokenRecord is None or not self.is_revoked(tokenRecord):
+            return False
+
+        self.remove_token(key)
+        return True
+
+
+    # Bulk Methods
+
+    def get_tokens(self):
+        # Copying the records is atomic; each is then read field by field, and may change meanwhile
+        return [(tokenRecord.key, tokenRecord.user, tokenRecord.created, tokenRecord.lastAccessed) for tokenRecord in list(self.tokens.values()) if not self.is_revoked(tokenRecord)]
+
+    def load_tokens(self, tokens, get_deadline):
+        (tokenRecords, users) = (self.tokens, self.users)
+        expiryQueue = []
+
+        for (key, email, created, lastAccessed) in tokens:
+            userRecord = users.get(email)
+            if userRecord is None:
+                userRecord = users[email] = UserRecord()
+
+            tokenRecord = TokenRecord(key, email, created, lastAccessed, userRecord.generation)
+            tokenRecords[key] = tokenRecord
+            userRecord.tokens.add(key)
+            expiryQueue.append((get_deadline(created, lastAccessed), tokenRecord))
+
+        with self.expiryLock:
+            self.expiryQueue.extend(expiryQueue)
+            heapq.heapify(self.expiryQueue)
+
+        return len(expiryQueue)
+
+    def get_stats(self):
+        return {
+            'liveTokens' : len(self.tokens),
+            'liveUsers' : len(self.users),
+            'queuedTokens' : len(self.expiryQueue),
+            'evictedUsers' : self.evictedUserCount
+        }
+
+
+    # Utility Methods
+
+    def is_revoked(self, tokenRecord):
+        # The user is held as long as it has tokens, but may be dropped as the last is removed
+        userRecord = self.users.get(tokenRecord.user)
+        return userRecord is None or tokenRecord.generation != userRecord.generation
+
+
+# Record for a single token, including information on its lifespan, and the user generation it was issued in
+class TokenRecord:
+
+    __slots__ = ('key', 'user', 'created', 'lastAccessed', 'generation')
+
+    def __init__(self, key, user, created, lastAccessed, generation = 0):
+        self.key = key
+        self.user = user
+        self.created = created
+        self.lastAccessed = lastAccessed
+        self.generation = generation
+
+    def __lt__(self, other):
+        # Breaks ties between expiry queue entries with the same deadline
+        return self.key < other.key
+
+
+# Record for a single user, including the associated token keys, concurrency lock, and current token generation
+class UserRecord:
+
+    __slots__ = ('lock', 'tokens', 'generation')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.tokens = set()
+        self.generation = 0
@@ -0,0 +1,479 @@
+import multiprocessing
+import os
+import struct
+import time
+import zlib
+from multiprocessing import shared_memory
+from AuthServer.SessionStore import SessionStore
+
+# Sessions held in shared memory, so several worker processes forked from the one creating the store serve the same
+# sessions; e.g. processes accepting on the same port through SO_REUSEPORT
+#
+# Tokens and users live in fixed-capacity open-addressing hash tables, each split into segments with a cross-process
+# lock guarding the allocation and freeing of its slots. A user's tokens are chained through their slots, from the user's
+# slot. The per-user lock is a flag in the user's slot, set and cleared under its segment's lock; waiters poll for it,
+# and take it over if the process holding it died.
+#
+# Tokens are read without locking: each token slot carries a version, odd while the slot is being written, which readers
+# check before and after reading, retrying on a change (a sequence lock). This relies on stores to shared memory being
+# seen in program order by other processes, as on x86-64.
+#
+# Times are monotonic, which on Linux is the same clock in every process. Emails are limited to 254 bytes, the longest
+# deliverable address.
+#
+# Revoked tokens are found by the reaper as it scans the table, like expired ones.
+
+tokenSlot = struct.Struct('<IBxxx16sIIIxxxxdd') # version, state, key, user slot, next token slot, generation, created, last accessed
+userSlot = struct.Struct('<BBxxiIIIH254s') # state, locked, locking process ID, token count, first token slot, generation, email length, email
+uint16 = struct.Struct('<H')
+int32 = struct.Struct('<i')
+uint32 = struct.Struct('<I')
+double = struct.Struct('<d')
+
+# Offsets of the token slot fields
+tokenVersionOffset = 0
+tokenStateOffset = 4
+tokenKeyOffset = 8
+tokenUserOffset = 24
+tokenNextOffset = 28
+tokenLastAccessedOffset = 48
+
+# Offsets of the user slot fields
+userStateOffset = 0
+userLockedOffset = 1
+userOwnerOffset = 4
+userTokenCountOffset = 8
+userFirstTokenOffset = 12
+userGenerationOffset = 16
+userEmailLengthOffset = 20
+userEmailOffset = 22
+
+# Slot states; freed slots are marked deleted, so probes for other entries continue past them
+emptySlot = 0
+usedSlot = 1
+deletedSlot = 2
+
+noSlot = 0xFFFFFFFF
+
+
+class SharedSessionStore(SessionStore):
+
+    __lockPollInterval__ = 0.0005 # 0.5 milliseconds, doubling up to the maximum
+    __maxLockPollInterval__ = 0.005 # 5 milliseconds
+    __reapScanSize__ = 16384 # Token slots scanned for expired tokens per call
+    __maxEmailLength__ = 254
+
+    def __init__(self, tokenCapacity = 1 << 20, userCapacity = 1 << 18, segmentCount = 64):
+        self.segmentCount = segmentCount
+        self.tokenSegmentSize = -(-tokenCapacity // segmentCount)
+        self.userSegmentSize = -(-userCapacity // segmentCount)
+        self.tokenCapacity = self.tokenSegmentSize * segmentCount
+        self.userCapacity = self.userSegmentSize * segmentCount
+
+        # Laid out as the token and user counts of each segment, then the token slots, then the user slots
+        self.segmentCounts = struct.Struct('<%dI' % segmentCount)
+        self.tokenCountsOffset = 0
+        self.userCountsOffset = self.segmentCounts.size
+        self.tokensOffset = (2 * self.segmentCounts.size + 7) // 8 * 8
+        self.usersOffset = self.tokensOffset + self.tokenCapacity * tokenSlot.size
+        size = self.usersOffset + self.userCapacity * userSlot.size
+
+        # New shared memory is zeroed, i.e. all the slots are empty
+        self.memory = shared_memory.SharedMemory(create = True, size = size)
+        self.buffer = self.memory.buf
+        self.creatorProcess = os.getpid()
+
+        # Inherited by the worker processes, which must be forked
+        context = multiprocessing.get_context('fork')
+        self.tokenLocks = [context.Lock() for _ in range(segmentCount)]
+        self.userLocks = [context.Lock() for _ in range(segmentCount)]
+
+        # Per process
+        self.evictedUserCount = 0
+        self.reapCursor = 0
+
+    def close(self):
+        # Detach from the shared memory, which the creating process then frees
+        self.buffer = None
+        self.memory.close()
+        if os.getpid() == self.creatorProcess:
+            self.memory.unlink()
+
+
+    # User Lock Methods
+
+    def lock_user(self, email, timeout):
+        emailBytes = self.encode_email(email)
+        segment = self.get_user_segment(emailBytes)
+        deadline = time.monotonic() + timeout
+        pollInterval = self.__lockPollInterval__
+
+        while True:
+            with self.userLocks[segment]:
+                offset = self.get_user_offset(self.find_user(emailBytes, segment, True))
+                if not self.buffer[offset + userLockedOffset] or not is_process_alive(int32.unpack_from(self.buffer, offset + userOwnerOffset)[0]):
+                    self.buffer[offset + userLockedOffset] = 1
+                    int32.pack_into(self.buffer, offset + userOwnerOffset, os.getpid())
+                    return True
+
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(pollInterval)
+            pollInterval = min(pollInterval * 2, self.__maxLockPollInterval__)
+
+    def release_user(self, email):
+        emailBytes = self.encode_email(email)
+        segment = self.get_user_segment(emailBytes)
+
+        with self.userLocks[segment]:
+            index = self.find_user(emailBytes, segment, False)
+            if index is None:
+                raise Exception('User ' + email + ' not found')
+
+            offset = self.get_user_offset(index)
+            if uint32.unpack_from(self.buffer, offset + userTokenCountOffset)[0] == 0:
+                self.free_user(index, segment)
+                self.evictedUserCount += 1
+            else:
+                self.buffer[offset + userLockedOffset] = 0
+
+    def is_user_locked(self, email):
+        emailBytes = self.encode_email(email)
+        segment = self.get_user_segment(emailBytes)
+
+        with self.userLocks[segment]:
+            index = self.find_user(emailBytes, segment, False)
+            return index is not None and self.buffer[self.get_user_offset(index) + userLockedOffset] == 1
+
+
+    # Token Methods
+
+    def get_token(self, key):
+        index = self.find_token(key)
+        if index is None:
+            return None
+
+        token = self.read_token(index)
+        if token is None or token[0] != key or self.is_revoked(token):
+            return None
+        return (self.read_email(token[1]), token[4], token[5])
+
+    def add_token(self, key, email, created, lastAccessed):
+        self.link_token(key, self.get_user_index(email), created, lastAccessed)
+
+    def touch_token(self, key, lastAccessed):
+        offset = self.get_token_offset(self.find_token(key))
+        self.begin_write(offset)
+        double.pack_into(self.buffer, offset + tokenLastAccessedOffset, lastAccessed)
+        self.end_write(offset)
+
+    def replace_token(self, oldKey, newKey):
+        index = self.find_token(oldKey)
+        (_, userIndex, _, _, created, lastAccessed) = self.read_token(index)
+        self.link_token(newKey, userIndex, created, lastAccessed)
+        self.unlink_token(index, userIndex)
+
+    def remove_token(self, key):
+        index = self.find_token(key)
+        self.unlink_token(index, self.read_token(index)[1])
+
+    def revoke_user_tokens(self, email):
+        userOffset = self.get_user_offset(self.get_user_index(email))
+        uint32.pack_into(self.buffer, userOffset + userGenerationOffset, (uint32.unpack_from(self.buffer, userOffset + userGenerationOffset)[0] + 1) & 0xFFFFFFFF)
+
+    def count_user_tokens(self, email):
+        return uint32.unpack_from(self.buffer, self.get_user_offset(self.get_user_index(email)) + userTokenCountOffset)[0]
+
+    def trim_user_tokens(self, email, maxCount):
+        userIndex = self.get_user_index(email)
+        validTokens = []
+        index = uint32.unpack_from(self.buffer, self.get_user_offset(userIndex) + userFirstTokenOffset)[0]
+        while index != noSlot:
+            token = self.read_token(index)
+            if self.is_revoked(token):
+                self.unlink_token(index, userIndex)
+            else:
+                validTokens.append((token[5], token[0], index))
+            index = token[2]
+
+        # Evict the least recently accessed
+        validTokens.sort()
+        evictedKeys = []
+        for (_, key, index) in validTokens[:max(len(validTokens) - maxCount, 0)]:
+            self.unlink_token(index, userIndex)
+            evictedKeys.append(key)
+        return evictedKeys
+
+
+    # Expiry Methods
+
+    def queue_expiry(self, key, deadline):
+        # Every token is checked as the reaper scans the table
+        pass
+
+    def get_expired_tokens(self, now, maxCount, get_deadline):
+        # Scan the next part of the table; a token is evicted within a full pass of the reaper over the table
+        expiredTokens = []
+        scanSize = min(self.__reapScanSize__, self.tokenCapacity)
+        for _ in range(scanSize):
+            index = self.reapCursor
+            self.reapCursor = (self.reapCursor + 1) % self.tokenCapacity
+
+            token = self.read_token(index)
+            if token is not None and (self.is_revoked(token) or get_deadline(token[4], token[5]) <= now):
+                expiredTokens.append((token[0], self.read_email(token[1])))
+                if len(expiredTokens) >= maxCount:
+                    break
+
+        return expiredTokens
+
+    def remove_revoked_token(self, key):
+        index = self.find_token(key)
+        if index is None:
+            return False
+
+        token = self.read_token(index)
+        if token is None or token[0] != key or not self.is_revoked(token):
+            return False
+
+        self.unlink_token(index, token[1])
+        return True
+
+
+    # Bulk Methods
+
+    def get_tokens(self):
+        tokens = []
+        for index in range(self.tokenCapacity):
+            token = self.read_token(index)
+            if token is not None and not self.is_revoked(token):
+                tokens.append((token[0], self.read_email(token[1]), token[4], token[5]))
+        return tokens
+
+    def load_tokens(self, tokens, get_deadline):
+        loadedCount = 0
+        for (key, email, created, lastAccessed) in tokens:
+            emailBytes = self.encode_email(email)
+            segment = self.get_user_segment(emailBytes)
+            with self.userLocks[segment]:
+                userIndex = self.find_user(emailBytes, segment, True)
+
+            self.link_token(key, userIndex, created, lastAccessed)
+            loadedCount += 1
+
+        return loadedCount
+
+    def get_stats(self):
+        liveTokens = sum(self.segmentCounts.unpack_from(self.buffer, self.tokenCountsOffset))
+        return {
+            'liveTokens' : liveTokens,
+            'liveUsers' : sum(self.segmentCounts.unpack_from(self.buffer, self.userCountsOffset)),
+            'queuedTokens' : liveTokens,
+            'evictedUsers' : self.evictedUserCount
+        }
+
+
+    # Token Slot Methods
+
+    def find_token(self, key):
+        # Returns the slot index of the token, or None; safe without locking, since a key never moves between slots
+        hash = int.from_bytes(key, 'little')
+        segment = hash % self.segmentCount
+        start = (hash // self.segmentCount) % self.tokenSegmentSize
+
+        for probe in range(self.tokenSegmentSize):
+            index = segment * self.tokenSegmentSize + (start + probe) % self.tokenSegmentSize
+            offset = self.get_token_offset(index)
+            state = self.buffer[offset + tokenStateOffset]
+            if state == emptySlot:
+                return None
+            if state == usedSlot and self.buffer[offset + tokenKeyOffset:offset + tokenKeyOffset + 16] == key:
+                return index
+
+        return None
+
+    def read_token(self, index):
+        # Returns (key, user slot, next token slot, generation, created, last accessed) as of a single point in time, or
+        # None if the slot is free
+        offset = self.get_token_offset(index)
+        while True:
+            (version, state, key, userIndex, nextIndex, generation, created, lastAccessed) = tokenSlot.unpack_from(self.buffer, offset)
+            if (version & 1) == 0 and uint32.unpack_from(self.buffer, offset)[0] == version:
+                return (key, userIndex, nextIndex, generation, created, lastAccessed) if state == usedSlot else None
+
+            # Let the writer finish
+            time.sleep(0)
+
+    def link_token(self, key, userIndex, created, lastAccessed):
+        # Allocate a slot for the token, at the head of the user's chain, in the user's current generation
+        userOffset = self.get_user_offset(userIndex)
+        firstIndex = uint32.unpack_from(self.buffer, userOffset + userFirstTokenOffset)[0]
+        generation = uint32.unpack_from(self.buffer, userOffset + userGenerationOffset)[0]
+
+        hash = int.from_bytes(key, 'little')
+        segment = hash % self.segmentCount
+        start = (hash // self.segmentCount) % self.tokenSegmentSize
+
+        with self.tokenLocks[segment]:
+            for probe in range(self.tokenSegmentSize):
+                index = segment * self.tokenSegmentSize + (start + probe) % self.tokenSegmentSize
+                offset = self.get_token_offset(index)
+                if self.buffer[offset + tokenStateOffset] != usedSlot:
+                    break
+            else:
+                raise Exception('Session store is full')
+
+            version = self.begin_write(offset)
+            tokenSlot.pack_into(self.buffer, offset, version, usedSlot, key, userIndex, firstIndex, generation, created, lastAccessed)
+            self.end_write(offset)
+            self.add_segment_count(self.tokenCountsOffset, segment, 1)
+
+        uint32.pack_into(self.buffer, userOffset + userFirstTokenOffset, index)
+        self.add_user_token_count(userOffset, 1)
+
+    def unlink_token(self, index, userIndex):
+        # Remove the token from the user's chain, then free its slot
+        userOffset = self.get_user_offset(userIndex)
+        nextIndex = uint32.unpack_from(self.buffer, self.get_token_offset(index) + tokenNextOffset)[0]
+
+        previousIndex = uint32.unpack_from(self.buffer, userOffset + userFirstTokenOffset)[0]
+        if previousIndex == index:
+            uint32.pack_into(self.buffer, userOffset + userFirstTokenOffset, nextIndex)
+        else:
+            while True:
+                previousOffset = self.get_token_offset(previousIndex)
+                followingIndex = uint32.unpack_from(self.buffer, previousOffset + tokenNextOffset)[0]
+                if followingIndex == index:
+                    break
+                previousIndex = followingIndex
+
+            self.begin_write(previousOffset)
+            uint32.pack_into(self.buffer, previousOffset + tokenNextOffset, nextIndex)
+            self.end_write(previousOffset)
+
+        self.free_token(index)
+        self.add_user_token_count(userOffset, -1)
+
+    def free_token(self, index):
+        segment = index // self.tokenSegmentSize
+        with self.tokenLocks[segment]:
+            offset = self.get_token_offset(index)
+            self.begin_write(offset)
+            self.buffer[offset + tokenStateOffset] = deletedSlot
+            self.end_write(offset)
+            self.clear_deleted_slots(index, segment, self.tokenSegmentSize, self.get_token_offset, tokenStateOffset)
+            self.add_segment_count(self.tokenCountsOffset, segment, -1)
+
+    def begin_write(self, offset):
+        # Returns the slot's next version, marking it as being written
+        version = uint32.unpack_from(self.buffer, offset)[0] + 1
+        uint32.pack_into(self.buffer, offset, version)
+        return version
+
+    def end_write(self, offset):
+        uint32.pack_into(self.buffer, offset, uint32.unpack_from(self.buffer, offset)[0] + 1)
+
+
+    # User Slot Methods; called under the user's segment lock
+
+    def find_user(self, emailBytes, segment, create):
+        # Returns the slot index of the user, creating the user if asked, or None
+        start = (zlib.crc32(emailBytes) // self.segmentCount) % self.userSegmentSize
+        freeIndex = None
+
+        for probe in range(self.userSegmentSize):
+            index = segment * self.userSegmentSize + (start + probe) % self.userSegmentSize
+            offset = self.get_user_offset(index)
+            state = self.buffer[offset + userStateOffset]
+            if state == emptySlot:
+                if freeIndex is None:
+                    freeIndex = index
+                break
+            if state == deletedSlot:
+                if freeIndex is None:
+                    freeIndex = index
+            elif uint16.unpack_from(self.buffer, offset + userEmailLengthOffset)[0] == len(emailBytes) and self.buffer[offset + userEmailOffset:offset + userEmailOffset + len(emailBytes)] == emailBytes:
+                return index
+
+        if not create:
+            return None
+        if freeIndex is None:
+            raise Exception('Session store is full')
+
+        # Fill in the slot before marking it used
+        offset = self.get_user_offset(freeIndex)
+        userSlot.pack_into(self.buffer, offset, emptySlot, 0, 0, 0, noSlot, 0, len(emailBytes), emailBytes)
+        self.buffer[offset + userStateOffset] = usedSlot
+        self.add_segment_count(self.userCountsOffset, segment, 1)
+        return freeIndex
+
+    def free_user(self, index, segment):
+        offset = self.get_user_offset(index)
+        self.buffer[offset + userStateOffset] = deletedSlot
+        self.clear_deleted_slots(index, segment, self.userSegmentSize, self.get_user_offset, userStateOffset)
+        self.add_segment_count(self.userCountsOffset, segment, -1)
+
+    def read_email(self, userIndex):
+        offset = self.get_user_offset(userIndex)
+        emailLength = uint16.unpack_from(self.buffer, offset + userEmailLengthOffset)[0]
+        return str(self.buffer[offset + userEmailOffset:offset + userEmailOffset + emailLength], 'utf8')
+
+    def add_user_token_count(self, userOffset, change):
+        uint32.pack_into(self.buffer, userOffset + userTokenCountOffset, uint32.unpack_from(self.buffer, userOffset + userTokenCountOffset)[0] + change)
+
+
+    # Utility Methods
+
+    def get_user_index(self, email):
+        emailBytes = self.encode_email(email)
+        segment = self.get_user_segment(emailBytes)
+        with self.userLocks[segment]:
+            return self.find_user(emailBytes, segment, False)
+
+    def is_revoked(self, token):
+        # A token is revoked once its user's generation moves past its own
+        return uint32.unpack_from(self.buffer, self.get_user_offset(token[1]) + userGenerationOffset)[0] != token[3]
+
+    def encode_email(self, email):
+        emailBytes = email.encode('utf8')
+        if len(emailBytes) > self.__maxEmailLength__:
+            raise Exception('Email ' + email + ' too long')
+        return emailBytes
+
+    def get_user_segment(self, emailBytes):
+        return zlib.crc32(emailBytes) % self.segmentCount
+
+    def get_token_offset(self, index):
+        return self.tokensOffset + index * tokenSlot.size
+
+    def get_user_offset(self, index):
+        return self.usersOffset + index * userSlot.size
+
+    def add_segment_count(self, countsOffset, segment, change):
+        offset = countsOffset + segment * uint32.size
+        uint32.pack_into(self.buffer, offset, uint32.unpack_from(self.buffer, offset)[0] + change)
+
+    def clear_deleted_slots(self, index, segment, segmentSize, get_offset, stateOffset):
+        # A deleted slot followed by an empty one ends every probe through it, so it can be emptied, along with any
+        # deleted slots before it; this keeps probes short as entries come and go
+        segmentStart = segment * segmentSize
+        position = index - segmentStart
+        if self.buffer[get_offset(segmentStart + (position + 1) % segmentSize) + stateOffset] != emptySlot:
+            return
+
+        for _ in range(segmentSize):
+            offset = get_offset(segmentStart + position)
+            if self.buffer[offset + stateOffset] != deletedSlot:
+                break
+            self.buffer[offset + stateOffset] = emptySlot
+            position = (position - 1) % segmentSize
+
+
+def is_process_alive(processId):
+    try:
+        os.kill(processId, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
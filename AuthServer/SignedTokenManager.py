@@ -0,0 +1,255 @@
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import sys
+import time
+from AuthServer.RevocationSet import RevocationSet, SharedRevocationSet
+from AuthServer.SharedSessionStore import SharedSessionStore
+from AuthServer.TokenManager import TokenManager
+
+# Manages stateless tokens, signed with a secret key, as an alternative to holding every session in a session store
+#
+# A token carries its session's ID, the time the session was opened, the time the token was issued, the number of times
+# the session has been rotated, and the user's email, followed by an HMAC-SHA256 signature of all of them, truncated to
+# 16 bytes. A token is validated from its own contents, without a lookup, so validation doesn't depend on where the
+# session was opened. It expires 15 minutes after the session was opened, or 12 hours after it was issued: accesses that
+# don't rotate the token can't be recorded, so inactivity is counted from the last rotation.
+#
+# Tokens are retired early through a revocation set, whose entries only last until the tokens they reject would have
+# expired anyway. Closing a session revokes its ID; rotating it revokes the earlier rotations; revoking a user's tokens
+# (on deletion, on a password change, or on request) revokes those issued before then. Revocations are held in memory,
+# so if the secret is kept across a restart, tokens revoked before it are valid again until they expire.
+#
+# Users are still locked while their tokens are changed, through the session store, which holds nothing else. Users
+# hold no count of their sessions, so their concurrent sessions aren't limited.
+#
+# Configured through environment variables:
+#   AUTHSERVER_TOKEN_MODE: "signed" for signed tokens; tokens are held in a session store by default
+#   AUTHSERVER_TOKEN_SECRET: the secret key signing the tokens; a random key by default, so tokens don't outlive the
+#     server
+#   AUTHSERVER_SHARED_REVOCATION_CAPACITY: the most revocations held, when serving from several worker processes
+
+tokenHeader = struct.Struct('<16sddI') # session ID, created, issued, rotations
+signatureLength = 16
+
+class SignedTokenManager(TokenManager):
+
+    def __init__(self, secret, tokenLifespan = 900, TokenInactiveDuration = 43200, store = None, revocations = None):
+        super().__init__(tokenLifespan, TokenInactiveDuration, store)
+        self.secret = secret
+        self.revocations = revocations if revocations is not None else RevocationSet()
+
+    def close(self):
+        super().close()
+        self.revocations.close()
+
+
+    # Token Action Methods
+
+    def create_token(self, email):
+        now = time.time()
+        return self.sign_token(os.urandom(16), email, now, now, 0)
+
+    def lock_on_token(self, token):
+        tokenData = self.read_token(token)
+        email = tokenData[1]
+
+        # Acquire lock on the user
+        self.lock_user(email)
+
+        # Verify the token, which may have been revoked while waiting for the lock
+        if not self.is_token_valid(tokenData, time.time()):
+            self.store.release_user(email)
+            raise Exception('Token ' + token + ' no longer valid')
+
+    def release_update_token(self, token, revokeOthers = False):
+        tokenData = self.get_locked_token(token)
+        try:
+            return self.rotate_token(tokenData, revokeOthers)
+        finally:
+            # Release the lock on the user, even if the revocation set is full
+            self.store.release_user(tokenData[1])
+
+    def release_token(self, token):
+        tokenData = self.get_locked_token(token)
+        self.store.release_user(tokenData[1])
+
+    def release_close_token(self, token):
+        tokenData = self.get_locked_token(token)
+        try:
+            self.revoke_session(tokenData)
+        finally:
+            self.store.release_user(tokenData[1])
+
+    def release_revoke_tokens(self, token):
+        tokenData = self.get_locked_token(token)
+        try:
+            self.revoke_user_tokens(tokenData[1])
+        finally:
+            self.store.release_user(tokenData[1])
+
+    def delete_user(self, user):
+        # Verify the user is locked
+        if not self.store.is_user_locked(user):
+            raise Exception('Token(s) for user ' + user + ' not locked')
+
+        # Revoke the tokens, then release the lock on the user
+        try:
+            self.revoke_user_tokens(user)
+        finally:
+            self.store.release_user(user)
+
+    def get_user_for_token(self, token):
+        tokenData = self.read_token(token)
+        if not self.is_token_valid(tokenData, time.time()):
+            raise Exception('Token ' + token + ' not found')
+        return tokenData[1]
+
+    def introspect_token(self, token):
+        try:
+            tokenData = self.read_token(token)
+        except Exception:
+            return None
+
+        now = time.time()
+        if not self.is_token_valid(tokenData, now):
+            return None
+
+        return (tokenData[1], self.get_token_deadline(tokenData[2], tokenData[3]) - now)
+
+
+    # User Action Methods
+
+    def verify_locked_token(self, email, token):
+        if self.get_locked_token(token)[1] != email:
+            raise Exception('Token ' + token + ' not found')
+
+    def update_locked_token(self, token, revokeOthers = False):
+        return self.rotate_token(self.get_locked_token(token), revokeOthers)
+
+    def close_locked_token(self, token):
+        self.revoke_session(self.get_locked_token(token))
+
+
+    # Expiry Methods
+
+    def reap_expired_tokens(self, maxBatchSize = 1000):
+        # Tokens expire on their own, so only the revocations of expired tokens are dropped, and counted as evicted
+        purgedCount = self.revocations.purge(time.time(), maxBatchSize)
+        self.evictedTokenCount += purgedCount
+        return purgedCount
+
+    def load_tokens(self, tokens):
+        # Sessions aren't held, so there are none to restore
+        return 0
+
+    def get_expiry_stats(self):
+        storeStats = self.store.get_stats()
+        return {
+            'evictedTokens' : self.evictedTokenCount,
+            'evictedUsers' : storeStats['evictedUsers'],
+            'queuedTokens' : self.revocations.get_count(),
+            'liveTokens' : 0,
+            'liveUsers' : storeStats['liveUsers']
+        }
+
+
+    # Handoff Methods
+
+    def add_tokens(self, tokens):
+        raise Exception('Signed tokens are not handed off')
+
+    def remove_tokens(self, keys):
+        raise Exception('Signed tokens are not handed off')
+
+
+    # Utility Methods
+
+    def sign_token(self, sessionId, email, created, issued, rotations):
+        payload = tokenHeader.pack(sessionId, created, issued, rotations) + email.encode('utf8')
+        signature = hmac.digest(self.secret, payload, 'sha256')[:signatureLength]
+        return str(base64.urlsafe_b64encode(payload + signature).rstrip(b'='), 'ascii')
+
+    def read_token(self, token):
+        # Returns the (session ID, email, created, issued, rotations) carried by a genuine token
+        try:
+            data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        except (ValueError, TypeError):
+            raise Exception('Token ' + str(token) + ' not found')
+
+        (payload, signature) = (data[:-signatureLength], data[-signatureLength:])
+        if len(payload) <= tokenHeader.size or not hmac.compare_digest(signature, hmac.digest(self.secret, payload, 'sha256')[:signatureLength]):
+            raise Exception('Token ' + token + ' not found')
+
+        (sessionId, created, issued, rotations) = tokenHeader.unpack_from(payload)
+        return (sessionId, sys.intern(str(payload[tokenHeader.size:], 'utf8')), created, issued, rotations)
+
+    def get_locked_token(self, token):
+        # Returns the data of a valid token whose user is locked
+        tokenData = self.read_token(token)
+        if not self.is_token_valid(tokenData, time.time()):
+            raise Exception('Token ' + token + ' not found')
+
+        # Verify the user is locked
+        if not self.store.is_user_locked(tokenData[1]):
+            raise Exception('Token ' + token + ' not locked')
+
+        return tokenData
+
+    def is_token_valid(self, tokenData, now):
+        (sessionId, email, created, issued, rotations) = tokenData
+        if self.get_token_deadline(created, issued) <= now:
+            return False
+
+        # The session may be closed, or rotated past this token
+        minRotations = self.revocations.get(sessionId)
+        if minRotations is not None and rotations < minRotations:
+            return False
+
+        # The user's tokens may have been revoked since this one was issued
+        revokedTime = self.revocations.get(get_user_revocation_key(email))
+        return revokedTime is None or issued >= revokedTime
+
+    def rotate_token(self, tokenData, revokeOthers):
+        # Issue the session's next token, revoking this one, and the user's other tokens if asked
+        (sessionId, email, created, issued, rotations) = tokenData
+        now = time.time()
+        if revokeOthers:
+            self.revoke_user_tokens(email, now)
+
+        self.revocations.revoke(sessionId, rotations + 1, created + self.maxTokenLifespan)
+        return self.sign_token(sessionId, email, created, now, rotations + 1)
+
+    def revoke_session(self, tokenData):
+        self.revocations.revoke(tokenData[0], float('inf'), tokenData[2] + self.maxTokenLifespan)
+
+    def revoke_user_tokens(self, email, now = None):
+        # Revoke the tokens issued before now; every one of them has expired once the lifespan has passed
+        now = now if now is not None else time.time()
+        self.revocations.revoke(get_user_revocation_key(email), now, now + self.maxTokenLifespan)
+
+
+def get_user_revocation_key(email):
+    return hashlib.blake2b(email.encode('utf8'), digest_size = 16, person = b'user').digest()
+
+def create_signed_token_manager_from_env(processCount, environ = os.environ):
+    # Returns None unless signed tokens are configured
+    if environ.get('AUTHSERVER_TOKEN_MODE', 'session') != 'signed':
+        return None
+
+    # Revocations would be held by the node a request lands on, rather than the one owning the user
+    if environ.get('AUTHSERVER_CLUSTER_FILE') is not None:
+        raise Exception('Signed tokens are not supported in cluster mode')
+
+    secret = environ.get('AUTHSERVER_TOKEN_SECRET')
+    secret = secret.encode('utf8') if secret else os.urandom(32)
+    if processCount <= 1:
+        return SignedTokenManager(secret)
+
+    # Worker processes share the user locks and the revocations; the store holds no tokens
+    return SignedTokenManager(
+        secret,
+        store = SharedSessionStore(64, int(environ.get('AUTHSERVER_SHARED_USER_CAPACITY', 1 << 18))),
+        revocations = SharedRevocationSet(int(environ.get('AUTHSERVER_SHARED_REVOCATION_CAPACITY', 1 << 18))))
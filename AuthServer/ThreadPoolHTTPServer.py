@@ -0,0 +1,39 @@
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+# HTTP server which hands each accepted connection to a fixed-size pool of worker threads
+class ThreadPoolHTTPServer(HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, server_address, RequestHandlerClass, workerCount = 8, reusePort = False):
+        # With port reuse, several worker processes can accept on the same address
+        self.reusePort = reusePort
+        self.workerCount = workerCount
+        self.executor = ThreadPoolExecutor(max_workers = workerCount, thread_name_prefix = 'AuthServerWorker')
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+
+
+    # Server Methods
+
+    def server_bind(self):
+        if self.reusePort:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        HTTPServer.server_bind(self)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        # Same as the synchronous handling, only run on a worker thread
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.executor.shutdown(wait = True)
@@ -1,154 +1,399 @@
-from datetime import datetime, timedelta
-from threading import Lock
+from threading import Event, Thread
+import sys
+import time
 import uuid
+from AuthServer.Metrics import metrics
+from AuthServer.SessionStore import LocalSessionStore
 
 # Manages the lifespan and validation of authentication tokens; supports multiple token per user, and concurrent access to those tokens
+# The sessions are kept by a session store: in the process's own memory by default, or shared between worker processes
+# (see SharedSessionStore). Tokens are keyed by their 16 raw UUID bytes, times are monotonic floats, and emails are
+# interned so all the records for a user share one string
+#
+# A user may hold a limited number of concurrent sessions, the least recently used being evicted to make room for a new
+# one. All of a user's sessions are revoked at once by moving the user to a new generation, without visiting them; the
+# revoked tokens are no longer valid, and are cleaned up by the reaper
 class TokenManager:
 
     __acquisitionTimeout__ = 5 # 5 seconds
+    __reaperRetryDelay__ = 1 # 1 second
+    __lockWaitTime__ = metrics.histogram('authserver_user_lock_wait_seconds', 'Time spent waiting on user locks')
+    __lockTimeouts__ = metrics.counter('authserver_user_lock_timeouts_total', 'User lock acquisitions that timed out')
+    __sessionEvictions__ = metrics.counter('authserver_user_session_evictions_total', 'Sessions evicted to keep users within their session limit')
 
-    def __init__(self, tokenLifespan = 900, TokenInactiveDuration = 43200):
-        self.tokens = {}
-        self.users = {}
-        self.maxTokenLifespan = timedelta(seconds = tokenLifespan) # Default is 15 minutes
-        self.maxTokenInactiveDuration = timedelta(seconds = TokenInactiveDuration) # Default is 12 hours
-    
+    def __init__(self, tokenLifespan = 900, TokenInactiveDuration = 43200, store = None, maxUserTokens = None):
+        self.store = store if store is not None else LocalSessionStore()
+        self.maxTokenLifespan = tokenLifespan # Default is 15 minutes
+        self.maxTokenInactiveDuration = TokenInactiveDuration # Default is 12 hours
+        self.maxUserTokens = maxUserTokens # Default is unlimited
 
-    # Token Action Methods
+        self.evictedTokenCount = 0
+        self.reaperThread = None
+        self.reaperStopped = Event()
 
-    def create_token(self, email):
-        # Acquire lock on user
-        userRecord = self.lock_user(email)
+        # Receives each session change, when sessions are persisted; see SessionSnapshot
+        self.changeLog = None
+
+        # Gives the shard of a user's sessions, carried in their tokens, in cluster mode; see ClusterRouter
+        self.get_shard = None
 
-        # Create a new token for the user
-        newToken = self.get_new_token()
-        newTokenRecord = TokenRecord(newToken, email)
-        self.tokens[newToken] = newTokenRecord
-        userRecord.tokens.add(newToken)
+    def close(self):
+        self.store.close()
 
-        # Release the lock
-        userRecord.lock.release()
 
-        return newToken
+    # Token Action Methods
+
+    def create_token(self, email):
+        # Acquire lock on user
+        email = sys.intern(email)
+        self.lock_user(email)
+
+        # Create a new token for the user; the store may be full, so the lock is released either way
+        newKey = self.get_new_token_key(email)
+        now = time.monotonic()
+        try:
+            # Make room within the user's limit, evicting the least recently used sessions
+            if self.maxUserTokens is not None and self.store.count_user_tokens(email) >= self.maxUserTokens:
+                for key in self.store.trim_user_tokens(email, self.maxUserTokens - 1):
+                    self.log_delete(key)
+                    self.__sessionEvictions__.increment()
+
+            self.store.add_token(newKey, email, now, now)
+            self.store.queue_expiry(newKey, self.get_token_deadline(now, now))
+            self.log_put(newKey, email, now, now)
+        finally:
+            # Release the lock
+            self.store.release_user(email)
+
+        return self.get_token_for_key(newKey)
 
     def lock_on_token(self, token):
-        (tokenRecord, _) = self.get_token_user_records(token, False)
+        key = self.get_token_key(token)
+        email = self.get_user_for_key(key, token)
 
         # Acquire lock on the user
-        userRecord = self.lock_user(tokenRecord.user)
-
-        # Verify and update the token
-        curLifespan = datetime.now() - tokenRecord.created
-        curInactiveDuration = datetime.now() - tokenRecord.lastAccessed
-        if abs(curLifespan) > self.maxTokenLifespan or abs(curInactiveDuration) > self.maxTokenInactiveDuration or tokenRecord.token != token:
-            userRecord.lock.release()
+        self.lock_user(email)
+
+        # Verify and update the token, which may have changed while waiting for the lock
+        try:
+            touched = self.touch_token(key, email)
+        except:
+            self.store.release_user(email)
+            raise
+        if not touched:
+            self.store.release_user(email)
             raise Exception('Token ' + token + ' no longer valid')
-        else:
-            tokenRecord.lastAccessed = datetime.now()
-
-    def release_update_token(self, token):
-        (tokenRecord, userRecord) = self.get_token_user_records(token, True)
 
-        # Update the token, user records
-        oldToken = tokenRecord.token
-        newToken = self.get_new_token()
+    def release_update_token(self, token, revokeOthers = False):
+        (key, tokenData) = self.get_locked_token(token)
 
-        tokenRecord.token = newToken
-        del self.tokens[oldToken]
-        self.tokens[newToken] = tokenRecord
+        # Revoke the user's other tokens if asked, e.g. on a password change, then update the token; the store may be
+        # full, so the lock on the user is released either way
+        try:
+            if revokeOthers:
+                self.revoke_user_tokens(tokenData[0])
+            newKey = self.replace_token_key(key, tokenData)
+        finally:
+            self.store.release_user(tokenData[0])
 
-        userRecord.tokens.remove(oldToken)
-        userRecord.tokens.add(newToken)
+        return self.get_token_for_key(newKey)
 
-        # Release the lock on the user
-        userRecord.lock.release()
+    def release_token(self, token):
+        (_, tokenData) = self.get_locked_token(token)
 
-        return newToken
+        # Release the lock on the user, leaving the token untouched
+        self.store.release_user(tokenData[0])
 
     def release_close_token(self, token):
-        (tokenRecord, userRecord) = self.get_token_user_records(token, True)
+        (key, tokenData) = self.get_locked_token(token)
 
-        # Update the token, user records
-        del self.tokens[token]
-        userRecord.tokens.remove(token)
+        # Remove the token, then release the lock on the user, dropping the user if it was the last token
+        try:
+            self.store.remove_token(key)
+            self.log_delete(key)
+        finally:
+            self.store.release_user(tokenData[0])
 
-        # Release the lock on the user
-        userRecord.lock.release()
+    def release_revoke_tokens(self, token):
+        (_, tokenData) = self.get_locked_token(token)
 
-    def delete_user(self, user):
-        # Get user record
-        userRecord = self.users.get(user)
-        if userRecord is None:
-            raise Exception('User ' + user + ' not found')
+        # Revoke all the user's tokens, including this one, then release the lock on the user
+        try:
+            self.revoke_user_tokens(tokenData[0])
+        finally:
+            self.store.release_user(tokenData[0])
 
+    def delete_user(self, user):
         # Verify the user is locked
-        if not userRecord.lock.locked():
+        if not self.store.is_user_locked(user):
             raise Exception('Token(s) for user ' + user + ' not locked')
 
-        # Delete the token records
-        tokensCopy = userRecord.tokens.copy()
-        for token in tokensCopy:
-            del self.tokens[token]
-
-        # Release the lock on the user, delete the user record
-        userRecord.lock.release()
-        del self.users[user]
+        # Revoke the tokens, then release the lock on the user; the user is dropped once the reaper removes them
+        try:
+            self.revoke_user_tokens(user)
+        finally:
+            self.store.release_user(user)
 
     def get_user_for_token(self, token):
-        (tokenRecord, _) = self.get_token_user_records(token, False)
-        return tokenRecord.user
+        return self.get_user_for_key(self.get_token_key(token), token)
 
+    def introspect_token(self, token):
+        # Read-only validity check, taking no locks and leaving the token untouched; returns the owner and the seconds
+        # until the token expires, or None if the token isn't valid
+        #
+        # The store reads the token consistently without locking, so a token rotated or closed meanwhile is reported as
+        # not valid
+        try:
+            key = self.get_token_key(token)
+        except Exception:
+            return None
 
-    # Utility Methods
+        tokenData = self.store.get_token(key)
+        if tokenData is None:
+            return None
+
+        (email, created, lastAccessed) = tokenData
+        expiresIn = self.get_token_deadline(created, lastAccessed) - time.monotonic()
+        if expiresIn <= 0:
+            return None
 
-    def get_new_token(self):
-        return str(uuid.uuid4())
+        return (email, expiresIn)
 
-    def get_token_user_records(self, token, verifyLocked):
-        # Get token, user records
-        tokenRecord = self.tokens.get(token)
-        if tokenRecord is None:
+
+    # User Action Methods; many tokens of a user are handled under a single lock on the user
+
+    def lock_on_user(self, email):
+        self.lock_user(sys.intern(email))
+
+    def verify_locked_token(self, email, token):
+        # Verify and update a token of the locked user, leaving the user locked either way
+        (key, tokenData) = self.get_locked_token(token)
+        if tokenData[0] != email:
             raise Exception('Token ' + token + ' not found')
+        if not self.touch_token(key, email):
+            raise Exception('Token ' + token + ' no longer valid')
 
-        userRecord = self.users[tokenRecord.user]
+    def update_locked_token(self, token, revokeOthers = False):
+        (key, tokenData) = self.get_locked_token(token)
+        if revokeOthers:
+            self.revoke_user_tokens(tokenData[0])
+        return self.get_token_for_key(self.replace_token_key(key, tokenData))
+
+    def close_locked_token(self, token):
+        (key, _) = self.get_locked_token(token)
+        self.store.remove_token(key)
+        self.log_delete(key)
+
+    def release_on_user(self, email):
+        # Release the lock on the user, dropping the user if it holds no tokens
+        if not self.store.is_user_locked(email):
+            raise Exception('User ' + email + ' not found')
+        self.store.release_user(email)
+
+
+    # Expiry Methods
+
+    def reap_expired_tokens(self, maxBatchSize = 1000):
+        # Evict up to the given number of expired tokens, returning how many were evicted
+        evictedCount = 0
+        now = time.monotonic()
+
+        for (key, email) in self.store.get_expired_tokens(now, maxBatchSize, self.get_token_deadline):
+            # Evict the token, without waiting on a user busy with a request
+            if not self.store.lock_user(email, 0):
+                self.store.queue_expiry(key, now + self.__reaperRetryDelay__)
+                continue
+
+            # Check the token again under the lock, requeueing it if it was accessed meanwhile; revoked tokens are removed
+            # outright
+            try:
+                tokenData = self.store.get_token(key)
+                if tokenData is None:
+                    if self.store.remove_revoked_token(key):
+                        evictedCount += 1
+                elif tokenData[0] == email:
+                    deadline = self.get_token_deadline(tokenData[1], tokenData[2])
+                    if deadline <= now:
+                        self.store.remove_token(key)
+                        evictedCount += 1
+                    else:
+                        self.store.queue_expiry(key, deadline)
+            finally:
+                self.store.release_user(email)
+
+        self.evictedTokenCount += evictedCount
+        return evictedCount
+
+    def load_tokens(self, tokens):
+        # Load restored sessions, given as (key, email, created, last accessed) with monotonic times, before serving;
+        # returns how many were loaded. Evictions of expired tokens aren't logged, since restoring drops them anyway
+        internedTokens = ((key, sys.intern(email), created, lastAccessed) for (key, email, created, lastAccessed) in tokens)
+        return self.store.load_tokens(internedTokens, self.get_token_deadline)
+
+    def start_reaper(self, interval = 1):
+        # Periodically evict expired tokens on a background thread
+        def run_reaper():
+            while not self.reaperStopped.wait(interval):
+                while self.reap_expired_tokens() > 0:
+                    pass
+
+        self.reaperStopped.clear()
+        self.reaperThread = Thread(target = run_reaper, name = 'TokenReaper', daemon = True)
+        self.reaperThread.start()
+
+    def stop_reaper(self):
+        self.reaperStopped.set()
+        if self.reaperThread is not None:
+            self.reaperThread.join()
+            self.reaperThread = None
+
+    def get_expiry_stats(self):
+        storeStats = self.store.get_stats()
+        return {
+            'evictedTokens' : self.evictedTokenCount,
+            'evictedUsers' : storeStats['evictedUsers'],
+            'queuedTokens' : storeStats['queuedTokens'],
+            'liveTokens' : storeStats['liveTokens'],
+            'liveUsers' : storeStats['liveUsers']
+        }
+
+
+    # Handoff Methods; sessions are moved between the nodes of a cluster as (key, email, created, last accessed)
+
+    def add_tokens(self, tokens):
+        # Add sessions handed over by another node, leaving any already held; returns how many were added
+        addedCount = 0
+        now = time.monotonic()
+
+        for (key, email, created, lastAccessed) in tokens:
+            deadline = self.get_token_deadline(created, lastAccessed)
+            if deadline <= now:
+                continue
+
+            email = sys.intern(email)
+            self.lock_user(email)
+            try:
+                if self.store.get_token(key) is None:
+                    self.store.add_token(key, email, created, lastAccessed)
+                    self.store.queue_expiry(key, deadline)
+                    self.log_put(key, email, created, lastAccessed)
+                    addedCount += 1
+            finally:
+                self.store.release_user(email)
+
+        return addedCount
+
+    def remove_tokens(self, keys):
+        # Remove sessions to hand them over to another node, each under its user's lock so requests in flight finish
+        # first; returns the sessions removed
+        removedTokens = []
+
+        for key in keys:
+            tokenData = self.store.get_token(key)
+            if tokenData is None or not self.store.lock_user(tokenData[0], self.__acquisitionTimeout__):
+                continue
+
+            # Check the token again under the lock, in case it was closed or rotated meanwhile
+            email = tokenData[0]
+            try:
+                tokenData = self.store.get_token(key)
+                if tokenData is not None and tokenData[0] == email:
+                    self.store.remove_token(key)
+                    self.log_delete(key)
+                    removedTokens.append((key, ) + tokenData)
+            finally:
+                self.store.release_user(email)
+
+        return removedTokens
+
+
+    # Utility Methods
+
+    def get_new_token_key(self, email):
+        # In cluster mode, the first two bytes carry the shard of the user's sessions, so any node can route the token;
+        # they're random bytes of a UUID either way
+        key = uuid.uuid4().bytes
+        if self.get_shard is None:
+            return key
+        return self.get_shard(email).to_bytes(2, 'big') + key[2:]
+
+    def get_token_key(self, token):
+        # Tokens are handed out in their UUID string form, but kept as raw bytes
+        try:
+            return uuid.UUID(token).bytes
+        except (ValueError, TypeError, AttributeError):
+            raise Exception('Token ' + str(token) + ' not found')
+
+    def get_token_for_key(self, key):
+        return str(uuid.UUID(bytes = key))
+
+    def get_user_for_key(self, key, token):
+        tokenData = self.store.get_token(key)
+        if tokenData is None:
+            raise Exception('Token ' + token + ' not found')
+        return tokenData[0]
+
+    def get_locked_token(self, token):
+        # Returns the key and (email, created, last accessed) of a token whose user is locked
+        key = self.get_token_key(token)
+        tokenData = self.store.get_token(key)
+        if tokenData is None:
+            raise Exception('Token ' + token + ' not found')
 
         # Verify the user is locked
-        if verifyLocked and not userRecord.lock.locked():
+        if not self.store.is_user_locked(tokenData[0]):
             raise Exception('Token ' + token + ' not locked')
 
-        return (tokenRecord, userRecord)
+        return (key, tokenData)
 
     def lock_user(self, email):
-        # Acquire lock on user
-        userRecord = self.users.get(email)
+        startTime = time.perf_counter()
+        locked = self.store.lock_user(email, self.__acquisitionTimeout__)
+        self.__lockWaitTime__.observe(time.perf_counter() - startTime)
 
-        if userRecord is None:
-            userRecord = UserRecord()
-            self.users[email] = userRecord
-
-        if not userRecord.lock.acquire(self.__acquisitionTimeout__):
+        if not locked:
+            self.__lockTimeouts__.increment()
             raise Exception('Failed to get lock for user ' + email)
 
-        # Revalidate user is available, in case the user was deleted while waiting for the lock
-        if email not in self.users:
-            raise Exception('User ' + email + ' no longer available')
+    def touch_token(self, key, email):
+        # Update the token's last access, returning False instead if it expired, or was closed or rotated
+        tokenData = self.store.get_token(key)
+        if tokenData is None or tokenData[0] != email:
+            return False
+
+        now = time.monotonic()
+        (_, created, lastAccessed) = tokenData
+        if now - created > self.maxTokenLifespan or now - lastAccessed > self.maxTokenInactiveDuration:
+            return False
+
+        self.store.touch_token(key, now)
+        return True
 
-        return userRecord
+    def replace_token_key(self, key, tokenData):
+        # Give the token a new key, returning it
+        (email, created, lastAccessed) = tokenData
+        newKey = self.get_new_token_key(email)
+        self.store.replace_token(key, newKey)
 
+        self.log_delete(key)
+        self.log_put(newKey, email, created, lastAccessed)
 
-# Record for a single token, including information on its lifespan
-class TokenRecord:
+        return newKey
 
-    def __init__(self, token, user):
-        self.token = token
-        self.user = user
-        self.created = datetime.now()
-        self.lastAccessed = datetime.now()
+    def revoke_user_tokens(self, email):
+        # Invalidate all the user's tokens, which is logged like deleting the user's sessions
+        self.store.revoke_user_tokens(email)
+        if self.changeLog is not None:
+            self.changeLog.log_delete_user(email)
 
+    def get_token_deadline(self, created, lastAccessed):
+        # The token expires at the earlier of its lifespan and inactivity deadlines
+        return min(created + self.maxTokenLifespan, lastAccessed + self.maxTokenInactiveDuration)
 
-# Record for a single user, including the associated tokens and concurrency lock
-class UserRecord:
+    def log_put(self, key, email, created, lastAccessed):
+        if self.changeLog is not None:
+            self.changeLog.log_put(key, email, created, lastAccessed)
 
-    def __init__(self):
-        self.lock = Lock()
-        self.tokens = set()
+    def log_delete(self, key):
+        if self.changeLog is not None:
+            self.changeLog.log_delete(key)
@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Bounded LRU cache of user rows by email, with entries expiring after a TTL; unknown emails are cached too, as None,
+# so repeated lookups of missing users skip the database as well
+#
+# The user manager invalidates an email after each write to it. So that a lookup racing a write can't cache the row as
+# it was before the write, rows read from the database are only stored if no invalidation happened since the read began
+class UserCache:
+
+    def __init__(self, maxSize = 100000, ttl = 60):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict() # email to (row, expiry time)
+        self.lock = Lock()
+        self.invalidationCount = 0
+        self.hitCount = 0
+        self.missCount = 0
+
+
+    # Cache Methods
+
+    def get(self, email):
+        # Returns a (hit, row) pair, where the row is None for a cached unknown email
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(email)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(email)
+                self.hitCount += 1
+                return (True, entry[0])
+
+            if entry is not None:
+                del self.entries[email]
+            self.missCount += 1
+            return (False, None)
+
+    def get_version(self):
+        # Taken before reading a row from the database, then given to put
+        return self.invalidationCount
+
+    def put(self, email, row, version):
+        with self.lock:
+            if version != self.invalidationCount:
+                return
+
+            self.entries[email] = (row, time.monotonic() + self.ttl)
+            self.entries.move_to_end(email)
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last = False)
+
+    def invalidate(self, email):
+        with self.lock:
+            self.invalidationCount += 1
+            self.entries.pop(email, None)
+
+    def get_stats(self):
+        return {
+            'hits' : self.hitCount,
+            'misses' : self.missCount,
+            'size' : len(self.entries)
+        }
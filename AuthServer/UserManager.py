@@ -1,79 +1,128 @@
 import sqlite3
 import uuid
 import codecs
-import hashlib
+import hmac
 import os
+import time
+from AuthServer.ConnectionPool import ConnectionPool
+from AuthServer import HashingExecutor
+from AuthServer.Metrics import metrics
+from AuthServer.UserWriter import execute_write
 
 # Manages the persistance of user data
 class UserManager:
 
-    def __init__(self, db):
+    __hashTime__ = metrics.histogram('authserver_password_hash_seconds', 'Time spent hashing passwords')
+    __readTime__ = metrics.histogram('authserver_sql_seconds', 'Time spent in SQLite queries', operation = 'read')
+    __writeTime__ = metrics.histogram('authserver_sql_seconds', 'Time spent in SQLite queries', operation = 'write')
+
+    def __init__(self, db, hashingExecutor = None, userWriter = None, userCache = None):
+        # Either a single connection, or a pool handing out a connection per thread
         self.db = db
 
+        # Passwords are hashed inline when no executor is given
+        self.hashingExecutor = hashingExecutor
+
+        # Writes are committed one at a time when no writer is given
+        self.userWriter = userWriter
+
+        # Every lookup reads the database when no cache is given
+        self.userCache = userCache
+
 
     # Query Methods
 
     def create_user(self, name, email, password):
-        # Check for the existence of the user
-        if self.get_user_count(email) > 0:
-            raise Exception('User ' + email + ' already exists')
+        # Skip the hashing for users known to exist already
+        if self.userCache is not None:
+            (hit, row) = self.userCache.get(email)
+            if hit and row is not None:
+                raise Exception('User ' + email + ' already exists')
 
-        # Insert the new user
+        # Insert the new user, unless one already exists with the email
         salt = self.get_new_salt()
         hashedPassword = self.hash_password(password, salt)
-        cursor = self.db.cursor()
-        cursor.execute('''
-            INSERT INTO 
-                Users 
-            VALUES 
-                (?, ?, ?, ?)''',
-            (name, email, hashedPassword, salt))
-
-        self.db.commit()
+        try:
+            rowcount = self.write_user(email, '''
+                INSERT INTO 
+                    Users 
+                SELECT 
+                    ?, ?, ?, ?
+                WHERE NOT EXISTS 
+                    (SELECT 1 FROM Users WHERE Email = ?)''',
+                (name, email, hashedPassword, salt, email))
+        except sqlite3.IntegrityError:
+            rowcount = 0
+
+        if rowcount < 1:
+            raise Exception('User ' + email + ' already exists')
     
     def validate_credentials(self, email, password):
         # Check for the existence of the user
-        cursor = self.db.cursor()
-        cursor.execute('SELECT * FROM Users WHERE Email = ?', (email, ))
-        
-        result = cursor.fetchone()
+        result = self.get_user_row(email)
         if result is None:
             return False
         (_, _, dbPassword, salt) = result
 
-        # Validate the password
+        # Validate the password; older rows may hold the hash as bytes rather than text
+        if isinstance(dbPassword, bytes):
+            dbPassword = dbPassword.decode('ascii')
         hashedPassword = self.hash_password(password, salt)
-        return hashedPassword == dbPassword
-
-        return False
+        return hmac.compare_digest(hashedPassword, dbPassword)
 
     def update_user(self, name, email, password):
-        # Check for the existence of the user
-        if self.get_user_count(email) < 1:
+        if name is None and password is None:
+            # Nothing to update, but the user should still exist
+            if self.get_user_count(email) < 1:
+                raise Exception('User ' + email + ' does not already exists')
+            return
+
+        # Update the user
+        (statement, values) = self.get_update_write(name, email, password)
+        rowcount = self.write_user(email, statement, values)
+
+        if rowcount < 1:
+            raise Exception('User ' + email + ' does not already exists')
+
+    def delete_user(self, email):
+        # Delete the user
+        rowcount = self.write_user(email, 'DELETE FROM Users WHERE Email = ?', (email, ))
+
+        if rowcount < 1:
             raise Exception('User ' + email + ' does not already exists')
 
-        # Define the update values
+    def begin_batch(self):
+        # Changes queued on the batch are committed together, in one transaction
+        return UserBatch(self)
+
+
+    # Utility Methods
+
+    def get_db(self):
+        if isinstance(self.db, ConnectionPool):
+            return self.db.get_connection()
+        else:
+            return self.db
+
+    def get_update_write(self, name, email, password, passwordHash = None):
+        # Define the update values; at least one of the name and password is given. The password is hashed here,
+        # unless its (hash, salt) is given
         setSQL = None
         newValues = None
-        if email is None and password is None:
-            return
-        elif password is None:
+        if password is not None:
+            (hashedPassword, salt) = passwordHash or self.hash_new_passwords([password])[0]
+
+        if password is None:
             setSQL = 'Name = ?'
             newValues = (name, email)
         elif name is None:
-            salt = self.get_new_salt()
-            hashedPassword = self.hash_password(password, salt)
             setSQL = 'PasswordHash = ?, PasswordSalt = ?'
             newValues = (hashedPassword, salt, email)
         else:
-            salt = self.get_new_salt()
-            hashedPassword = self.hash_password(password, salt)
             setSQL = 'Name = ?, PasswordHash = ?, PasswordSalt = ?'
             newValues = (name, hashedPassword, salt, email)
-        
-        # Update the user
-        cursor = self.db.cursor()
-        cursor.execute('''
+
+        return ('''
             UPDATE 
                 Users
             SET
@@ -82,27 +131,86 @@ class UserManager:
                 Email = ?''' % setSQL,
             newValues)
 
-        self.db.commit()
+    def write(self, statement, values):
+        # Writes go through the batching writer when there is one, and are committed immediately otherwise
+        startTime = time.perf_counter()
+        try:
+            if self.userWriter is not None:
+                return self.userWriter.write(statement, values)
 
-    def delete_user(self, email):
-        # Check for the existence of the user
-        if self.get_user_count(email) < 1:
-            raise Exception('User ' + email + ' does not already exists')
+            db = self.get_db()
+            cursor = db.cursor()
+            try:
+                cursor.execute(statement, values)
+                db.commit()
+            except:
+                db.rollback()
+                raise
 
-        # Delete the user
-        cursor = self.db.cursor()
-        cursor.execute('DELETE FROM Users WHERE Email = ?', (email, ))
+            return cursor.rowcount
+        finally:
+            self.__writeTime__.observe(time.perf_counter() - startTime)
 
-        self.db.commit()
+    def write_many(self, writes):
+        # Commits the (statement, values) writes in one transaction, returning a (row count, error) pair for each
+        startTime = time.perf_counter()
+        try:
+            if self.userWriter is not None:
+                return self.userWriter.write_many(writes)
 
+            db = self.get_db()
+            cursor = db.cursor()
+            try:
+                results = [execute_write(cursor, statement, values) for (statement, values) in writes]
+                db.commit()
+            except:
+                db.rollback()
+                raise
 
-    # Utility Methods
+            return results
+        finally:
+            self.__writeTime__.observe(time.perf_counter() - startTime)
+
+    def write_user(self, email, statement, values):
+        # Write to a single user, invalidating their cached row once the write is done
+        try:
+            return self.write(statement, values)
+        finally:
+            if self.userCache is not None:
+                self.userCache.invalidate(email)
+
+    def get_user_row(self, email):
+        # Returns the user's (name, email, password hash, salt) row, or None if they don't exist
+        if self.userCache is not None:
+            (hit, row) = self.userCache.get(email)
+            if hit:
+                return row
+            version = self.userCache.get_version()
+
+        startTime = time.perf_counter()
+        db = self.get_db()
+        cursor = db.cursor()
+        cursor.execute('SELECT * FROM Users WHERE Email = ?', (email, ))
+
+        result = cursor.fetchone()
+        self.__readTime__.observe(time.perf_counter() - startTime)
+
+        if self.userCache is not None:
+            self.userCache.put(email, result, version)
+        return result
 
     def get_user_count(self, email):
-        cursor = self.db.cursor()
+        # Existence checks are answered by the cache, when there is one
+        if self.userCache is not None:
+            return 0 if self.get_user_row(email) is None else 1
+
+        startTime = time.perf_counter()
+        db = self.get_db()
+        cursor = db.cursor()
         cursor.execute('SELECT COUNT(*) FROM Users WHERE Email = ?', (email, ))
 
         result = cursor.fetchone()
+        self.__readTime__.observe(time.perf_counter() - startTime)
         if result is None:
             raise Exception('Unabled to verify if the user already exists')
         (count, ) = result
@@ -110,10 +218,71 @@ class UserManager:
         return count
     
     def get_new_salt(self):
-        return codecs.encode(os.urandom(32), 'hex')
+        return codecs.encode(os.urandom(32), 'hex').decode('ascii')
+
+    def hash_new_passwords(self, passwords):
+        # Returns a (hash, new salt) for each password; many are hashed in parallel, where there's an executor
+        salts = [self.get_new_salt() for _ in passwords]
+        startTime = time.perf_counter()
+        try:
+            if self.hashingExecutor is not None and len(passwords) > 1:
+                hashedPasswords = self.hashingExecutor.hash_passwords(passwords, salts)
+            else:
+                hashedPasswords = [self.hash_password(password, salt) for (password, salt) in zip(passwords, salts)]
+        finally:
+            if len(passwords) > 1:
+                self.__hashTime__.observe(time.perf_counter() - startTime)
+        return list(zip(hashedPasswords, salts))
 
     def hash_password(self, password, salt):
-        passwordBytes = password.encode('utf-8')
-        saltBytes = codecs.decode(salt, 'hex')
-        derived_key = hashlib.pbkdf2_hmac('sha256', passwordBytes, saltBytes, 100000)
-        return codecs.encode(derived_key, 'hex')
\ No newline at end of file
+        startTime = time.perf_counter()
+        try:
+            if self.hashingExecutor is not None:
+                return self.hashingExecutor.hash_password(password, salt)
+            else:
+                return HashingExecutor.hash_password(password, salt)
+        finally:
+            self.__hashTime__.observe(time.perf_counter() - startTime)
+
+
+# Changes to many users, queued then committed in one transaction; each change succeeds or fails on its own
+class UserBatch:
+
+    def __init__(self, userManager):
+        self.userManager = userManager
+        self.writes = []
+        self.errors = []
+
+    def update_user(self, name, email, password, passwordHash = None):
+        # Returns the index of the change's error in the commit results; the password's (hash, salt) may be given, so
+        # it's hashed ahead of time
+        self.errors.append(None)
+        if name is None and password is None:
+            # Nothing to update, but the user should still exist
+            if self.userManager.get_user_count(email) < 1:
+                self.errors[-1] = Exception('User ' + email + ' does not already exists')
+        else:
+            self.writes.append((len(self.errors) - 1, email, self.userManager.get_update_write(name, email, password, passwordHash)))
+        return len(self.errors) - 1
+
+    def delete_user(self, email):
+        self.errors.append(None)
+        self.writes.append((len(self.errors) - 1, email, ('DELETE FROM Users WHERE Email = ?', (email, ))))
+        return len(self.errors) - 1
+
+    def commit(self):
+        # Returns the error for each change, in the order queued, or None where the change succeeded
+        if self.writes:
+            try:
+                results = self.userManager.write_many([write for (_, _, write) in self.writes])
+            finally:
+                if self.userManager.userCache is not None:
+                    for (_, email, _) in self.writes:
+                        self.userManager.userCache.invalidate(email)
+            for ((index, email, _), (rowcount, error)) in zip(self.writes, results):
+                if error is not None:
+                    self.errors[index] = error
+                elif rowcount < 1:
+                    self.errors[index] = Exception('User ' + email + ' does not already exists')
+
+        return self.errors
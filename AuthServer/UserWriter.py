@@ -0,0 +1,107 @@
+import queue
+from concurrent.futures import Future, TimeoutError
+from threading import Thread
+
+# Funnels user writes through a dedicated thread, which commits them in batches so that many writes share one fsync
+class UserWriter:
+
+    __maxBatchSize__ = 256
+    __maxBatchDelay__ = 0.002 # 2 milliseconds
+    __writeTimeout__ = 10 # 10 seconds
+
+    def __init__(self, db, maxBatchSize = None, maxBatchDelay = None, writeTimeout = None):
+        # A connection pool; the writer thread draws its own connection from it
+        self.db = db
+        self.maxBatchSize = maxBatchSize or self.__maxBatchSize__
+        self.maxBatchDelay = maxBatchDelay if maxBatchDelay is not None else self.__maxBatchDelay__
+        self.writeTimeout = writeTimeout or self.__writeTimeout__
+        self.pendingWrites = queue.Queue()
+        self.batchCount = 0
+        self.writeCount = 0
+
+        self.writerThread = Thread(target = self.run_writer, name = 'UserWriter', daemon = True)
+        self.writerThread.start()
+
+
+    # Write Methods
+
+    def write(self, statement, values):
+        # Queue the write, then wait for its batch to commit; returns the affected row count, or raises the write's error
+        [(rowcount, error)] = self.write_many([(statement, values)])
+        if error is not None:
+            raise error
+        return rowcount
+
+    def write_many(self, writes):
+        # Queue the (statement, values) writes together, so they commit in the same transaction, then wait for it;
+        # returns a (row count, error) pair for each write, or raises if the commit fails or takes too long; writes given
+        # up on may still commit later
+        future = Future()
+        self.pendingWrites.put((writes, future))
+        try:
+            return future.result(self.writeTimeout)
+        except TimeoutError:
+            raise Exception('Timed out waiting for the write to commit')
+
+    def shutdown(self):
+        self.pendingWrites.put(None)
+        self.writerThread.join()
+
+
+    # Writer Thread Methods
+
+    def run_writer(self):
+        db = self.db.get_connection()
+
+        while True:
+            # Wait for a write, then gather more until the batch is full or the delay is up
+            write = self.pendingWrites.get()
+            if write is None:
+                return
+
+            batch = [write]
+            stopping = False
+            while len(batch) < self.maxBatchSize:
+                try:
+                    write = self.pendingWrites.get(timeout = self.maxBatchDelay)
+                except queue.Empty:
+                    break
+                if write is None:
+                    stopping = True
+                    break
+                batch.append(write)
+
+            self.commit_batch(db, batch)
+            if stopping:
+                return
+
+    def commit_batch(self, db, batch):
+        # Apply each write in the one transaction; a failed write is rolled back on its own, leaving the rest of the batch
+        cursor = db.cursor()
+        results = []
+        for (writes, future) in batch:
+            results.append((future, [execute_write(cursor, statement, values) for (statement, values) in writes]))
+
+        # Commit the batch; if that fails, every write in it fails
+        try:
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            for (future, _) in results:
+                future.set_exception(e)
+            return
+
+        self.batchCount += 1
+        self.writeCount += sum(len(writes) for (writes, _) in batch)
+
+        for (future, writeResults) in results:
+            future.set_result(writeResults)
+
+
+# Executes a write, returning a (row count, error) pair
+def execute_write(cursor, statement, values):
+    try:
+        cursor.execute(statement, values)
+        return (cursor.rowcount, None)
+    except Exception as e:
+        return (None, e)
@@ -0,0 +1,78 @@
+import os
+import signal
+import sys
+from AuthServer.SharedSessionStore import SharedSessionStore
+
+# Serves from several worker processes, so session requests scale across cores rather than share one interpreter
+#
+# The sessions are kept in a SharedSessionStore, and each worker accepts connections on the same port through
+# SO_REUSEPORT, leaving the kernel to spread them across the workers. The starting process creates the store, forks the
+# workers, then supervises them: it evicts expired sessions and snapshots them, if persisted, until the workers exit.
+# Changes aren't logged between snapshots, since they're made by the workers.
+#
+# Configured through environment variables:
+#   AUTHSERVER_PROCESS_COUNT: the number of worker processes; with 1, the default, the server runs in a single process
+#     with the sessions in its own memory
+#   AUTHSERVER_SHARED_TOKEN_CAPACITY: the most sessions the shared store holds
+#   AUTHSERVER_SHARED_USER_CAPACITY: the most users holding sessions the shared store holds
+
+
+def get_process_count(environ = os.environ):
+    return int(environ.get('AUTHSERVER_PROCESS_COUNT', 1))
+
+def create_session_store_from_env(processCount, environ = os.environ):
+    # Returns the shared store to serve from several processes, or None for the default, in-process one
+    if processCount <= 1:
+        return None
+
+    return SharedSessionStore(
+        int(environ.get('AUTHSERVER_SHARED_TOKEN_CAPACITY', 1 << 20)),
+        int(environ.get('AUTHSERVER_SHARED_USER_CAPACITY', 1 << 18)))
+
+def run_worker_processes(processCount, tokenManager, sessionSnapshotter = None):
+    # Fork the workers, returning in each of them; this process supervises them, and exits once they have. Must be
+    # called before any threads are started.
+    workerIds = []
+    for _ in range(processCount):
+        processId = os.fork()
+        if processId == 0:
+            return
+        workerIds.append(processId)
+
+    tokenManager.start_reaper()
+    if sessionSnapshotter is not None:
+        sessionSnapshotter.start(logChanges = False)
+
+    # Stop on SIGTERM as on an interrupt, stopping the workers in turn
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Relay SIGHUP to the workers, which reload the cluster membership on it
+    def relay_signal(signum, frame):
+        for processId in workerIds:
+            try:
+                os.kill(processId, signum)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGHUP, relay_signal)
+    try:
+        while workerIds:
+            os.waitpid(workerIds[0], 0)
+            workerIds.pop(0)
+    finally:
+        for processId in workerIds:
+            try:
+                os.kill(processId, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for processId in workerIds:
+            try:
+                os.waitpid(processId, 0)
+            except ChildProcessError:
+                pass
+
+        tokenManager.stop_reaper()
+        if sessionSnapshotter is not None:
+            sessionSnapshotter.stop()
+        tokenManager.close()
+
+    sys.exit(0)
@@ -0,0 +1,121 @@
+import sys
+import argparse
+import json
+import os
+from AuthServerBench import TokenManagerBench
+from AuthServerBench import UserManagerBench
+
+# Runs the microbenchmarks, comparing their throughput against the JSON baseline for the scale, if there is one, and
+# flagging those that regressed beyond the threshold; exits with status 1 if any did
+#   python -m AuthServerBench.BenchRunner [--scale small|large] [--threshold 0.2] [--update-baseline] [--filter text]
+#
+# Baselines are absolute rates, so they only mean something on the machine that recorded them; none are kept in the
+# repository. Record one with --update-baseline, e.g. before a change, to compare against on the same machine
+
+
+# Sizes for a benchmark run
+class BenchScale:
+
+    def __init__(self, name, userCount, operationCount, writeCount, hashCount, threadCount, tokensPerUser):
+        self.name = name
+        self.userCount = userCount
+        self.operationCount = operationCount
+        self.writeCount = writeCount
+        self.hashCount = hashCount
+        self.threadCount = threadCount
+        self.tokensPerUser = tokensPerUser
+
+
+__scales__ = {
+    'small' : BenchScale('small', 10000, 20000, 200, 10, 8, 10000),
+    'large' : BenchScale('large', 1000000, 100000, 1000, 20, 32, 100000)
+}
+
+__baselineDirectory__ = os.path.join(os.path.dirname(__file__), 'baselines')
+
+
+def run_benchmarks(scale, repeatCount, nameFilter):
+    # Run each benchmark, keeping its best throughput
+    results = {}
+    for (name, benchmark) in TokenManagerBench.__benchmarks__ + UserManagerBench.__benchmarks__:
+        if nameFilter and nameFilter not in name:
+            continue
+
+        bestRate = 0
+        for _ in range(repeatCount):
+            (operationCount, elapsed) = benchmark(scale)
+            bestRate = max(bestRate, operationCount / elapsed)
+
+        results[name] = round(bestRate, 2)
+        print('%-56s %14.2f ops/s' % (name, bestRate))
+
+    return results
+
+
+def compare_results(results, baseline, threshold):
+    # Returns the names of the benchmarks slower than their baseline by more than the threshold
+    regressions = []
+    for (name, rate) in results.items():
+        baselineRate = baseline.get(name)
+        if baselineRate is None:
+            print('%-56s no baseline' % name)
+            continue
+
+        change = (rate - baselineRate) / baselineRate
+        regressed = change < -threshold
+        if regressed:
+            regressions.append(name)
+        print('%-56s %+8.1f%%%s' % (name, change * 100, '  REGRESSION' if regressed else ''))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Microbenchmarks for the TokenManager and UserManager hot paths')
+    parser.add_argument('--scale', choices = sorted(__scales__), default = 'small')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'fractional slowdown to flag as a regression')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'runs per benchmark, keeping the best')
+    parser.add_argument('--filter', help = 'only run benchmarks whose name contains the text')
+    parser.add_argument('--baseline', help = 'baseline file; defaults to baselines/<scale>.json')
+    parser.add_argument('--update-baseline', action = 'store_true', help = 'store the results as the new baseline')
+    args = parser.parse_args()
+
+    scale = __scales__[args.scale]
+    baselineFile = args.baseline or os.path.join(__baselineDirectory__, scale.name + '.json')
+
+    try:
+        results = run_benchmarks(scale, args.repeat, args.filter)
+    finally:
+        UserManagerBench.userDatabases.cleanup()
+
+    # Store the new baseline, merging with results for benchmarks not run this time
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(baselineFile):
+            with open(baselineFile) as input:
+                baseline = json.load(input)
+        baseline.update(results)
+
+        os.makedirs(os.path.dirname(baselineFile) or '.', exist_ok = True)
+        with open(baselineFile, 'w') as output:
+            json.dump(baseline, output, indent = 2, sort_keys = True)
+            output.write('\n')
+        print('Baseline written to ' + baselineFile)
+        return
+
+    # Compare against the baseline
+    if not os.path.exists(baselineFile):
+        print('No baseline at ' + baselineFile + '; run with --update-baseline on this machine to record one')
+        return
+
+    with open(baselineFile) as input:
+        baseline = json.load(input)
+
+    print()
+    regressions = compare_results(results, baseline, args.threshold)
+    if regressions:
+        print('%d benchmark(s) regressed by more than %d%%' % (len(regressions), args.threshold * 100))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+import sys
+import argparse
+import http.client
+import json
+import random
+import signal
+import socket
+import ssl
+import subprocess
+import time
+import uuid
+from threading import Lock, Thread
+
+# Drives an AuthServer over TLS with concurrent clients, reporting throughput and latency percentiles per endpoint as JSON
+#
+# Clients either run a synthetic register/login/update/logout/delete mix, or replay a JSONL request log holding
+# { "method", "path", "body" } per line, where "$token" in a body is replaced with the client's latest session token:
+#   python -m AuthServerBench.LoadBench --port 4443 --concurrency 16 --duration 30
+#   python -m AuthServerBench.LoadBench --port 4443 --replay requests.jsonl --output results.json
+#   python -m AuthServerBench.LoadBench --launch async --db ./bench.db --key ./key.pem --cert ./cert.pem
+
+
+# Latency and error tallies for each endpoint, shared by the client threads
+class LoadResults:
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.lock = Lock()
+
+    def record(self, path, latency, success):
+        with self.lock:
+            self.latencies.setdefault(path, []).append(latency)
+            if not success:
+                self.errors[path] = self.errors.get(path, 0) + 1
+
+    def summarize(self, elapsed):
+        endpoints = {}
+        allLatencies = []
+        for (path, latencies) in sorted(self.latencies.items()):
+            endpoints[path] = summarize_latencies(latencies, self.errors.get(path, 0), elapsed)
+            allLatencies.extend(latencies)
+
+        return {
+            'endpoints' : endpoints,
+            'total' : summarize_latencies(allLatencies, sum(self.errors.values()), elapsed)
+        }
+
+
+# A single client, holding one connection open for as long as the server allows
+class LoadClient:
+
+    def __init__(self, host, port, results, timeout = 30):
+        self.host = host
+        self.port = port
+        self.results = results
+        self.timeout = timeout
+        self.connection = None
+        self.token = None
+
+        # The server's certificate is self-signed
+        self.sslContext = ssl.create_default_context()
+        self.sslContext.check_hostname = False
+        self.sslContext.verify_mode = ssl.CERT_NONE
+
+    def request(self, method, path, body):
+        # Send the request, returning the reply body on success, or None otherwise
+        payload = bytes(json.dumps(body), 'utf8')
+        startTime = time.perf_counter()
+        success = False
+        reply = None
+
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPSConnection(self.host, self.port, timeout = self.timeout, context = self.sslContext)
+            self.connection.request(method, path, payload, { 'Content-Type' : 'text/plain' })
+            response = self.connection.getresponse()
+            replyBody = response.read()
+            success = response.status == 200
+
+            if success and replyBody:
+                reply = json.loads(replyBody)
+            elif success:
+                reply = {}
+
+            if response.will_close:
+                self.close()
+
+        except (OSError, http.client.HTTPException, ValueError):
+            self.close()
+
+        self.results.record(path, time.perf_counter() - startTime, success)
+        if reply is not None and 'token' in reply:
+            self.token = reply['token']
+        return reply
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+    # Workloads
+
+    def run_synthetic(self, shouldStop):
+        # Cycle through the lifetime of a user: register, login, a few updates, logout, login again, then delete
+        while not shouldStop():
+            email = 'bench-%s@foo.bar' % uuid.uuid4().hex
+            password = '1PasswordPassword!'
+
+            if self.request('POST', '/register', { 'name' : 'bench', 'email' : email, 'password' : password }) is None:
+                continue
+            if self.request('POST', '/login', { 'email' : email, 'password' : password }) is None:
+                continue
+
+            for _ in range(random.randint(1, 4)):
+                if self.request('POST', '/update', { 'name' : 'bench', 'email' : email, 'token' : self.token }) is None:
+                    break
+
+            self.request('POST', '/logout', { 'token' : self.token })
+            if self.request('POST', '/login', { 'email' : email, 'password' : password }) is not None:
+                self.request('DELETE', '/delete', { 'token' : self.token })
+
+    def run_replay(self, entries, shouldStop):
+        for entry in entries:
+            if shouldStop():
+                break
+
+            body = json.loads(json.dumps(entry.get('body', {})).replace('"$token"', json.dumps(self.token)))
+            self.request(entry.get('method', 'POST'), entry['path'], body)
+
+
+# Utility Functions
+
+def percentile(sortedValues, fraction):
+    # Nearest-rank percentile
+    if not sortedValues:
+        return None
+    index = min(len(sortedValues) - 1, max(0, int(round(fraction * len(sortedValues) + 0.5)) - 1))
+    return sortedValues[index]
+
+def summarize_latencies(latencies, errorCount, elapsed):
+    latencies = sorted(latencies)
+    toMilliseconds = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        'requests' : len(latencies),
+        'errors' : errorCount,
+        'throughput' : round(len(latencies) / elapsed, 2) if elapsed > 0 else 0,
+        'meanMs' : toMilliseconds(sum(latencies) / len(latencies)) if latencies else None,
+        'p50Ms' : toMilliseconds(percentile(latencies, 0.50)),
+        'p95Ms' : toMilliseconds(percentile(latencies, 0.95)),
+        'p99Ms' : toMilliseconds(percentile(latencies, 0.99)),
+        'maxMs' : toMilliseconds(latencies[-1]) if latencies else None
+    }
+
+def load_replay_entries(replayFile):
+    with open(replayFile) as replay:
+        return [json.loads(line) for line in replay if line.strip()]
+
+def launch_server(args):
+    # Start the server as a subprocess, then wait for it to accept connections
+    module = 'AuthServer.AsyncAuthServer' if args.launch == 'async' else 'AuthServer.AuthServer'
+    # Its per-request output is discarded, so it doesn't drown out the report
+    server = subprocess.Popen(
+        [sys.executable, '-m', module, args.host, str(args.port), args.db, args.key, args.cert, str(args.workers)],
+        stdout = subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((args.host, args.port), timeout = 1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                raise Exception('Server exited during startup')
+            time.sleep(0.2)
+
+    server.kill()
+    raise Exception('Server did not start listening')
+
+def stop_server(server):
+    # Interrupt rather than terminate, so the server shuts down its hashing processes along with it
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(timeout = 10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+# Main application
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Load-generation and replay benchmark for AuthServer')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 4443)
+    parser.add_argument('--concurrency', type = int, default = 8, help = 'number of concurrent clients')
+    parser.add_argument('--duration', type = float, default = 30, help = 'seconds to run the synthetic mix for')
+    parser.add_argument('--replay', help = 'JSONL request log for each client to replay, instead of the synthetic mix')
+    parser.add_argument('--output', help = 'file to write the JSON results to; printed when omitted')
+    parser.add_argument('--launch', choices = ['threaded', 'async'], help = 'launch a local server with the given engine')
+    parser.add_argument('--db', help = 'SQLite file for the launched server')
+    parser.add_argument('--key', help = 'SSL key file for the launched server')
+    parser.add_argument('--cert', help = 'SSL cert file for the launched server')
+    parser.add_argument('--workers', type = int, default = 8, help = 'worker threads for the launched server')
+    args = parser.parse_args()
+
+    server = launch_server(args) if args.launch else None
+    try:
+        results = LoadResults()
+        replayEntries = load_replay_entries(args.replay) if args.replay else None
+        startTime = time.perf_counter()
+        shouldStop = lambda: replayEntries is None and time.perf_counter() - startTime >= args.duration
+
+        # Run the clients
+        clients = [LoadClient(args.host, args.port, results) for _ in range(args.concurrency)]
+        if replayEntries is None:
+            threads = [Thread(target = client.run_synthetic, args = (shouldStop, )) for client in clients]
+        else:
+            threads = [Thread(target = client.run_replay, args = (replayEntries, shouldStop)) for client in clients]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for client in clients:
+            client.close()
+
+        elapsed = time.perf_counter() - startTime
+
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    # Report the results
+    report = {
+        'config' : {
+            'host' : args.host,
+            'port' : args.port,
+            'concurrency' : args.concurrency,
+            'workload' : 'replay' if args.replay else 'synthetic',
+            'server' : args.launch,
+            'workers' : args.workers if args.launch else None
+        },
+        'elapsedSeconds' : round(elapsed, 3)
+    }
+    report.update(results.summarize(elapsed))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent = 2)
+    else:
+        print(json.dumps(report, indent = 2))
+
+if __name__ == '__main__':
+    main()
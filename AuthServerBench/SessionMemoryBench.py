@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import subprocess
+import time
+import tracemalloc
+from AuthServer.TokenManager import TokenManager
+
+# Measures the memory held by the TokenManager per open session, at the given session counts
+#
+# Each count is measured in a fresh process, so that one run's freed memory can't skew the next:
+#   python -m AuthServerBench.SessionMemoryBench [session count ...] [--sessions-per-user N] [--tracemalloc]
+#
+# Memory is measured as the growth in resident set size by default; --tracemalloc counts Python allocations
+# exactly instead, but runs several times slower
+
+__defaultSessionCounts__ = [1000000, 10000000]
+__defaultSessionsPerUser__ = 2
+
+
+def get_resident_bytes():
+    # Linux only; other platforms should use --tracemalloc
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(sessionCount, sessionsPerUser, useTracemalloc):
+    # Emails are built outside the measured region, as they would arrive from request input
+    userCount = max(1, sessionCount // sessionsPerUser)
+    emails = ['user%d@foo.bar' % i for i in range(userCount)]
+
+    if useTracemalloc:
+        tracemalloc.start()
+    else:
+        startBytes = get_resident_bytes()
+
+    tokenManager = TokenManager()
+    startTime = time.perf_counter()
+
+    for i in range(sessionCount):
+        tokenManager.create_token(emails[i % userCount])
+
+    elapsed = time.perf_counter() - startTime
+    if useTracemalloc:
+        (currentBytes, _) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    else:
+        currentBytes = get_resident_bytes() - startBytes
+
+    return {
+        'sessions' : sessionCount,
+        'users' : userCount,
+        'totalBytes' : currentBytes,
+        'bytesPerSession' : round(currentBytes / sessionCount, 1),
+        'createSeconds' : round(elapsed, 2),
+        'method' : 'tracemalloc' if useTracemalloc else 'rss'
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    useTracemalloc = '--tracemalloc' in args
+    if useTracemalloc:
+        args.remove('--tracemalloc')
+
+    sessionsPerUser = __defaultSessionsPerUser__
+    if '--sessions-per-user' in args:
+        index = args.index('--sessions-per-user')
+        sessionsPerUser = int(args[index + 1])
+        del args[index:index + 2]
+
+    # Measure a single count in this process
+    if '--child' in args:
+        args.remove('--child')
+        print(json.dumps(measure(int(args[0]), sessionsPerUser, useTracemalloc)))
+        return
+
+    sessionCounts = [int(arg) for arg in args] or __defaultSessionCounts__
+    for sessionCount in sessionCounts:
+        result = subprocess.run(
+            [sys.executable, '-m', 'AuthServerBench.SessionMemoryBench', '--child', str(sessionCount), '--sessions-per-user', str(sessionsPerUser)] + (['--tracemalloc'] if useTracemalloc else []),
+            capture_output = True,
+            text = True,
+            check = True)
+        print(result.stdout.strip())
+
+if __name__ == '__main__':
+    main()
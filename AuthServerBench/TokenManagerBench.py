@@ -0,0 +1,150 @@
+import multiprocessing
+import os
+import time
+from threading import Barrier, Thread
+from AuthServer.SharedSessionStore import SharedSessionStore
+from AuthServer.TokenManager import TokenManager
+
+# Microbenchmarks for the TokenManager hot paths; each returns the operations completed and the seconds they took
+
+
+def bench_create_token(scale):
+    tokenManager = TokenManager()
+    emails = ['user%d@foo.bar' % i for i in range(scale.userCount)]
+    operationCount = scale.operationCount
+
+    startTime = time.perf_counter()
+    for i in range(operationCount):
+        tokenManager.create_token(emails[i % len(emails)])
+
+    return (operationCount, time.perf_counter() - startTime)
+
+
+def bench_lock_release_update_token(scale):
+    # Each thread rotates its own token, each for a user of its own
+    return run_rotation_threads(scale, ['user%d@foo.bar' % i for i in range(scale.threadCount)])
+
+
+def bench_lock_release_update_token_contended(scale):
+    # Each thread rotates its own token, all for the same user, so they contend for the one user lock
+    return run_rotation_threads(scale, ['alice@foo.bar'] * scale.threadCount)
+
+
+def bench_lock_release_update_token_shared(scale):
+    # As above, through the shared-memory session store, within a single process
+    store = SharedSessionStore()
+    try:
+        return run_rotation_threads(scale, ['user%d@foo.bar' % i for i in range(scale.threadCount)], store)
+    finally:
+        store.close()
+
+
+def bench_lock_release_update_token_shared_processes(scale):
+    # One process per core rotates its own token, each for a user of its own, through the shared-memory session store
+    store = SharedSessionStore()
+    processCount = os.cpu_count()
+    rotationsPerProcess = scale.operationCount // processCount
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(processCount + 1)
+
+    def rotate(index):
+        tokenManager = TokenManager(store = store)
+        token = tokenManager.create_token('user%d@foo.bar' % index)
+        barrier.wait()
+        for _ in range(rotationsPerProcess):
+            tokenManager.lock_on_token(token)
+            token = tokenManager.release_update_token(token)
+
+    try:
+        processes = [context.Process(target = rotate, args = (i, )) for i in range(processCount)]
+        for process in processes:
+            process.start()
+
+        barrier.wait()
+        startTime = time.perf_counter()
+        for process in processes:
+            process.join()
+
+        return (rotationsPerProcess * processCount, time.perf_counter() - startTime)
+    finally:
+        store.close()
+
+
+def bench_introspect_token(scale):
+    # Each thread checks its own token, each for a user of its own
+    tokenManager = TokenManager()
+    tokens = [tokenManager.create_token('user%d@foo.bar' % i) for i in range(scale.threadCount)]
+    checksPerThread = scale.operationCount // len(tokens)
+    barrier = Barrier(len(tokens) + 1)
+
+    def introspect(index):
+        token = tokens[index]
+        barrier.wait()
+        for _ in range(checksPerThread):
+            tokenManager.introspect_token(token)
+
+    threads = [Thread(target = introspect, args = (i, )) for i in range(len(tokens))]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    startTime = time.perf_counter()
+    for thread in threads:
+        thread.join()
+
+    return (checksPerThread * len(tokens), time.perf_counter() - startTime)
+
+
+def bench_delete_user_many_tokens(scale):
+    # Deleting revokes the user's tokens at once, leaving them to the reaper, so it's a single operation however many
+    # tokens the user holds. The revoked tokens stay until reaped, so the user is deleted over and over, to time enough
+    # operations for a stable rate
+    tokenManager = TokenManager()
+    for _ in range(scale.tokensPerUser):
+        tokenManager.create_token('alice@foo.bar')
+    operationCount = scale.operationCount
+
+    startTime = time.perf_counter()
+    for _ in range(operationCount):
+        tokenManager.lock_on_user('alice@foo.bar')
+        tokenManager.delete_user('alice@foo.bar')
+
+    return (operationCount, time.perf_counter() - startTime)
+
+
+# Utility Functions
+
+def run_rotation_threads(scale, emails, store = None):
+    tokenManager = TokenManager(store = store)
+    tokens = [tokenManager.create_token(email) for email in emails]
+    rotationsPerThread = scale.operationCount // len(emails)
+    barrier = Barrier(len(emails) + 1)
+
+    def rotate(index):
+        token = tokens[index]
+        barrier.wait()
+        for _ in range(rotationsPerThread):
+            tokenManager.lock_on_token(token)
+            token = tokenManager.release_update_token(token)
+
+    threads = [Thread(target = rotate, args = (i, )) for i in range(len(emails))]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    startTime = time.perf_counter()
+    for thread in threads:
+        thread.join()
+
+    return (rotationsPerThread * len(emails), time.perf_counter() - startTime)
+
+
+__benchmarks__ = [
+    ('TokenManager.create_token', bench_create_token),
+    ('TokenManager.lock_release_update_token', bench_lock_release_update_token),
+    ('TokenManager.lock_release_update_token_contended', bench_lock_release_update_token_contended),
+    ('TokenManager.lock_release_update_token.shared', bench_lock_release_update_token_shared),
+    ('TokenManager.lock_release_update_token.shared_processes', bench_lock_release_update_token_shared_processes),
+    ('TokenManager.introspect_token', bench_introspect_token),
+    ('TokenManager.delete_user_many_tokens', bench_delete_user_many_tokens)
+]
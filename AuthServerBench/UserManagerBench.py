@@ -0,0 +1,107 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from AuthServer import HashingExecutor
+from AuthServer.SchemaMigrator import SchemaMigrator
+from AuthServer.UserCache import UserCache
+from AuthServer.UserManager import UserManager
+
+# Microbenchmarks for the UserManager hot paths, against in-memory and on-disk databases populated to the scale's user count;
+# each returns the operations completed and the seconds they took
+#
+# The full credential checks are dominated by PBKDF2, so the database paths are also measured on their own, with a
+# hasher that skips the key derivation
+
+__password__ = '1PasswordPassword!'
+__salt__ = '1112131415161718a1a2a3a4a5a6a7a8'
+
+
+# Stands in for the HashingExecutor, returning a fixed hash so only the database work is measured
+class FixedHasher:
+
+    def __init__(self):
+        self.hashedPassword = HashingExecutor.hash_password(__password__, __salt__)
+
+    def hash_password(self, password, salt):
+        return self.hashedPassword
+
+
+# Databases populated once per scale, and reused across benchmarks
+class UserDatabases:
+
+    def __init__(self):
+        self.databases = {}
+        self.directory = tempfile.TemporaryDirectory()
+
+    def get(self, scale, onDisk):
+        key = (scale.userCount, onDisk)
+        if key not in self.databases:
+            dbfile = os.path.join(self.directory.name, 'users%d.db' % scale.userCount) if onDisk else ':memory:'
+            db = sqlite3.connect(dbfile, check_same_thread = False)
+            SchemaMigrator(db).migrate()
+
+            # Every user shares the one password hash, so the population costs no key derivations
+            hashedPassword = HashingExecutor.hash_password(__password__, __salt__)
+            db.executemany(
+                'INSERT INTO Users VALUES (?, ?, ?, ?)',
+                (('user', 'user%d@foo.bar' % i, hashedPassword, __salt__) for i in range(scale.userCount)))
+            db.commit()
+            self.databases[key] = db
+
+        return self.databases[key]
+
+    def cleanup(self):
+        for db in self.databases.values():
+            db.close()
+        self.directory.cleanup()
+
+
+userDatabases = UserDatabases()
+
+
+def run_validate_credentials(scale, onDisk, hasher, operationCount, userCache = None):
+    userManager = UserManager(userDatabases.get(scale, onDisk), hasher, None, userCache)
+    emails = ['user%d@foo.bar' % random.randrange(scale.userCount) for _ in range(operationCount)]
+
+    # Warm the cache with the emails looked up, so only repeat logins are measured
+    if userCache is not None:
+        for email in emails:
+            userManager.get_user_row(email)
+
+    startTime = time.perf_counter()
+    for email in emails:
+        if not userManager.validate_credentials(email, __password__):
+            raise Exception('Credentials for ' + email + ' not valid')
+
+    return (operationCount, time.perf_counter() - startTime)
+
+
+def run_create_user(scale, onDisk, hasher, operationCount):
+    db = userDatabases.get(scale, onDisk)
+    userManager = UserManager(db, hasher)
+    prefix = 'new%d-' % random.randrange(1 << 30)
+
+    startTime = time.perf_counter()
+    for i in range(operationCount):
+        userManager.create_user('user', '%s%d@foo.bar' % (prefix, i), __password__)
+    elapsed = time.perf_counter() - startTime
+
+    # Leave the population as it was, for the benchmarks that follow
+    db.execute('DELETE FROM Users WHERE Email LIKE ?', (prefix + '%', ))
+    db.commit()
+
+    return (operationCount, elapsed)
+
+
+__benchmarks__ = [
+    ('UserManager.validate_credentials.memory', lambda scale: run_validate_credentials(scale, False, None, scale.hashCount)),
+    ('UserManager.validate_credentials.disk', lambda scale: run_validate_credentials(scale, True, None, scale.hashCount)),
+    ('UserManager.validate_credentials_lookup.memory', lambda scale: run_validate_credentials(scale, False, FixedHasher(), scale.operationCount)),
+    ('UserManager.validate_credentials_lookup.disk', lambda scale: run_validate_credentials(scale, True, FixedHasher(), scale.operationCount)),
+    ('UserManager.validate_credentials_lookup.cached', lambda scale: run_validate_credentials(scale, True, FixedHasher(), scale.operationCount, UserCache(scale.operationCount))),
+    ('UserManager.create_user.memory', lambda scale: run_create_user(scale, False, None, scale.hashCount)),
+    ('UserManager.create_user_insert.memory', lambda scale: run_create_user(scale, False, FixedHasher(), scale.operationCount)),
+    ('UserManager.create_user_insert.disk', lambda scale: run_create_user(scale, True, FixedHasher(), scale.writeCount))
+]
@@ -0,0 +1,108 @@
+import unittest
+import sqlite3
+import time
+from AuthServer.AdmissionControl import AdmissionController, RateLimiter, requires_hashing
+from AuthServer.TokenManager import TokenManager
+from AuthServer.UserManager import UserManager
+from AuthServer.RequestHandler import RequestHandler
+from AuthServer.RequestRouter import RequestRouter
+from AuthServer.SchemaMigrator import SchemaMigrator
+
+class AdmissionControlTest(unittest.TestCase):
+
+    def test_rate_limiter_pass(self):
+        rateLimiter = RateLimiter(10, 2)
+        self.assertTrue(rateLimiter.try_acquire('127.0.0.1'))
+        self.assertTrue(rateLimiter.try_acquire('127.0.0.1'))
+        self.assertFalse(rateLimiter.try_acquire('127.0.0.1'))
+
+        # Other keys have buckets of their own
+        self.assertTrue(rateLimiter.try_acquire('127.0.0.2'))
+
+        # The bucket refills over time
+        time.sleep(0.15)
+        self.assertTrue(rateLimiter.try_acquire('127.0.0.1'))
+
+    def test_rate_limiter_pass_drops_least_recent_keys(self):
+        rateLimiter = RateLimiter(1, 1, 2)
+        for key in ('a', 'b', 'c'):
+            rateLimiter.try_acquire(key)
+
+        self.assertEqual(list(rateLimiter.buckets), ['b', 'c'])
+
+    def test_requires_hashing_pass(self):
+        self.assertTrue(requires_hashing('/login', {}))
+        self.assertTrue(requires_hashing('/register', {}))
+        self.assertTrue(requires_hashing('/update', { 'password' : '1PasswordPassword!' }))
+        self.assertFalse(requires_hashing('/update', { 'name' : 'bob' }))
+        self.assertFalse(requires_hashing('/logout', {}))
+        self.assertTrue(requires_hashing('/batch', { 'operations' : [{ 'op' : 'update', 'password' : '1PasswordPassword!' }] }))
+        self.assertFalse(requires_hashing('/batch', { 'operations' : [{ 'op' : 'logout' }] }))
+
+    def test_admit_pass_batch_counts_passwords(self):
+        admissionController = AdmissionController(4, RateLimiter(0.01, 3))
+        batch = { 'operations' : [{ 'op' : 'update', 'password' : '1PasswordPassword!' }] * 2 + [{ 'op' : 'logout' }] }
+        self.assertIsNone(admissionController.admit('/batch', '127.0.0.1', batch))
+        self.assertEqual(admissionController.get_hashing_count(), 2)
+        admissionController.release('/batch', batch)
+        self.assertEqual(admissionController.get_hashing_count(), 0)
+
+        # Only one of the IP's hashing requests is left
+        (status, _) = admissionController.admit('/batch', '127.0.0.1', batch)
+        self.assertEqual(status, 429)
+
+    def test_admit_fail_batch_beyond_budget(self):
+        admissionController = AdmissionController(2)
+        self.assertIsNone(admissionController.admit('/login', '127.0.0.1', {}))
+
+        # A batch takes up to the whole budget, and gives back what it took when it can't get all of it
+        batch = { 'operations' : [{ 'op' : 'update', 'password' : '1PasswordPassword!' }] * 5 }
+        (status, _) = admissionController.admit('/batch', '127.0.0.1', batch)
+        self.assertEqual(status, 503)
+        admissionController.release('/login', {})
+        self.assertIsNone(admissionController.admit('/batch', '127.0.0.1', batch))
+        self.assertEqual(admissionController.get_hashing_count(), 2)
+
+    def test_admit_fail_rate_limited(self):
+        admissionController = AdmissionController(4, RateLimiter(0.01, 1), RateLimiter(0.01, 5))
+        self.assertIsNone(admissionController.admit('/login', '127.0.0.1', { 'email' : 'alice@foo.bar' }))
+        admissionController.release('/login', { 'email' : 'alice@foo.bar' })
+
+        (status, _) = admissionController.admit('/login', '127.0.0.1', { 'email' : 'alice@foo.bar' })
+        self.assertEqual(status, 429)
+
+        # Session requests aren't limited
+        self.assertIsNone(admissionController.admit('/logout', '127.0.0.1', {}))
+
+    def test_admit_fail_hashing_budget_exhausted(self):
+        admissionController = AdmissionController(1)
+        self.assertIsNone(admissionController.admit('/login', '127.0.0.1', {}))
+        self.assertEqual(admissionController.get_hashing_count(), 1)
+
+        (status, _) = admissionController.admit('/register', '127.0.0.1', {})
+        self.assertEqual(status, 503)
+
+        # Session requests skip the budget
+        self.assertIsNone(admissionController.admit('/logout', '127.0.0.1', {}))
+
+        admissionController.release('/login', {})
+        self.assertIsNone(admissionController.admit('/register', '127.0.0.1', {}))
+
+    def test_route_fail_rate_limited(self):
+        db = sqlite3.connect(':memory:')
+        SchemaMigrator(db).migrate()
+        router = RequestRouter(RequestHandler(TokenManager(), UserManager(db)), None, AdmissionController(4, None, RateLimiter(0.01, 2)))
+        router.route('POST', '/register', { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' }, '127.0.0.1')
+
+        (status, result) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' }, '127.0.0.1')
+        self.assertEqual(status, 200)
+        (status, _) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' }, '127.0.0.1')
+        self.assertEqual(status, 429)
+
+        # The budget is returned after each request, and session requests are still served
+        self.assertEqual(router.admissionController.get_hashing_count(), 0)
+        (status, _) = router.route('POST', '/logout', { 'token' : result['token'] }, '127.0.0.1')
+        self.assertEqual(status, 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import asyncio
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from AuthServer.AsyncAuthServer import AsyncAuthServer
+from AuthServer.ConnectionPool import ConnectionPool
+from AuthServer.TokenManager import TokenManager
+from AuthServer.UserManager import UserManager
+from AuthServer.RequestHandler import RequestHandler
+from AuthServer.RequestRouter import RequestRouter
+from AuthServer.SchemaMigrator import SchemaMigrator
+
+class AsyncAuthServerTest(unittest.TestCase):
+
+    def setUp(self):
+        (handle, self.dbfile) = tempfile.mkstemp()
+        os.close(handle)
+
+        self.pool = ConnectionPool(self.dbfile)
+        db = self.pool.get_connection()
+        SchemaMigrator(db).migrate()
+
+        self.executor = ThreadPoolExecutor(max_workers = 2)
+        self.router = RequestRouter(RequestHandler(TokenManager(), UserManager(self.pool)))
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.pool.close_all()
+        os.remove(self.dbfile)
+
+    async def send_request(self, reader, writer, method, path, input, close = False):
+        body = bytes(json.dumps(input), 'utf8')
+        head = '%s %s HTTP/1.1\r\nContent-Length: %d\r\n%s\r\n' % (method, path, len(body), 'Connection: close\r\n' if close else '')
+        writer.write(bytes(head, 'latin-1') + body)
+        await writer.drain()
+
+        # Read the reply
+        statusLine = await reader.readline()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            (key, value) = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+        replyBody = await reader.readexactly(int(headers['content-length']))
+
+        return (int(statusLine.split()[1]), json.loads(replyBody) if replyBody else None)
+
+    def run_session(self, session, maxRequestsPerConnection = 1000):
+        async def run():
+            server = await AsyncAuthServer(self.router, self.executor, maxRequestsPerConnection = maxRequestsPerConnection).start('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+                result = await session(reader, writer)
+                writer.close()
+                return result
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        return asyncio.run(run())
+
+    def test_keep_alive_session_pass(self):
+        async def session(reader, writer):
+            # Run a full session over a single connection
+            (status, _) = await self.send_request(reader, writer, 'POST', '/register', { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+            self.assertEqual(status, 200)
+
+            (status, reply) = await self.send_request(reader, writer, 'POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+            self.assertEqual(status, 200)
+
+            (status, reply) = await self.send_request(reader, writer, 'POST', '/update', { 'name' : 'bob', 'email' : 'alice@foo.bar', 'token' : reply['token'] })
+            self.assertEqual(status, 200)
+
+            (status, _) = await self.send_request(reader, writer, 'POST', '/logout', { 'token' : reply['token'] }, True)
+            self.assertEqual(status, 200)
+
+            # The server should close the connection after the last request
+            self.assertEqual(await reader.read(), b'')
+
+        self.run_session(session)
+
+    def test_request_fail_bad_input(self):
+        async def session(reader, writer):
+            (status, reply) = await self.send_request(reader, writer, 'POST', '/logout', {})
+            self.assertEqual(status, 400)
+            self.assertIn('error', reply)
+
+        self.run_session(session)
+
+    def test_request_cap_closes_connection(self):
+        async def session(reader, writer):
+            (status, _) = await self.send_request(reader, writer, 'POST', '/logout', {})
+            (status, _) = await self.send_request(reader, writer, 'POST', '/logout', {})
+            self.assertEqual(status, 400)
+
+            # The server should close the connection once the cap is reached
+            self.assertEqual(await reader.read(), b'')
+
+        self.run_session(session, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+import http.client
+import json
+import os
+import tempfile
+from threading import Thread
+from AuthServer import AuthServer
+from AuthServer.ConnectionPool import ConnectionPool
+from AuthServer.RequestLogger import RequestLogger
+from AuthServer.ThreadPoolHTTPServer import ThreadPoolHTTPServer
+from AuthServer.TokenManager import TokenManager
+from AuthServer.UserManager import UserManager
+from AuthServer.RequestHandler import RequestHandler
+from AuthServer.RequestRouter import RequestRouter
+from AuthServer.SchemaMigrator import SchemaMigrator
+
+class AuthServerTest(unittest.TestCase):
+
+    def setUp(self):
+        (handle, self.dbfile) = tempfile.mkstemp()
+        os.close(handle)
+
+        self.pool = ConnectionPool(self.dbfile)
+        SchemaMigrator(self.pool.get_connection()).migrate()
+
+        # The handler reads the router and logger from its module, as set up by the main application
+        AuthServer.requestRouter = RequestRouter(RequestHandler(TokenManager(), UserManager(self.pool)))
+        AuthServer.requestLogger = RequestLogger(os.devnull)
+
+        self.server = ThreadPoolHTTPServer(('127.0.0.1', 0), AuthServer.AuthServer, 2)
+        self.serverThread = Thread(target = self.server.serve_forever)
+        self.serverThread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.serverThread.join()
+        AuthServer.requestLogger.shutdown()
+        self.pool.close_all()
+        os.remove(self.dbfile)
+
+    def send_request(self, connection, method, path, input):
+        connection.request(method, path, bytes(json.dumps(input), 'utf8'), { 'Content-Type' : 'text/plain' })
+        response = connection.getresponse()
+        body = response.read()
+        return (response, json.loads(body) if body else None)
+
+    def test_keep_alive_session_pass(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout = 10)
+
+        # Run a full session over a single connection
+        (response, _) = self.send_request(connection, 'POST', '/register', { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        self.assertEqual(response.status, 200)
+        self.assertFalse(response.will_close)
+        socket = connection.sock
+
+        (response, reply) = self.send_request(connection, 'POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        self.assertEqual(response.status, 200)
+
+        (response, reply) = self.send_request(connection, 'POST', '/update', { 'name' : 'bob', 'email' : 'alice@foo.bar', 'token' : reply['token'] })
+        self.assertEqual(response.status, 200)
+
+        (response, reply) = self.send_request(connection, 'POST', '/logout', { 'token' : reply['token'] })
+        self.assertEqual(response.status, 200)
+        self.assertIsNone(reply)
+        self.assertIs(connection.sock, socket)
+
+        connection.close()
+
+    def test_request_fail_keeps_connection(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout = 10)
+
+        (response, reply) = self.send_request(connection, 'POST', '/logout', {})
+        self.assertEqual(response.status, 400)
+        self.assertIn('error', reply)
+        self.assertFalse(response.will_close)
+
+        (response, reply) = self.send_request(connection, 'POST', '/unknown', {})
+        self.assertEqual(response.status, 404)
+        self.assertIn('error', reply)
+
+        connection.close()
+
+    def test_request_cap_closes_connection(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout = 10)
+
+        maxRequests = AuthServer.AuthServer.__maxRequestsPerConnection__
+        AuthServer.AuthServer.__maxRequestsPerConnection__ = 2
+        try:
+            (response, _) = self.send_request(connection, 'POST', '/logout', {})
+            self.assertFalse(response.will_close)
+
+            (response, _) = self.send_request(connection, 'POST', '/logout', {})
+            self.assertTrue(response.will_close)
+        finally:
+            AuthServer.AuthServer.__maxRequestsPerConnection__ = maxRequests
+
+        connection.close()
+
+    def test_json_result_pass(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout = 10)
+
+        self.send_request(connection, 'POST', '/register', { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        (_, reply) = self.send_request(connection, 'POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+
+        # Results other than tokens are replied in full
+        (response, introspection) = self.send_request(connection, 'POST', '/introspect', { 'token' : reply['token'] })
+        self.assertEqual(response.status, 200)
+        self.assertTrue(introspection['active'])
+        self.assertEqual(introspection['email'], 'alice@foo.bar')
+
+        (response, batch) = self.send_request(connection, 'POST', '/batch', { 'operations' : [{ 'op' : 'logout', 'token' : reply['token'] }] })
+        self.assertEqual(response.status, 200)
+        self.assertEqual(batch, { 'results' : [{}] })
+
+        connection.close()
+
+if __name__ == '__main__':
+    unittest.main()
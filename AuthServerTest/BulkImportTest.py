@@ -0,0 +1,77 @@
+import unittest
+import json
+import os
+import sqlite3
+import tempfile
+from AuthServer.BulkImport import BulkImporter
+from AuthServer.HashingExecutor import HashingExecutor
+from AuthServer.SchemaMigrator import SchemaMigrator
+from AuthServer.UserManager import UserManager
+
+class BulkImportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.hashingExecutor = HashingExecutor(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hashingExecutor.shutdown()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.importFile = os.path.join(self.directory.name, 'users.jsonl')
+        self.checkpointFile = os.path.join(self.directory.name, 'users.checkpoint')
+
+        self.db = sqlite3.connect(':memory:')
+        SchemaMigrator(self.db).migrate()
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    def write_import_file(self, rows):
+        with open(self.importFile, 'w') as importFile:
+            for row in rows:
+                importFile.write((row if isinstance(row, str) else json.dumps(row)) + '\n')
+
+    def get_user_count(self):
+        (count, ) = self.db.execute('SELECT COUNT(*) FROM Users').fetchone()
+        return count
+
+    def test_run_pass(self):
+        self.write_import_file([
+            { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' },
+            { 'name' : 'bob', 'email' : 'bob@foo.bar', 'password' : '2PasswordPassword!' },
+            { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '3PasswordPassword!' },
+            { 'name' : 'charlie', 'email' : 'charlie', 'password' : '1PasswordPassword!' },
+            { 'name' : 'dave', 'email' : 'dave@foo.bar', 'password' : 'password' },
+            'not json'
+        ])
+
+        result = BulkImporter(self.db, self.hashingExecutor, self.checkpointFile, 2, 2).run(self.importFile)
+
+        self.assertEqual(result, { 'imported' : 2, 'duplicates' : 1, 'invalid' : 3 })
+        self.assertEqual(self.get_user_count(), 2)
+
+        # The first of the duplicate users is kept, and imported passwords validate as usual
+        userManager = UserManager(self.db)
+        self.assertTrue(userManager.validate_credentials('alice@foo.bar', '1PasswordPassword!'))
+        self.assertTrue(userManager.validate_credentials('bob@foo.bar', '2PasswordPassword!'))
+
+    def test_run_pass_resume(self):
+        rows = [{ 'name' : 'user', 'email' : 'user%d@foo.bar' % i, 'password' : '1PasswordPassword!' } for i in range(6)]
+        self.write_import_file(rows[:4])
+
+        # Import the first rows, then more rows are appended to the file
+        BulkImporter(self.db, self.hashingExecutor, self.checkpointFile, 2, 2).run(self.importFile)
+        self.write_import_file(rows)
+
+        # Resuming only reads the new rows
+        result = BulkImporter(self.db, self.hashingExecutor, self.checkpointFile, 2, 2).run(self.importFile)
+
+        self.assertEqual(result, { 'imported' : 6, 'duplicates' : 0, 'invalid' : 0 })
+        self.assertEqual(self.get_user_count(), 6)
+
+if __name__ == '__main__':
+    unittest.main()
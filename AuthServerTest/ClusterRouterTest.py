@@ -0,0 +1,212 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from AuthServer.AsyncAuthServer import AsyncAuthServer
+from AuthServer.ClusterRouter import ClusterRouter, assign_shards, get_email_shard, get_key_shard, shardCount
+from AuthServer.ConnectionPool import ConnectionPool
+from AuthServer.TokenManager import TokenManager
+from AuthServer.UserManager import UserManager
+from AuthServer.RequestHandler import RequestHandler
+from AuthServer.RequestRouter import RequestRouter
+from AuthServer.SchemaMigrator import SchemaMigrator
+
+# Runs a cluster of nodes on loopback, each an asyncio server sharing one event loop and user database
+class ClusterRouterTest(unittest.TestCase):
+
+    __secret__ = 'secret'
+
+    def setUp(self):
+        (handle, self.dbfile) = tempfile.mkstemp()
+        os.close(handle)
+
+        self.pool = ConnectionPool(self.dbfile)
+        SchemaMigrator(self.pool.get_connection()).migrate()
+
+        self.executor = ThreadPoolExecutor(max_workers = 8)
+        self.loop = asyncio.new_event_loop()
+        self.loopThread = Thread(target = self.loop.run_forever, daemon = True)
+        self.loopThread.start()
+        self.servers = []
+        self.authServers = []
+
+    def tearDown(self):
+        # Close the servers, then wait out the connections the nodes kept alive between them
+        for server in self.servers:
+            self.loop.call_soon_threadsafe(server.close)
+        deadline = time.monotonic() + 5
+        while any(authServer.openConnections for authServer in self.authServers) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loopThread.join()
+        self.loop.close()
+        self.executor.shutdown()
+        self.pool.close_all()
+        os.remove(self.dbfile)
+
+    def start_nodes(self, names):
+        # Returns the address of each node, and its server, which has no router yet
+        addresses = {}
+        authServers = {}
+        for name in names:
+            # Connections between the nodes are dropped soon after they go idle, so the tests can finish
+            authServers[name] = AsyncAuthServer(None, self.executor, idleTimeout = 0.2)
+            self.authServers.append(authServers[name])
+            server = asyncio.run_coroutine_threadsafe(authServers[name].start('127.0.0.1', 0), self.loop).result()
+            self.servers.append(server)
+            addresses[name] = '127.0.0.1:%d' % server.sockets[0].getsockname()[1]
+        return (addresses, authServers)
+
+    def start_cluster(self, names, nodes = None):
+        # Returns the router of each node; the nodes are members of the given cluster, or of their own
+        (addresses, authServers) = self.start_nodes(names)
+        routers = {}
+        for name in names:
+            tokenManager = TokenManager()
+            clusterRouter = ClusterRouter(tokenManager, name, nodes or addresses, self.__secret__)
+            routers[name] = authServers[name].requestRouter = RequestRouter(RequestHandler(tokenManager, UserManager(self.pool)), clusterRouter = clusterRouter)
+        return (addresses, routers)
+
+    def get_owned_email(self, owners, name, start = 0):
+        # Returns an email whose sessions are owned by the given node
+        index = start
+        while owners[get_email_shard('user%d@foo.bar' % index)] != name:
+            index += 1
+        return 'user%d@foo.bar' % index
+
+    def get_token_manager(self, router):
+        return router.requestHandler.tokenManager
+
+    def register_login(self, router, email):
+        router.route('POST', '/register', { 'name' : 'alice', 'email' : email, 'password' : '1PasswordPassword!' })
+        (status, result) = router.route('POST', '/login', { 'email' : email, 'password' : '1PasswordPassword!' })
+        self.assertEqual(status, 200)
+        return result['token']
+
+    def test_assign_shards_pass_adding_node(self):
+        owners = assign_shards(['a', 'b'])
+        self.assertEqual(owners, assign_shards(['b', 'a']))
+        self.assertEqual(set(owners), set(['a', 'b']))
+
+        # Only the shards taken over by the new node move
+        newOwners = assign_shards(['a', 'b', 'c'])
+        movedShards = [shard for shard in range(shardCount) if newOwners[shard] != owners[shard]]
+        self.assertTrue(all(newOwners[shard] == 'c' for shard in movedShards))
+        self.assertTrue(shardCount / 4 < len(movedShards) < shardCount / 2.5)
+
+    def test_create_token_pass_carries_shard(self):
+        tokenManager = TokenManager()
+        ClusterRouter(tokenManager, 'a', { 'a' : '127.0.0.1:1' }, self.__secret__)
+
+        token = tokenManager.create_token('alice@foo.bar')
+        self.assertEqual(get_key_shard(tokenManager.get_token_key(token)), get_email_shard('alice@foo.bar'))
+
+        # Rotated tokens keep the shard
+        tokenManager.lock_on_token(token)
+        token = tokenManager.release_update_token(token)
+        self.assertEqual(get_key_shard(tokenManager.get_token_key(token)), get_email_shard('alice@foo.bar'))
+
+    def test_route_pass_forwarded(self):
+        (addresses, routers) = self.start_cluster(['a', 'b'])
+        email = self.get_owned_email(assign_shards(addresses), 'b')
+
+        # Requests landing on node a are handled by node b, which holds the session
+        token = self.register_login(routers['a'], email)
+        self.assertEqual(self.get_token_manager(routers['b']).get_user_for_token(token), email)
+        self.assertIsNone(self.get_token_manager(routers['a']).introspect_token(token))
+        self.assertEqual(routers['a'].route('POST', '/introspect', { 'token' : token })[1]['email'], email)
+
+        (status, result) = routers['a'].route('POST', '/update', { 'name' : 'bob', 'email' : email, 'token' : token })
+        self.assertEqual(status, 200)
+        (status, _) = routers['a'].route('POST', '/logout', { 'token' : result['token'] })
+        self.assertEqual(status, 200)
+        self.assertEqual(routers['b'].route('POST', '/introspect', { 'token' : result['token'] }), (200, { 'active' : False }))
+
+    def test_route_fail_forwarded_error(self):
+        (addresses, routers) = self.start_cluster(['a', 'b'])
+        email = self.get_owned_email(assign_shards(addresses), 'b')
+        self.register_login(routers['a'], email)
+
+        # The owner's errors are relayed
+        (status, result) = routers['a'].route('POST', '/login', { 'email' : email, 'password' : '1PasswordPassword?' })
+        self.assertEqual(status, 400)
+        self.assertEqual(result, 'Invalid credentials provided')
+
+    def test_route_fail_forward_not_authenticated(self):
+        (_, routers) = self.start_cluster(['a'])
+        envelope = { 'secret' : 'guess', 'method' : 'POST', 'path' : '/logout', 'input' : {}, 'client' : '10.0.0.1', 'hops' : 1 }
+        self.assertEqual(routers['a'].route('POST', '/internal/forward', envelope)[0], 403)
+        self.assertEqual(routers['a'].route('POST', '/internal/sessions', { 'secret' : 'guess', 'sessions' : [] })[0], 400)
+
+    def test_route_fail_node_unavailable(self):
+        # Node b is in the cluster, but isn't running
+        (addresses, _) = self.start_nodes(['b'])
+        self.loop.call_soon_threadsafe(self.servers.pop().close)
+        (_, routers) = self.start_cluster(['a'], dict(addresses, a = '127.0.0.1:1'))
+        email = self.get_owned_email(assign_shards(['a', 'b']), 'b')
+
+        (status, _) = routers['a'].route('POST', '/login', { 'email' : email, 'password' : '1PasswordPassword!' })
+        self.assertEqual(status, 503)
+
+    def test_route_batch_pass_split(self):
+        (addresses, routers) = self.start_cluster(['a', 'b'])
+        owners = assign_shards(addresses)
+        tokenA = self.get_token_manager(routers['a']).create_token(self.get_owned_email(owners, 'a'))
+        tokenB = self.get_token_manager(routers['b']).create_token(self.get_owned_email(owners, 'b'))
+
+        (status, result) = routers['a'].route('POST', '/batch', { 'operations' : [
+            { 'op' : 'logout', 'token' : tokenB },
+            { 'op' : 'logout', 'token' : 'bad' },
+            { 'op' : 'logout', 'token' : tokenA }
+        ]})
+        self.assertEqual(status, 200)
+        self.assertEqual(result['results'][0], {})
+        self.assertIn('error', result['results'][1])
+        self.assertEqual(result['results'][2], {})
+        self.assertEqual(self.get_token_manager(routers['b']).get_expiry_stats()['liveTokens'], 0)
+
+    def test_route_batch_fail_too_many_operations(self):
+        (addresses, routers) = self.start_cluster(['a', 'b'])
+        owners = assign_shards(addresses)
+        tokenA = self.get_token_manager(routers['a']).create_token(self.get_owned_email(owners, 'a'))
+        tokenB = self.get_token_manager(routers['b']).create_token(self.get_owned_email(owners, 'b'))
+
+        # Each node's share is within the limit, but the batch isn't
+        (status, _) = routers['a'].route('POST', '/batch', { 'operations' : [
+            { 'op' : 'logout', 'token' : token } for token in [tokenA, tokenB] * 51
+        ]})
+        self.assertEqual(status, 400)
+        self.assertEqual(self.get_token_manager(routers['b']).get_expiry_stats()['liveTokens'], 1)
+
+    def test_rebalance_pass_adding_node(self):
+        (addresses, routers) = self.start_cluster(['a', 'b'])
+        owners = assign_shards(addresses)
+        tokens = {}
+        index = 0
+        for _ in range(40):
+            email = 'user%d@foo.bar' % index
+            tokens[self.get_token_manager(routers[owners[get_email_shard(email)]]).create_token(email)] = email
+            index += 1
+
+        # Start node c with the new membership, then rebalance the others onto it
+        (newAddresses, newRouters) = self.start_cluster(['c'], dict(addresses, c = None))
+        addresses['c'] = newAddresses['c']
+        newRouters['c'].clusterRouter.membership = (dict(addresses), assign_shards(addresses))
+        routers.update(newRouters)
+
+        handedOffCount = routers['a'].clusterRouter.rebalance(addresses) + routers['b'].clusterRouter.rebalance(addresses)
+        self.assertTrue(handedOffCount > 0)
+
+        # Each session is held by its new owner alone, and valid through any node
+        newOwners = assign_shards(addresses)
+        for (token, email) in tokens.items():
+            owner = newOwners[get_email_shard(email)]
+            self.assertEqual(self.get_token_manager(routers[owner]).get_user_for_token(token), email)
+            self.assertEqual(routers['a'].route('POST', '/introspect', { 'token' : token })[1]['email'], email)
+        self.assertEqual(sum(self.get_token_manager(router).get_expiry_stats()['liveTokens'] for router in routers.values()), len(tokens))
+
+if __name__ == '__main__':
+    unittest.main()
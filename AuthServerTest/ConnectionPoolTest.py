@@ -0,0 +1,43 @@
+import unittest
+import os
+import tempfile
+from threading import Thread
+from AuthServer.ConnectionPool import ConnectionPool
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        (handle, self.dbfile) = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.dbfile)
+
+    def test_get_connection_pass_same_thread(self):
+        pool = ConnectionPool(self.dbfile)
+        self.assertIs(pool.get_connection(), pool.get_connection())
+        pool.close_all()
+
+    def test_get_connection_pass_separate_threads(self):
+        pool = ConnectionPool(self.dbfile)
+        connections = []
+
+        # Get a connection on each of several threads
+        threads = [Thread(target = lambda: connections.append(pool.get_connection())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(id(connection) for connection in connections)), 4)
+        self.assertEqual(len(pool.connections), 4)
+        pool.close_all()
+
+    def test_close_all_pass(self):
+        pool = ConnectionPool(self.dbfile)
+        pool.get_connection()
+        pool.close_all()
+        self.assertEqual(len(pool.connections), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import sqlite3
+from threading import Thread
+from AuthServer import HashingExecutor as HashingModule
+from AuthServer.HashingExecutor import HashingExecutor
+from AuthServer.UserManager import UserManager
+
+class HashingExecutorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.hashingExecutor = HashingExecutor(2, 4)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hashingExecutor.shutdown()
+
+    def test_hash_password_pass(self):
+        hashedPassword = self.hashingExecutor.hash_password('password', '1112131415161718a1a2a3a4a5a6a7a8')
+        self.assertEqual(hashedPassword, '94f31a148026c638fe8fde6097dbf1d2e90b61be2240c0d57f8acd91a0642626')
+
+    def test_hash_password_pass_matches_inline(self):
+        self.assertEqual(
+            self.hashingExecutor.hash_password('1PasswordPassword!', 'a1a2a3a4'),
+            HashingModule.hash_password('1PasswordPassword!', 'a1a2a3a4'))
+
+    def test_hash_password_pass_concurrent(self):
+        results = []
+
+        # Submit more hashes than the queue holds; callers wait for room rather than failing
+        def hash_passwords():
+            results.append(self.hashingExecutor.hash_password('password', '1112131415161718a1a2a3a4a5a6a7a8'))
+
+        threads = [Thread(target = hash_passwords) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(self.hashingExecutor.get_queue_depth(), 0)
+
+    def test_user_manager_pass_with_executor(self):
+        db = sqlite3.connect(':memory:')
+        db.cursor().execute('CREATE TABLE Users (Name TEXT, Email TEXT, PasswordHash TEXT, PasswordSalt TEXT);')
+        db.commit()
+
+        userManager = UserManager(db, self.hashingExecutor)
+        userManager.create_user('bob', 'bob@foo.bar', 'password')
+        self.assertTrue(userManager.validate_credentials('bob@foo.bar', 'password'))
+        self.assertFalse(userManager.validate_credentials('bob@foo.bar', 'badpassword'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import sqlite3
+from AuthServer.Metrics import Histogram, MetricsRegistry
+from AuthServer.TokenManager import TokenManager
+from AuthServer.UserManager import UserManager
+from AuthServer.RequestHandler import RequestHandler
+from AuthServer.RequestRouter import RequestRouter
+from AuthServer.SchemaMigrator import SchemaMigrator
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counter_pass(self):
+        registry = MetricsRegistry()
+        registry.counter('requests_total', 'Requests', path = '/login').increment()
+        registry.counter('requests_total', 'Requests', path = '/login').increment(2)
+        registry.counter('requests_total', 'Requests', path = '/logout').increment()
+
+        text = registry.render()
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{path="/login"} 3', text)
+        self.assertIn('requests_total{path="/logout"} 1', text)
+
+    def test_histogram_pass(self):
+        histogram = Histogram()
+        histogram.observe(0.00001)
+        histogram.observe(0.0001)
+        histogram.observe(100)
+
+        cumulative = histogram.get_cumulative_counts()
+        self.assertEqual(cumulative[0], 1)
+        self.assertEqual(cumulative[1], 2)
+        self.assertEqual(cumulative[-2], 2)
+        self.assertEqual(cumulative[-1], 3)
+        self.assertEqual(histogram.count, 3)
+
+    def test_histogram_render_pass(self):
+        registry = MetricsRegistry()
+        registry.histogram('request_seconds', 'Request time', path = '/login').observe(0.01)
+
+        text = registry.render()
+        self.assertIn('# TYPE request_seconds histogram', text)
+        self.assertIn('request_seconds_bucket{path="/login",le="+Inf"} 1', text)
+        self.assertIn('request_seconds_count{path="/login"} 1', text)
+        self.assertIn('request_seconds_sum{path="/login"} 0.01', text)
+
+    def test_gauge_pass(self):
+        registry = MetricsRegistry()
+        values = [5]
+        registry.gauge('live_tokens', 'Tokens', lambda: values[0])
+        self.assertIn('live_tokens 5', registry.render())
+
+        values[0] = 7
+        self.assertIn('live_tokens 7', registry.render())
+
+    def test_metrics_route_pass(self):
+        db = sqlite3.connect(':memory:')
+        SchemaMigrator(db).migrate()
+        router = RequestRouter(RequestHandler(TokenManager(), UserManager(db)))
+        router.route('POST', '/register', { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        router.route('GET', '/unknown', {})
+
+        (status, result) = router.route('GET', '/metrics', {})
+        self.assertEqual(status, 200)
+        self.assertIn('authserver_requests_total{method="POST",path="/register",status="200"}', result)
+        self.assertIn('authserver_requests_total{method="",path="unknown",status="404"}', result)
+        self.assertIn('authserver_password_hash_seconds_count', result)
+        self.assertIn('authserver_sql_seconds_count{operation="write"}', result)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import json
+import os
+import tempfile
+from AuthServer.RequestLogger import RequestLogger, parse_sample_rates
+from AuthServer.SignedTokenManager import SignedTokenManager
+
+class RequestLoggerTest(unittest.TestCase):
+
+    def setUp(self):
+        (handle, self.logfile) = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.logfile)
+
+    def read_records(self):
+        with open(self.logfile) as logfile:
+            return [json.loads(line) for line in logfile]
+
+    def test_log_request_pass(self):
+        requestLogger = RequestLogger(self.logfile)
+        requestLogger.log_request('POST', '/login', 200, 0.0125, { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        requestLogger.shutdown()
+
+        [record] = self.read_records()
+        self.assertEqual(record['path'], '/login')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['durationMs'], 12.5)
+        self.assertEqual(record['input'], { 'email' : 'alice@foo.bar', 'password' : '[REDACTED]' })
+
+    def test_log_request_pass_redacts_token_in_error(self):
+        requestLogger = RequestLogger(self.logfile)
+        requestLogger.log_request('POST', '/logout', 400, 0.001, { 'token' : '6c060cf8-28b9-46fb-b618-25faa81bb12f' },
+            'Token 6c060cf8-28b9-46fb-b618-25faa81bb12f not found')
+        requestLogger.shutdown()
+
+        [record] = self.read_records()
+        self.assertEqual(record['input'], { 'token' : '[REDACTED]' })
+        self.assertEqual(record['error'], 'Token [REDACTED] not found')
+
+    def test_log_request_pass_redacts_signed_token_in_error(self):
+        token = SignedTokenManager(b'secret').create_token('alice@foo.bar')
+        requestLogger = RequestLogger(self.logfile)
+        requestLogger.log_request('POST', '/logout', 400, 0.001, { 'token' : token }, 'Token ' + token + ' not found')
+        requestLogger.shutdown()
+
+        [record] = self.read_records()
+        self.assertEqual(record['error'], 'Token [REDACTED] not found')
+
+    def test_log_request_pass_redacts_nested_input(self):
+        requestLogger = RequestLogger(self.logfile)
+        requestLogger.log_request('POST', '/batch', 200, 0.001, { 'operations' : [{ 'op' : 'logout', 'token' : '6c060cf8-28b9-46fb-b618-25faa81bb12f' }] })
+        requestLogger.shutdown()
+
+        [record] = self.read_records()
+        self.assertEqual(record['input'], { 'operations' : [{ 'op' : 'logout', 'token' : '[REDACTED]' }] })
+
+    def test_log_request_pass_sampling(self):
+        # Successful requests to /logout are never sampled, but failed ones are always logged
+        requestLogger = RequestLogger(self.logfile, { '/logout' : 0 })
+        for _ in range(10):
+            requestLogger.log_request('POST', '/logout', 200, 0.001)
+            requestLogger.log_request('POST', '/login', 200, 0.001)
+        requestLogger.log_request('POST', '/logout', 400, 0.001)
+        requestLogger.shutdown()
+
+        records = self.read_records()
+        self.assertEqual(len([record for record in records if record['path'] == '/login']), 10)
+        self.assertEqual([record['status'] for record in records if record['path'] == '/logout'], [400])
+
+    def test_log_pass(self):
+        requestLogger = RequestLogger(self.logfile)
+        requestLogger.log('server', message = 'started', password = 'secret')
+        requestLogger.shutdown()
+
+        [record] = self.read_records()
+        self.assertEqual(record['event'], 'server')
+        self.assertEqual(record['message'], 'started')
+        self.assertEqual(record['password'], '[REDACTED]')
+
+    def test_parse_sample_rates_pass(self):
+        self.assertEqual(parse_sample_rates('/login=0.1, /update=0.01'), { '/login' : 0.1, '/update' : 0.01 })
+        self.assertEqual(parse_sample_rates(None), {})
+
+if __name__ == '__main__':
+    unittest.main()
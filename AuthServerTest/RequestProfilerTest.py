@@ -0,0 +1,72 @@
+import unittest
+import sqlite3
+import sys
+from AuthServer.RequestProfiler import RequestProfiler
+from AuthServer.TokenManager import TokenManager
+from AuthServer.UserManager import UserManager
+from AuthServer.RequestHandler import RequestHandler
+from AuthServer.RequestRouter import RequestRouter
+from AuthServer.SchemaMigrator import SchemaMigrator
+
+class RequestProfilerTest(unittest.TestCase):
+
+    def setup_router(self, requestProfiler):
+        db = sqlite3.connect(':memory:', check_same_thread = False)
+        SchemaMigrator(db).migrate()
+        return RequestRouter(RequestHandler(TokenManager(), UserManager(db)), None, None, requestProfiler)
+
+    def test_profile_requests_pass(self):
+        requestProfiler = RequestProfiler(1.0)
+        router = self.setup_router(requestProfiler)
+
+        (status, _) = router.route('POST', '/admin/profile', { 'enabled' : True })
+        self.assertEqual(status, 200)
+        self.assertTrue(requestProfiler.enabled)
+
+        # Registrations spend their time hashing
+        for i in range(5):
+            router.route('POST', '/register', { 'name' : 'alice', 'email' : 'alice%d@foo.bar' % i, 'password' : '1PasswordPassword!' })
+
+        (status, stacks) = router.route('GET', '/admin/profile', {})
+        self.assertEqual(status, 200)
+        router.route('POST', '/admin/profile', { 'enabled' : False })
+        self.assertFalse(requestProfiler.enabled)
+
+        lines = stacks.splitlines()
+        self.assertTrue(len(lines) > 0)
+        self.assertTrue(all(line.startswith('/register;') for line in lines))
+        self.assertTrue(any(line.startswith('/register;hashing;RequestRouter.dispatch;') for line in lines))
+        self.assertTrue(all(int(line.rsplit(' ', 1)[1]) > 0 for line in lines))
+
+    def test_collapse_stack_pass_categories(self):
+        requestProfiler = RequestProfiler()
+        frames = []
+
+        def capture():
+            frames.append(sys._getframe())
+
+        capture()
+        # Outside of a request, the stack is unattributed and runs to the outermost frame
+        self.assertTrue(requestProfiler.collapse_stack('/login', frames[0]).startswith('/login;other;'))
+        self.assertTrue(requestProfiler.collapse_stack('/login', frames[0]).endswith('capture'))
+
+    def test_begin_request_pass_sampling(self):
+        requestProfiler = RequestProfiler(0.0)
+        self.assertFalse(requestProfiler.begin_request('/login'))
+
+        requestProfiler.start(1.0)
+        self.assertTrue(requestProfiler.begin_request('/login'))
+        requestProfiler.end_request()
+        requestProfiler.stop()
+        self.assertFalse(requestProfiler.begin_request('/login'))
+
+    def test_admin_fail_remote_client(self):
+        router = self.setup_router(RequestProfiler())
+        (status, _) = router.route('GET', '/admin/profile', {}, '10.0.0.1')
+        self.assertEqual(status, 403)
+
+        (status, _) = router.route('GET', '/admin/profile', {}, '127.0.0.1')
+        self.assertEqual(status, 200)
+
+if __name__ == '__main__':
+    unittest.main()
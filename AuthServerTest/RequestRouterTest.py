@@ -0,0 +1,215 @@
+import unittest
+import sqlite3
+from AuthServer.TokenManager import TokenManager
+from AuthServer.UserManager import UserManager
+from AuthServer.RequestHandler import RequestHandler
+from AuthServer.RequestRouter import RequestRouter
+from AuthServer.SchemaMigrator import SchemaMigrator
+
+class RequestRouterTest(unittest.TestCase):
+
+    def setup_router(self):
+        db = sqlite3.connect(':memory:')
+        SchemaMigrator(db).migrate()
+        return RequestRouter(RequestHandler(TokenManager(), UserManager(db)))
+
+    def register_login(self, router):
+        router.route('POST', '/register', { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        (_, result) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        return result['token']
+
+    def test_route_register_login_pass(self):
+        router = self.setup_router()
+        (status, result) = router.route('POST', '/register', { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        self.assertEqual(status, 200)
+        self.assertIsNone(result)
+
+        (status, result) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        self.assertEqual(status, 200)
+        self.assertTrue(len(result['token']) > 0)
+
+    def test_route_update_logout_pass(self):
+        router = self.setup_router()
+        token = self.register_login(router)
+
+        (status, result) = router.route('POST', '/update', { 'name' : 'bob', 'email' : 'alice@foo.bar', 'token' : token })
+        self.assertEqual(status, 200)
+        self.assertNotEqual(result['token'], token)
+
+        (status, _) = router.route('POST', '/logout', { 'token' : result['token'] })
+        self.assertEqual(status, 200)
+
+    def test_route_update_pass_password_revokes_others(self):
+        router = self.setup_router()
+        token = self.register_login(router)
+        otherToken = self.register_login(router)
+
+        (status, result) = router.route('POST', '/update', { 'password' : '2PasswordPassword!', 'email' : 'alice@foo.bar', 'token' : token })
+        self.assertEqual(status, 200)
+        self.assertEqual(router.route('POST', '/introspect', { 'token' : result['token'] })[1]['active'], True)
+        self.assertEqual(router.route('POST', '/introspect', { 'token' : otherToken })[1]['active'], False)
+
+    def test_route_revoke_pass(self):
+        router = self.setup_router()
+        tokens = [self.register_login(router) for _ in range(2)]
+
+        (status, _) = router.route('POST', '/revoke', { 'token' : tokens[0] })
+        self.assertEqual(status, 200)
+        for token in tokens:
+            self.assertEqual(router.route('POST', '/logout', { 'token' : token })[0], 400)
+
+    def test_route_delete_pass(self):
+        router = self.setup_router()
+        token = self.register_login(router)
+
+        (status, _) = router.route('DELETE', '/delete', { 'token' : token })
+        self.assertEqual(status, 200)
+
+        (status, _) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        self.assertEqual(status, 400)
+
+    def test_route_register_fail_bad_password(self):
+        router = self.setup_router()
+        (status, _) = router.route('POST', '/register', { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : 'password' })
+        self.assertEqual(status, 400)
+
+    def test_route_register_fail_bad_email(self):
+        router = self.setup_router()
+        (status, _) = router.route('POST', '/register', { 'name' : 'alice', 'email' : 'alice', 'password' : '1PasswordPassword!' })
+        self.assertEqual(status, 400)
+
+    def test_route_logout_fail_missing_token(self):
+        router = self.setup_router()
+        (status, _) = router.route('POST', '/logout', {})
+        self.assertEqual(status, 400)
+
+    def test_route_introspect_pass(self):
+        router = self.setup_router()
+        token = self.register_login(router)
+
+        (status, result) = router.route('POST', '/introspect', { 'token' : token })
+        self.assertEqual(status, 200)
+        self.assertEqual(result['email'], 'alice@foo.bar')
+        self.assertTrue(result['active'])
+
+        router.route('POST', '/logout', { 'token' : token })
+        (status, result) = router.route('POST', '/introspect', { 'token' : token })
+        self.assertEqual(status, 200)
+        self.assertEqual(result, { 'active' : False })
+
+    def test_route_batch_pass(self):
+        router = self.setup_router()
+        token1 = self.register_login(router)
+        (_, result) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        token2 = result['token']
+        (_, result) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        token3 = result['token']
+
+        (status, result) = router.route('POST', '/batch', { 'operations' : [
+            { 'op' : 'logout', 'token' : token1 },
+            { 'op' : 'update', 'name' : 'bob', 'token' : token2 },
+            { 'op' : 'logout', 'token' : 'b1d3c6bb-49c4-4c8b-a5d4-2bb41b9d0a8c' },
+            { 'op' : 'rename', 'token' : token3 }
+        ] })
+        self.assertEqual(status, 200)
+
+        [logout, update, missing, unknown] = result['results']
+        self.assertEqual(logout, {})
+        self.assertNotEqual(update['token'], token2)
+        self.assertIn('error', missing)
+        self.assertIn('error', unknown)
+
+        # The closed and rotated tokens are gone, while the new and untouched tokens remain
+        self.assertEqual(router.route('POST', '/logout', { 'token' : token1 })[0], 400)
+        self.assertEqual(router.route('POST', '/logout', { 'token' : token2 })[0], 400)
+        self.assertEqual(router.route('POST', '/logout', { 'token' : update['token'] })[0], 200)
+        self.assertEqual(router.route('POST', '/logout', { 'token' : token3 })[0], 200)
+
+    def test_route_batch_pass_delete(self):
+        router = self.setup_router()
+        token1 = self.register_login(router)
+        (_, result) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        token2 = result['token']
+
+        # Operations on a user after it's deleted fail
+        (status, result) = router.route('POST', '/batch', { 'operations' : [
+            { 'op' : 'delete', 'token' : token1 },
+            { 'op' : 'logout', 'token' : token2 }
+        ] })
+        self.assertEqual(status, 200)
+        self.assertEqual(result['results'][0], {})
+        self.assertIn('error', result['results'][1])
+
+        (status, _) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        self.assertEqual(status, 400)
+
+    def test_route_batch_pass_reused_token(self):
+        router = self.setup_router()
+        token = self.register_login(router)
+
+        # The token is rotated by the update, so the logout fails, without failing the batch
+        (status, result) = router.route('POST', '/batch', { 'operations' : [
+            { 'op' : 'update', 'name' : 'bob', 'token' : token },
+            { 'op' : 'logout', 'token' : token }
+        ] })
+        self.assertEqual(status, 200)
+        [update, logout] = result['results']
+        self.assertIn('error', logout)
+        self.assertEqual(router.route('POST', '/logout', { 'token' : update['token'] })[0], 200)
+
+    def test_route_batch_pass_closed_token_not_written(self):
+        router = self.setup_router()
+        token = self.register_login(router)
+
+        # The logout closes the token, so the update after it fails without being written
+        (status, result) = router.route('POST', '/batch', { 'operations' : [
+            { 'op' : 'logout', 'token' : token },
+            { 'op' : 'update', 'name' : 'mallory', 'token' : token }
+        ] })
+        self.assertEqual(status, 200)
+        self.assertEqual(result['results'][0], {})
+        self.assertIn('error', result['results'][1])
+        self.assertEqual(router.requestHandler.userManager.get_user_row('alice@foo.bar')[0], 'alice')
+
+    def test_route_batch_pass_rotated_token_not_written(self):
+        router = self.setup_router()
+        token = self.register_login(router)
+
+        # The first update rotates the token, so the second fails without being written
+        (status, result) = router.route('POST', '/batch', { 'operations' : [
+            { 'op' : 'update', 'name' : 'x1', 'token' : token },
+            { 'op' : 'update', 'name' : 'x2', 'token' : token }
+        ] })
+        self.assertEqual(status, 200)
+        self.assertIn('token', result['results'][0])
+        self.assertIn('error', result['results'][1])
+        self.assertEqual(router.requestHandler.userManager.get_user_row('alice@foo.bar')[0], 'x1')
+
+    def test_route_batch_pass_password_change(self):
+        router = self.setup_router()
+        token1 = self.register_login(router)
+        token2 = self.register_login(router)
+
+        # The password change revokes the other token, so its later update isn't written
+        (status, result) = router.route('POST', '/batch', { 'operations' : [
+            { 'op' : 'update', 'password' : '2PasswordPassword!', 'token' : token1 },
+            { 'op' : 'update', 'name' : 'mallory', 'token' : token2 }
+        ] })
+        self.assertEqual(status, 200)
+        [passwordUpdate, nameUpdate] = result['results']
+        self.assertIn('token', passwordUpdate)
+        self.assertIn('error', nameUpdate)
+        self.assertEqual(router.requestHandler.userManager.get_user_row('alice@foo.bar')[0], 'alice')
+
+    def test_route_batch_fail_no_operations(self):
+        router = self.setup_router()
+        (status, _) = router.route('POST', '/batch', { 'operations' : [] })
+        self.assertEqual(status, 400)
+
+    def test_route_fail_unknown_path(self):
+        router = self.setup_router()
+        (status, _) = router.route('POST', '/unknown', {})
+        self.assertEqual(status, 404)
+
+if __name__ == '__main__':
+    unittest.main()
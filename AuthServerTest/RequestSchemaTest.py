@@ -0,0 +1,63 @@
+import unittest
+import random
+import re
+from AuthServer.RequestSchema import FieldSpec, RequestSchema, validate_email, validate_password
+
+class RequestSchemaTest(unittest.TestCase):
+
+    def test_validate_pass(self):
+        schema = RequestSchema(FieldSpec('name'), FieldSpec('email', validate_email), FieldSpec('token', required = False))
+        values = schema.validate({ 'name' : 'alice', 'email' : 'alice@foo.bar' })
+        self.assertEqual(values, ('alice', 'alice@foo.bar', None))
+
+    def test_validate_fail_missing_field(self):
+        schema = RequestSchema(FieldSpec('name'), FieldSpec('email', validate_email))
+        with self.assertRaises(Exception):
+            schema.validate({ 'name' : 'alice' })
+
+    def test_validate_fail_invalid_field(self):
+        schema = RequestSchema(FieldSpec('email', validate_email))
+        with self.assertRaises(Exception):
+            schema.validate({ 'email' : 'alice' })
+
+    def test_validate_fail_not_an_object(self):
+        schema = RequestSchema(FieldSpec('token'))
+        with self.assertRaises(Exception):
+            schema.validate(['token'])
+
+    def test_validate_email_pass(self):
+        self.assertTrue(validate_email('alice@foo.bar'))
+        self.assertTrue(validate_email('alice.b+c@foo-bar.co.uk'))
+
+    def test_validate_email_fail(self):
+        self.assertFalse(validate_email('alice'))
+        self.assertFalse(validate_email('alice@foo'))
+        self.assertFalse(validate_email(42))
+
+    def test_validate_password_pass(self):
+        self.assertTrue(validate_password('1PasswordPassword!'))
+
+    def test_validate_password_fail(self):
+        self.assertFalse(validate_password('1Password!'))
+        self.assertFalse(validate_password('1PASSWORDPASSWORD!'))
+        self.assertFalse(validate_password('1passwordpassword!'))
+        self.assertFalse(validate_password('PasswordPassword!'))
+        self.assertFalse(validate_password(None))
+
+    def test_validate_password_pass_matches_original_rules(self):
+        # The single-pass check should accept exactly what the original regular expressions did
+        def original_rules(password):
+            return (len(password) >= 16
+                and len(re.findall("[a-z]", password)) >= 1
+                and len(re.findall("[A-Z]", password)) >= 1
+                and len(re.findall("[\\d]", password)) >= 1
+                and len(re.findall("[,.:;?!@#$%&-_+=]", password)) >= 1)
+
+        generator = random.Random(42)
+        alphabet = 'aZ9 !,&_+=-~`{|}٣é'
+        for _ in range(5000):
+            password = ''.join(generator.choice(alphabet) for _ in range(generator.randint(14, 18)))
+            self.assertEqual(validate_password(password), original_rules(password), password)
+
+if __name__ == '__main__':
+    unittest.main()
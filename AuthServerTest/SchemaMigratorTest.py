@@ -0,0 +1,67 @@
+import unittest
+import io
+import sqlite3
+from contextlib import redirect_stdout
+from AuthServer.SchemaMigrator import SchemaMigrator
+
+class SchemaMigratorTest(unittest.TestCase):
+
+    def get_index_names(self, db):
+        cursor = db.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'Users'")
+        return [name for (name, ) in cursor.fetchall()]
+
+    def test_migrate_pass_new_db(self):
+        db = sqlite3.connect(':memory:')
+        migrator = SchemaMigrator(db)
+
+        self.assertEqual(migrator.migrate(), [1, 2])
+        self.assertEqual(migrator.get_version(), migrator.get_latest_version())
+        self.assertIn('UsersEmailIndex', self.get_index_names(db))
+
+    def test_migrate_pass_existing_db(self):
+        # Setup a database predating the migrations, with a duplicate user
+        db = sqlite3.connect(':memory:')
+        cursor = db.cursor()
+        cursor.execute('CREATE TABLE Users (Name TEXT, Email TEXT, PasswordHash TEXT, PasswordSalt TEXT);')
+        cursor.execute("INSERT INTO Users VALUES ('alice', 'alice@foo.bar', 'hash1', 'salt1')")
+        cursor.execute("INSERT INTO Users VALUES ('alice2', 'alice@foo.bar', 'hash2', 'salt2')")
+        cursor.execute("INSERT INTO Users VALUES ('bob', 'bob@foo.bar', 'hash3', 'salt3')")
+        db.commit()
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            SchemaMigrator(db).migrate()
+        self.assertIn('Schema migration 2 moved 1 row(s) aside', output.getvalue())
+
+        # The first of the duplicate users is kept, and the others are set aside rather than dropped
+        cursor.execute('SELECT Name FROM Users ORDER BY Email')
+        self.assertEqual(cursor.fetchall(), [('alice', ), ('bob', )])
+        cursor.execute('SELECT * FROM UsersDuplicates')
+        self.assertEqual(cursor.fetchall(), [('alice2', 'alice@foo.bar', 'hash2', 'salt2')])
+
+    def test_migrate_pass_already_migrated(self):
+        db = sqlite3.connect(':memory:')
+        SchemaMigrator(db).migrate()
+        self.assertEqual(SchemaMigrator(db).migrate(), [])
+
+    def test_insert_fail_duplicate_email(self):
+        db = sqlite3.connect(':memory:')
+        SchemaMigrator(db).migrate()
+
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO Users VALUES ('alice', 'alice@foo.bar', 'hash1', 'salt1')")
+        with self.assertRaises(sqlite3.IntegrityError):
+            cursor.execute("INSERT INTO Users VALUES ('alice2', 'alice@foo.bar', 'hash2', 'salt2')")
+
+    def test_lookup_pass_uses_index(self):
+        db = sqlite3.connect(':memory:')
+        SchemaMigrator(db).migrate()
+
+        cursor = db.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN SELECT * FROM Users WHERE Email = ?', ('alice@foo.bar', ))
+        plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('UsersEmailIndex', plan)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import os
+import socket
+import ssl
+import tempfile
+from threading import Thread
+from AuthServer.ServerSSLContext import create_ssl_context, create_ssl_context_from_env, read_key_password
+
+# The repository's sample key and cert; the key password is "password"
+certfile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cert.pem')
+keyfile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'key.pem')
+
+class ServerSSLContextTest(unittest.TestCase):
+
+    def create_client_context(self):
+        # The sample cert is self-signed
+        clientContext = ssl.create_default_context()
+        clientContext.check_hostname = False
+        clientContext.verify_mode = ssl.CERT_NONE
+        return clientContext
+
+    def connect(self, clientContext, port, session = None):
+        client = clientContext.wrap_socket(socket.create_connection(('127.0.0.1', port)), session = session)
+        # Read the echo, which also receives any TLS 1.3 session tickets
+        client.sendall(b'x')
+        client.recv(1)
+        return client
+
+    def serve(self, sslContext, connectionCount):
+        listener = socket.create_server(('127.0.0.1', 0))
+
+        def run():
+            for _ in range(connectionCount):
+                (connection, _) = listener.accept()
+                with sslContext.wrap_socket(connection, server_side = True) as secure:
+                    secure.sendall(secure.recv(1))
+                    secure.recv(1)
+            listener.close()
+
+        thread = Thread(target = run)
+        thread.start()
+        return (thread, listener.getsockname()[1])
+
+    def test_read_key_password_pass(self):
+        self.assertEqual(read_key_password({ 'AUTHSERVER_SSL_KEY_PASSWORD' : 'password' }), 'password')
+        self.assertIsNone(read_key_password({}))
+
+        (handle, passwordFile) = tempfile.mkstemp()
+        os.write(handle, b'password\n')
+        os.close(handle)
+        try:
+            self.assertEqual(read_key_password({ 'AUTHSERVER_SSL_KEY_PASSWORD_FILE' : passwordFile }), 'password')
+        finally:
+            os.remove(passwordFile)
+
+    def test_create_ssl_context_from_env_pass(self):
+        sslContext = create_ssl_context_from_env(certfile, keyfile, { 'AUTHSERVER_SSL_KEY_PASSWORD' : 'password', 'AUTHSERVER_SSL_TICKET_COUNT' : '4' })
+        self.assertEqual(sslContext.num_tickets, 4)
+        self.assertEqual(sslContext.minimum_version, ssl.TLSVersion.TLSv1_2)
+        self.assertTrue(all('ECDHE' in cipher['name'] for cipher in sslContext.get_ciphers() if cipher['protocol'] == 'TLSv1.2'))
+
+    def test_create_ssl_context_fail_bad_password(self):
+        with self.assertRaises(ssl.SSLError):
+            create_ssl_context(certfile, keyfile, 'wrong')
+
+    def test_session_resumption_pass(self):
+        sslContext = create_ssl_context(certfile, keyfile, 'password')
+        (thread, port) = self.serve(sslContext, 2)
+
+        clientContext = self.create_client_context()
+        first = self.connect(clientContext, port)
+        session = first.session
+        self.assertFalse(first.session_reused)
+        first.close()
+
+        second = self.connect(clientContext, port, session)
+        self.assertTrue(second.session_reused)
+        second.close()
+
+        thread.join()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+import time
+from contextlib import redirect_stdout
+from AuthServer.SessionSnapshot import SessionSnapshotter, create_session_snapshotter_from_env
+from AuthServer.TokenManager import TokenManager
+
+class SessionSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.snapshotFile = os.path.join(self.directory, 'sessions.snap')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def restore(self):
+        # Restore into a fresh token manager, as on startup
+        tokenManager = TokenManager()
+        restoredCount = SessionSnapshotter(tokenManager, self.snapshotFile).restore()
+        return (tokenManager, restoredCount)
+
+    def test_restore_pass_snapshot_and_log(self):
+        tokenManager = TokenManager()
+        snapshotter = SessionSnapshotter(tokenManager, self.snapshotFile, 3600)
+        snapshotter.start()
+
+        tokenA = tokenManager.create_token('alice@foo.bar')
+        tokenB = tokenManager.create_token('bob@foo.bar')
+        snapshotter.take_snapshot()
+
+        # Changes after the snapshot are only in the log
+        tokenC = tokenManager.create_token('alice@foo.bar')
+        tokenManager.lock_on_token(tokenA)
+        tokenA = tokenManager.release_update_token(tokenA)
+        tokenManager.lock_on_token(tokenB)
+        tokenManager.release_close_token(tokenB)
+        snapshotter.changeLog.shutdown()
+
+        (restoredManager, restoredCount) = self.restore()
+        self.assertEqual(restoredCount, 2)
+        self.assertEqual(restoredManager.get_user_for_token(tokenA), 'alice@foo.bar')
+        self.assertEqual(restoredManager.get_user_for_token(tokenC), 'alice@foo.bar')
+        self.assertIsNone(restoredManager.introspect_token(tokenB))
+
+        # Restored tokens rotate and expire as before
+        restoredManager.lock_on_token(tokenA)
+        self.assertIsNotNone(restoredManager.release_update_token(tokenA))
+        self.assertEqual(restoredManager.get_expiry_stats()['queuedTokens'], 2)
+
+    def test_restore_pass_failed_snapshots(self):
+        tokenManager = TokenManager()
+        snapshotter = SessionSnapshotter(tokenManager, self.snapshotFile, 3600)
+        snapshotter.start()
+
+        # Snapshots fail while the temporary file can't be written, leaving each change in a log
+        os.mkdir(self.snapshotFile + '.tmp')
+        tokenA = tokenManager.create_token('alice@foo.bar')
+        self.assertRaises(Exception, snapshotter.take_snapshot)
+        tokenB = tokenManager.create_token('bob@foo.bar')
+        self.assertRaises(Exception, snapshotter.take_snapshot)
+        snapshotter.changeLog.shutdown()
+
+        (restoredManager, restoredCount) = self.restore()
+        self.assertEqual(restoredCount, 2)
+        self.assertEqual(restoredManager.get_user_for_token(tokenA), 'alice@foo.bar')
+        self.assertEqual(restoredManager.get_user_for_token(tokenB), 'bob@foo.bar')
+
+    def test_start_pass_snapshots_continue_after_failure(self):
+        tokenManager = TokenManager()
+        snapshotter = SessionSnapshotter(tokenManager, self.snapshotFile, 0.05)
+        os.mkdir(self.snapshotFile + '.tmp')
+        output = io.StringIO()
+        with redirect_stdout(output):
+            snapshotter.start()
+            time.sleep(0.2)
+
+            # Snapshots succeed again once the file can be written
+            os.rmdir(self.snapshotFile + '.tmp')
+            time.sleep(0.2)
+            snapshotter.stop()
+
+        self.assertIn('Unable to snapshot the sessions', output.getvalue())
+        self.assertTrue(os.path.exists(self.snapshotFile))
+
+    def test_restore_pass_deleted_user(self):
+        tokenManager = TokenManager()
+        snapshotter = SessionSnapshotter(tokenManager, self.snapshotFile, 3600)
+        snapshotter.start()
+
+        tokenA = tokenManager.create_token('alice@foo.bar')
+        snapshotter.take_snapshot()
+        tokenManager.lock_on_token(tokenA)
+        tokenManager.delete_user('alice@foo.bar')
+
+        # Sessions created after the deletion survive it
+        tokenB = tokenManager.create_token('alice@foo.bar')
+        snapshotter.stop()
+
+        (restoredManager, restoredCount) = self.restore()
+        self.assertEqual(restoredCount, 1)
+        self.assertIsNone(restoredManager.introspect_token(tokenA))
+        self.assertEqual(restoredManager.introspect_token(tokenB)[0], 'alice@foo.bar')
+
+    def test_restore_pass_drops_expired(self):
+        tokenManager = TokenManager(tokenLifespan = 0.2)
+        snapshotter = SessionSnapshotter(tokenManager, self.snapshotFile, 3600)
+        snapshotter.start()
+        tokenManager.create_token('alice@foo.bar')
+        snapshotter.stop()
+
+        time.sleep(0.3)
+        restoredManager = TokenManager(tokenLifespan = 0.2)
+        self.assertEqual(SessionSnapshotter(restoredManager, self.snapshotFile).restore(), 0)
+        self.assertEqual(restoredManager.get_expiry_stats()['liveUsers'], 0)
+
+    def test_restore_pass_truncated_log(self):
+        tokenManager = TokenManager()
+        snapshotter = SessionSnapshotter(tokenManager, self.snapshotFile, 3600)
+        snapshotter.start()
+        token = tokenManager.create_token('alice@foo.bar')
+        tokenManager.create_token('bob@foo.bar')
+        snapshotter.changeLog.shutdown()
+
+        # A crash mid-write leaves a partial last record, which is skipped
+        with open(snapshotter.logFile, 'r+b') as log:
+            log.truncate(os.path.getsize(snapshotter.logFile) - 3)
+
+        (restoredManager, restoredCount) = self.restore()
+        self.assertEqual(restoredCount, 1)
+        self.assertEqual(restoredManager.get_user_for_token(token), 'alice@foo.bar')
+
+    def test_restore_pass_nothing_persisted(self):
+        self.assertEqual(self.restore()[1], 0)
+
+    def test_restore_fail_unrecognised_snapshot(self):
+        with open(self.snapshotFile, 'wb') as snapshot:
+            snapshot.write(b'\0' * 64)
+        self.assertRaises(Exception, self.restore)
+
+    def test_create_from_env_pass(self):
+        self.assertIsNone(create_session_snapshotter_from_env(TokenManager(), {}))
+
+        snapshotter = create_session_snapshotter_from_env(TokenManager(), { 'AUTHSERVER_SESSION_SNAPSHOT' : self.snapshotFile, 'AUTHSERVER_SESSION_SNAPSHOT_INTERVAL' : '60' })
+        self.assertEqual(snapshotter.interval, 60)
+        self.assertEqual(snapshotter.logFile, self.snapshotFile + '.log')
+
+if __name__ == '__main__':
+    unittest.main()
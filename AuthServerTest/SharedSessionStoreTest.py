@@ -0,0 +1,142 @@
+import unittest
+import multiprocessing
+import os
+from AuthServer.SharedSessionStore import SharedSessionStore, tokenStateOffset
+from AuthServer.TokenManager import TokenManager
+from AuthServerTest import TokenManagerTest
+
+# Runs the TokenManager tests against the shared store
+class SharedTokenManagerTest(TokenManagerTest.TokenManagerTest):
+
+    def create_token_manager(self, *args, **kwargs):
+        store = SharedSessionStore(4096, 1024, 8)
+        self.addCleanup(store.close)
+        return TokenManager(*args, store = store, **kwargs)
+
+
+class SharedSessionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SharedSessionStore(4096, 1024, 8)
+
+    def tearDown(self):
+        self.store.close()
+
+    def run_process(self, target):
+        # Workers are forked, inheriting the store
+        process = multiprocessing.get_context('fork').Process(target = target)
+        process.start()
+        process.join()
+        return process.exitcode
+
+    def test_tokens_pass_shared_between_processes(self):
+        tokenManager = TokenManager(store = self.store)
+        token = tokenManager.create_token('alice@foo.bar')
+
+        # Rotate the token in another process
+        def rotate():
+            workerManager = TokenManager(store = self.store)
+            workerManager.lock_on_token(token)
+            workerManager.release_update_token(token)
+            workerManager.create_token('bob@foo.bar')
+
+        self.assertEqual(self.run_process(rotate), 0)
+        self.assertIsNone(tokenManager.introspect_token(token))
+        self.assertEqual(tokenManager.get_expiry_stats()['liveTokens'], 2)
+        self.assertEqual(tokenManager.get_expiry_stats()['liveUsers'], 2)
+
+    def test_lock_user_fail_locked_by_other_process(self):
+        self.assertTrue(self.store.lock_user('alice@foo.bar', 0))
+
+        def lock():
+            os._exit(0 if not self.store.lock_user('alice@foo.bar', 0.1) else 1)
+
+        self.assertEqual(self.run_process(lock), 0)
+        self.assertTrue(self.store.lock_user('bob@foo.bar', 0))
+        self.store.release_user('alice@foo.bar')
+        self.store.release_user('bob@foo.bar')
+
+    def test_lock_user_pass_takes_over_from_dead_process(self):
+        def lock_and_exit():
+            self.store.lock_user('alice@foo.bar', 0)
+            os._exit(0)
+
+        self.assertEqual(self.run_process(lock_and_exit), 0)
+        self.assertTrue(self.store.lock_user('alice@foo.bar', 0))
+        self.store.release_user('alice@foo.bar')
+
+    def test_lock_user_pass_concurrent_processes(self):
+        # Each process counts up under the user lock, in the created time of a shared token
+        tokenManager = TokenManager(store = self.store)
+        key = tokenManager.get_token_key(tokenManager.create_token('alice@foo.bar'))
+
+        def count():
+            for _ in range(50):
+                self.store.lock_user('alice@foo.bar', 5)
+                (_, created, lastAccessed) = self.store.get_token(key)
+                self.store.touch_token(key, lastAccessed + 1)
+                self.store.release_user('alice@foo.bar')
+
+        processes = [multiprocessing.get_context('fork').Process(target = count) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        (_, created, lastAccessed) = self.store.get_token(key)
+        self.assertEqual(round(lastAccessed - created), 200)
+
+    def test_add_token_fail_full(self):
+        store = SharedSessionStore(8, 8, 1)
+        self.addCleanup(store.close)
+        store.lock_user('alice@foo.bar', 0)
+        for i in range(8):
+            store.add_token(bytes([i]) * 16, 'alice@foo.bar', 0, 0)
+        with self.assertRaises(Exception):
+            store.add_token(bytes([8]) * 16, 'alice@foo.bar', 0, 0)
+
+        # Freed slots are reused
+        store.remove_token(bytes([3]) * 16)
+        store.add_token(bytes([8]) * 16, 'alice@foo.bar', 0, 0)
+        self.assertEqual(store.get_stats()['liveTokens'], 8)
+
+    def test_create_token_fail_full_releases_user(self):
+        store = SharedSessionStore(8, 8, 1)
+        self.addCleanup(store.close)
+        tokenManager = TokenManager(store = store)
+        for _ in range(8):
+            tokenManager.create_token('alice@foo.bar')
+        self.assertRaises(Exception, tokenManager.create_token, 'alice@foo.bar')
+        self.assertFalse(store.is_user_locked('alice@foo.bar'))
+
+    def test_release_update_token_fail_full_releases_user(self):
+        store = SharedSessionStore(8, 8, 1)
+        self.addCleanup(store.close)
+        tokenManager = TokenManager(store = store)
+        tokens = [tokenManager.create_token('alice@foo.bar') for _ in range(8)]
+
+        # The rotated token needs a free slot before the old one is freed
+        tokenManager.lock_on_token(tokens[0])
+        self.assertRaises(Exception, tokenManager.release_update_token, tokens[0])
+        self.assertFalse(store.is_user_locked('alice@foo.bar'))
+
+    def test_remove_token_pass_clears_deleted_slots(self):
+        self.store.lock_user('alice@foo.bar', 0)
+        keys = [os.urandom(16) for _ in range(100)]
+        for key in keys:
+            self.store.add_token(key, 'alice@foo.bar', 0, 0)
+        for key in keys:
+            self.store.remove_token(key)
+        self.store.release_user('alice@foo.bar')
+
+        # With every entry gone, no slot is left marked deleted
+        states = set(self.store.buffer[self.store.get_token_offset(index) + tokenStateOffset] for index in range(self.store.tokenCapacity))
+        self.assertEqual(states, { 0 })
+        self.assertEqual(self.store.get_stats()['liveUsers'], 0)
+
+    def test_add_token_fail_long_email(self):
+        with self.assertRaises(Exception):
+            self.store.lock_user('a' * 250 + '@foo.bar', 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import unittest
+import multiprocessing
+import sqlite3
+import time
+from AuthServer.RequestHandler import RequestHandler
+from AuthServer.RequestRouter import RequestRouter
+from AuthServer.RevocationSet import RevocationSet, SharedRevocationSet
+from AuthServer.SchemaMigrator import SchemaMigrator
+from AuthServer.SharedSessionStore import SharedSessionStore
+from AuthServer.SignedTokenManager import SignedTokenManager, create_signed_token_manager_from_env
+from AuthServer.UserManager import UserManager
+
+class SignedTokenManagerTest(unittest.TestCase):
+
+    __secret__ = b'secret'
+
+    def create_token_manager(self, *args, **kwargs):
+        # Overridden to run the tests against the shared revocations
+        return SignedTokenManager(self.__secret__, *args, **kwargs)
+
+    def test_create_token_pass_validated_anywhere(self):
+        token = self.create_token_manager().create_token('alice@foo.bar')
+
+        # Any token manager with the secret validates the token, without having seen it
+        self.assertEqual(self.create_token_manager().get_user_for_token(token), 'alice@foo.bar')
+        self.assertEqual(self.create_token_manager().introspect_token(token)[0], 'alice@foo.bar')
+        self.assertIsNone(SignedTokenManager(b'other').introspect_token(token))
+
+    def test_get_user_for_token_fail_tampered_token(self):
+        tokenManager = self.create_token_manager()
+        token = tokenManager.create_token('alice@foo.bar')
+        tamperedToken = token[:-30] + ('A' if token[-30] != 'A' else 'B') + token[-29:]
+
+        for badToken in (tamperedToken, token[:20], 'NotAValidToken', '', None, 5):
+            self.assertRaises(Exception, tokenManager.get_user_for_token, badToken)
+            self.assertIsNone(tokenManager.introspect_token(badToken))
+
+    def test_lock_release_update_token_pass(self):
+        tokenManager = self.create_token_manager()
+        token1 = tokenManager.create_token('alice@foo.bar')
+
+        tokenManager.lock_on_token(token1)
+        token2 = tokenManager.release_update_token(token1)
+        self.assertNotEqual(token1, token2)
+
+        # Rotating retires the earlier token
+        self.assertRaises(Exception, tokenManager.lock_on_token, token1)
+        tokenManager.lock_on_token(token2)
+        tokenManager.release_close_token(token2)
+        self.assertIsNone(tokenManager.introspect_token(token2))
+
+    def test_release_update_token_fail_not_locked(self):
+        tokenManager = self.create_token_manager()
+        token = tokenManager.create_token('alice@foo.bar')
+        self.assertRaises(Exception, tokenManager.release_update_token, token)
+
+    def test_lock_on_token_fail_expired_token(self):
+        tokenManager = self.create_token_manager(1, 60)
+        token = tokenManager.create_token('alice@foo.bar')
+        time.sleep(1.5)
+        self.assertRaises(Exception, tokenManager.lock_on_token, token)
+        self.assertFalse(tokenManager.store.is_user_locked('alice@foo.bar'))
+
+    def test_revoke_tokens_pass(self):
+        tokenManager = self.create_token_manager()
+        tokens = [tokenManager.create_token('alice@foo.bar') for _ in range(3)]
+        otherToken = tokenManager.create_token('bob@foo.bar')
+
+        # A password change keeps the rotated token
+        tokenManager.lock_on_token(tokens[0])
+        newToken = tokenManager.release_update_token(tokens[0], True)
+        for token in tokens:
+            self.assertIsNone(tokenManager.introspect_token(token))
+        self.assertEqual(tokenManager.get_user_for_token(newToken), 'alice@foo.bar')
+
+        # Revoking all of them doesn't
+        tokenManager.lock_on_token(newToken)
+        tokenManager.release_revoke_tokens(newToken)
+        self.assertIsNone(tokenManager.introspect_token(newToken))
+        self.assertEqual(tokenManager.get_user_for_token(otherToken), 'bob@foo.bar')
+        self.assertEqual(tokenManager.get_user_for_token(tokenManager.create_token('alice@foo.bar')), 'alice@foo.bar')
+
+    def test_reap_expired_tokens_pass(self):
+        tokenManager = self.create_token_manager(1, 60)
+        token = tokenManager.create_token('alice@foo.bar')
+        tokenManager.lock_on_token(token)
+        tokenManager.release_close_token(token)
+        self.assertEqual(tokenManager.get_expiry_stats()['queuedTokens'], 1)
+
+        # The revocation is dropped once the token would have expired
+        self.assertEqual(tokenManager.reap_expired_tokens(), 0)
+        time.sleep(1.5)
+        self.assertEqual(tokenManager.reap_expired_tokens(), 1)
+        self.assertEqual(tokenManager.get_expiry_stats()['queuedTokens'], 0)
+        self.assertEqual(tokenManager.get_expiry_stats()['liveUsers'], 0)
+
+    def test_route_pass_signed_tokens(self):
+        db = sqlite3.connect(':memory:')
+        SchemaMigrator(db).migrate()
+        router = RequestRouter(RequestHandler(self.create_token_manager(), UserManager(db)))
+
+        router.route('POST', '/register', { 'name' : 'alice', 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        (_, result) = router.route('POST', '/login', { 'email' : 'alice@foo.bar', 'password' : '1PasswordPassword!' })
+        (status, result) = router.route('POST', '/update', { 'name' : 'bob', 'email' : 'alice@foo.bar', 'token' : result['token'] })
+        self.assertEqual(status, 200)
+
+        (status, result) = router.route('POST', '/batch', { 'operations' : [{ 'op' : 'logout', 'token' : result['token'] }] })
+        self.assertEqual(result['results'], [{}])
+
+    def test_create_signed_token_manager_from_env_pass(self):
+        self.assertIsNone(create_signed_token_manager_from_env(1, {}))
+        tokenManager = create_signed_token_manager_from_env(1, { 'AUTHSERVER_TOKEN_MODE' : 'signed', 'AUTHSERVER_TOKEN_SECRET' : 'secret' })
+        self.assertEqual(tokenManager.get_user_for_token(self.create_token_manager().create_token('alice@foo.bar')), 'alice@foo.bar')
+        self.assertRaises(Exception, create_signed_token_manager_from_env, 1, { 'AUTHSERVER_TOKEN_MODE' : 'signed', 'AUTHSERVER_CLUSTER_FILE' : 'cluster.json' })
+
+
+# Runs the SignedTokenManager tests against the shared revocations and user locks
+class SharedSignedTokenManagerTest(SignedTokenManagerTest):
+
+    def create_token_manager(self, *args, **kwargs):
+        store = SharedSessionStore(64, 1024, 8)
+        revocations = SharedRevocationSet(1024, 8)
+        tokenManager = SignedTokenManager(self.__secret__, *args, store = store, revocations = revocations, **kwargs)
+        self.addCleanup(tokenManager.close)
+        return tokenManager
+
+    def test_revoke_pass_shared_between_processes(self):
+        tokenManager = self.create_token_manager()
+        token = tokenManager.create_token('alice@foo.bar')
+
+        # Log out in another process
+        def logout():
+            tokenManager.lock_on_token(token)
+            tokenManager.release_close_token(token)
+
+        process = multiprocessing.get_context('fork').Process(target = logout)
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        self.assertIsNone(tokenManager.introspect_token(token))
+
+
+class RevocationSetTest(unittest.TestCase):
+
+    def test_revoke_purge_pass(self):
+        for revocations in (RevocationSet(), SharedRevocationSet(64, 4)):
+            # Replacing an entry takes its latest expiry
+            revocations.revoke(b'a' * 16, 1, 10)
+            revocations.revoke(b'a' * 16, 2, 30)
+            revocations.revoke(b'b' * 16, 1, 20)
+            self.assertEqual(revocations.get(b'a' * 16), 2)
+            self.assertIsNone(revocations.get(b'c' * 16))
+
+            self.assertEqual(revocations.purge(25, 100), 1)
+            self.assertIsNone(revocations.get(b'b' * 16))
+            self.assertEqual(revocations.get_count(), 1)
+            revocations.close()
+
+    def test_revoke_pass_full_of_expired(self):
+        revocations = SharedRevocationSet(4, 1)
+        self.addCleanup(revocations.close)
+        for i in range(4):
+            revocations.revoke(bytes([i]) * 16, 1, 10)
+
+        # Expired entries are replaced before the reaper drops them
+        revocations.revoke(bytes([4]) * 16, 1, time.time() + 60)
+        self.assertEqual(revocations.get(bytes([4]) * 16), 1)
+        self.assertEqual(revocations.get_count(), 4)
+
+    def test_revoke_fail_full(self):
+        revocations = SharedRevocationSet(4, 1)
+        self.addCleanup(revocations.close)
+        for i in range(4):
+            revocations.revoke(bytes([i]) * 16, 1, time.time() + 60)
+        self.assertRaises(Exception, revocations.revoke, bytes([4]) * 16, 1, time.time() + 60)
+
+        # Purged slots are reused
+        self.assertEqual(revocations.purge(time.time() + 60, 100), 4)
+        revocations.revoke(bytes([4]) * 16, 1, time.time() + 60)
+        self.assertEqual(revocations.get_count(), 1)
+
+    def test_release_close_token_fail_full_releases_user(self):
+        revocations = SharedRevocationSet(4, 1)
+        tokenManager = SignedTokenManager(b'secret', revocations = revocations)
+        self.addCleanup(tokenManager.close)
+
+        # The fifth logout can't be revoked, but still releases its user
+        tokens = [tokenManager.create_token('alice@foo.bar') for _ in range(5)]
+        for token in tokens[:4]:
+            tokenManager.lock_on_token(token)
+            tokenManager.release_close_token(token)
+        tokenManager.lock_on_token(tokens[4])
+        self.assertRaises(Exception, tokenManager.release_close_token, tokens[4])
+        self.assertFalse(tokenManager.store.is_user_locked('alice@foo.bar'))
+
+if __name__ == '__main__':
+    unittest.main()
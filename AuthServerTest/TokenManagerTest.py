@@ -1,11 +1,16 @@
 import unittest
 import time
+from threading import Thread
 from AuthServer.TokenManager import TokenManager
 
 class TokenManagerTest(unittest.TestCase):
 
+    def create_token_manager(self, *args, **kwargs):
+        # Overridden to run the tests against other session stores
+        return TokenManager(*args, **kwargs)
+
     def test_create_token_pass(self):
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         token = tokenManager.create_token('alice@foo.bar')
 
         self.assertTrue(token is not None)
@@ -13,7 +18,7 @@ class TokenManagerTest(unittest.TestCase):
 
     def test_lock_release_update_token_pass(self):
         # Setup the tokens
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         token1 = tokenManager.create_token('alice@foo.bar')
 
         # Lock the first token
@@ -32,13 +37,13 @@ class TokenManagerTest(unittest.TestCase):
         self.assertNotEquals(token2, token3)
 
     def test_lock_on_token_fail_missing_token(self):
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         with self.assertRaises(Exception):
             tokenManager.lock_on_token('alice@foo.bar')
 
     def test_lock_on_token_fail_inactive_token(self):
         # Setup and touch the token
-        tokenManager = TokenManager(1, 60)
+        tokenManager = self.create_token_manager(1, 60)
         token1 = tokenManager.create_token('alice@foo.bar')
 
         tokenManager.lock_on_token(token1)
@@ -53,7 +58,7 @@ class TokenManagerTest(unittest.TestCase):
 
     def test_lock_on_token_fail_expired_token(self):
         # Setup the tokens
-        tokenManager = TokenManager(1, 2)
+        tokenManager = self.create_token_manager(1, 2)
         token = tokenManager.create_token('alice@foo.bar')
 
         # Let the token expire
@@ -64,13 +69,13 @@ class TokenManagerTest(unittest.TestCase):
             tokenManager.lock_on_token(token)
 
     def test_release_update_token_fail_missing_token(self):
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         with self.assertRaises(Exception):
             tokenManager.release_update_token('NotAValidToken')
 
     def test_release_update_token_fail_not_locked(self):
         # Setup the tokens
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         token = tokenManager.create_token('alice@foo.bar')
 
         # Attempt to immediately release the token
@@ -79,7 +84,7 @@ class TokenManagerTest(unittest.TestCase):
 
     def test_lock_release_close_token_pass(self):
         # Setup the tokens
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         token = tokenManager.create_token('alice@foo.bar')
 
         # Lock the token
@@ -93,13 +98,13 @@ class TokenManagerTest(unittest.TestCase):
             tokenManager.release_close_token(token)
 
     def test_release_close_token_fail_missing_token(self):
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         with self.assertRaises(Exception):
             tokenManager.release_close_token('NotAValidToken')
 
     def test_release_close_token_fail_not_locked(self):
         # Setup the tokens
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         token = tokenManager.create_token('alice@foo.bar')
 
         # Attempt to immediately release the token
@@ -108,7 +113,7 @@ class TokenManagerTest(unittest.TestCase):
 
     def test_lock_delete_user_pass(self):
         # Setup the tokens
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         token1 = tokenManager.create_token('alice@foo.bar')
         token2 = tokenManager.create_token('alice@foo.bar')
         token3 = tokenManager.create_token('alice@foo.bar')
@@ -122,13 +127,13 @@ class TokenManagerTest(unittest.TestCase):
             tokenManager.release_close_token(token)
 
     def test_delete_user_fail_missing_user(self):
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         with self.assertRaises(Exception):
             tokenManager.delete_user('NotAValidUser')
 
     def test_delete_user_fail_not_locked(self):
         # Setup the tokens
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         token = tokenManager.create_token('alice@foo.bar')
 
         # Attempt to immediately release the token
@@ -137,7 +142,7 @@ class TokenManagerTest(unittest.TestCase):
 
     def test_get_user_for_token_pass(self):
         # Setup the tokens
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         token = tokenManager.create_token('alice@foo.bar')
 
         # Get the user
@@ -145,10 +150,242 @@ class TokenManagerTest(unittest.TestCase):
 
         self.assertEquals(user, 'alice@foo.bar')
 
+    def test_release_token_pass(self):
+        # Setup and lock the token
+        tokenManager = self.create_token_manager()
+        token = tokenManager.create_token('alice@foo.bar')
+        tokenManager.lock_on_token(token)
+
+        # Release the token without rotating it, then verify it can be locked again
+        tokenManager.release_token(token)
+        tokenManager.lock_on_token(token)
+        tokenManager.release_close_token(token)
+
+    def test_create_token_pass_concurrent(self):
+        tokenManager = self.create_token_manager()
+        tokens = []
+
+        # Create tokens for the same user from several threads
+        def create_tokens():
+            for _ in range(100):
+                tokens.append(tokenManager.create_token('alice@foo.bar'))
+
+        threads = [Thread(target = create_tokens) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(tokens)), 800)
+        self.assertEqual(tokenManager.get_expiry_stats()['liveTokens'], 800)
+
+    def test_reap_expired_tokens_pass(self):
+        # Setup the tokens, closing one of them
+        tokenManager = self.create_token_manager(1, 60)
+        token1 = tokenManager.create_token('alice@foo.bar')
+        token2 = tokenManager.create_token('alice@foo.bar')
+        token3 = tokenManager.create_token('bob@foo.bar')
+        tokenManager.lock_on_token(token3)
+        tokenManager.release_close_token(token3)
+
+        # Let the tokens expire
+        time.sleep(1.5)
+
+        # Only the open tokens are counted as evicted; the empty user records are dropped
+        self.assertEqual(tokenManager.reap_expired_tokens(), 2)
+        self.assertEqual(tokenManager.get_expiry_stats()['liveTokens'], 0)
+        self.assertEqual(tokenManager.get_expiry_stats()['liveUsers'], 0)
+        self.assertEqual(tokenManager.get_expiry_stats()['queuedTokens'], 0)
+        self.assertEqual(tokenManager.get_expiry_stats()['evictedTokens'], 2)
+
+    def test_reap_expired_tokens_pass_requeues_active_token(self):
+        # Setup and touch the token, pushing out its inactivity deadline
+        tokenManager = self.create_token_manager(60, 1)
+        token1 = tokenManager.create_token('alice@foo.bar')
+        time.sleep(0.6)
+        tokenManager.lock_on_token(token1)
+        token2 = tokenManager.release_update_token(token1)
+        time.sleep(0.6)
+
+        # The original deadline has passed, but the token is still active
+        self.assertEqual(tokenManager.reap_expired_tokens(), 0)
+        tokenManager.lock_on_token(token2)
+        tokenManager.release_close_token(token2)
+
+    def test_reap_expired_tokens_pass_skips_locked_user(self):
+        # Setup and lock the token
+        tokenManager = self.create_token_manager(1, 60)
+        token = tokenManager.create_token('alice@foo.bar')
+        time.sleep(1.5)
+        tokenManager.lock_user('alice@foo.bar')
+
+        # The token can't be evicted while the user is locked, so it is retried later
+        self.assertEqual(tokenManager.reap_expired_tokens(), 0)
+        self.assertIsNotNone(tokenManager.store.get_token(tokenManager.get_token_key(token)))
+        self.assertEqual(tokenManager.get_expiry_stats()['queuedTokens'], 1)
+
+    def test_start_stop_reaper_pass(self):
+        tokenManager = self.create_token_manager(1, 60)
+        tokenManager.create_token('alice@foo.bar')
+
+        # Let the reaper evict the token
+        tokenManager.start_reaper(0.1)
+        time.sleep(1.5)
+        tokenManager.stop_reaper()
+
+        self.assertEqual(tokenManager.get_expiry_stats()['liveTokens'], 0)
+        self.assertEqual(tokenManager.get_expiry_stats()['evictedTokens'], 1)
+
+    def test_introspect_token_pass(self):
+        tokenManager = self.create_token_manager()
+        token = tokenManager.create_token('alice@foo.bar')
+
+        (email, expiresIn) = tokenManager.introspect_token(token)
+        self.assertEqual(email, 'alice@foo.bar')
+        self.assertGreater(expiresIn, 0)
+
+        # Introspection neither rotates nor locks the token
+        tokenManager.lock_on_token(token)
+        tokenManager.release_token(token)
+
+    def test_introspect_token_fail_invalid_token(self):
+        tokenManager = self.create_token_manager(1, 60)
+        token = tokenManager.create_token('alice@foo.bar')
+        self.assertIsNone(tokenManager.introspect_token('alice@foo.bar'))
+        self.assertIsNone(tokenManager.introspect_token('b1d3c6bb-49c4-4c8b-a5d4-2bb41b9d0a8c'))
+
+        # Rotated tokens are no longer valid
+        tokenManager.lock_on_token(token)
+        newToken = tokenManager.release_update_token(token)
+        self.assertIsNone(tokenManager.introspect_token(token))
+
+        # Nor are expired ones
+        time.sleep(1.5)
+        self.assertIsNone(tokenManager.introspect_token(newToken))
+
+    def test_lock_on_user_pass(self):
+        tokenManager = self.create_token_manager()
+        token1 = tokenManager.create_token('alice@foo.bar')
+        token2 = tokenManager.create_token('alice@foo.bar')
+
+        # Handle both tokens under the one lock
+        tokenManager.lock_on_user('alice@foo.bar')
+        tokenManager.verify_locked_token('alice@foo.bar', token1)
+        tokenManager.verify_locked_token('alice@foo.bar', token2)
+        token3 = tokenManager.update_locked_token(token1)
+        tokenManager.close_locked_token(token2)
+        tokenManager.release_on_user('alice@foo.bar')
+
+        self.assertNotEqual(token1, token3)
+        self.assertEqual(tokenManager.get_expiry_stats()['liveTokens'], 1)
+        tokenManager.lock_on_token(token3)
+        tokenManager.release_token(token3)
+
+    def test_verify_locked_token_fail_other_user(self):
+        tokenManager = self.create_token_manager()
+        tokenManager.create_token('alice@foo.bar')
+        token = tokenManager.create_token('bob@foo.bar')
+
+        tokenManager.lock_on_user('alice@foo.bar')
+        with self.assertRaises(Exception):
+            tokenManager.verify_locked_token('alice@foo.bar', token)
+        tokenManager.release_on_user('alice@foo.bar')
+
+    def test_get_token_key_pass(self):
+        # Tokens are kept as raw bytes, but handed out as UUID strings
+        tokenManager = self.create_token_manager()
+        token = tokenManager.create_token('alice@foo.bar')
+        key = tokenManager.get_token_key(token)
+
+        self.assertEqual(len(key), 16)
+        self.assertIsNotNone(tokenManager.store.get_token(key))
+        self.assertEqual(tokenManager.get_token_for_key(key), token)
+
+    def test_get_token_key_fail_malformed_token(self):
+        tokenManager = self.create_token_manager()
+        with self.assertRaises(Exception):
+            tokenManager.get_token_key('NotAValidToken')
+        with self.assertRaises(Exception):
+            tokenManager.get_token_key(None)
+
     def test_get_user_for_token_fail_missing_token(self):
-        tokenManager = TokenManager()
+        tokenManager = self.create_token_manager()
         with self.assertRaises(Exception):
             tokenManager.get_user_for_token('NotAValidToken')
 
+    def test_remove_add_tokens_pass(self):
+        # Sessions handed from one token manager to another stay valid
+        tokenManager = self.create_token_manager()
+        tokenA = tokenManager.create_token('alice@foo.bar')
+        tokenB = tokenManager.create_token('bob@foo.bar')
+        tokens = tokenManager.remove_tokens([tokenManager.get_token_key(tokenA), tokenManager.get_token_key(tokenB), b'\0' * 16])
+        self.assertEqual(len(tokens), 2)
+        self.assertEqual(tokenManager.get_expiry_stats()['liveUsers'], 0)
+
+        otherManager = self.create_token_manager()
+        self.assertEqual(otherManager.add_tokens(tokens), 2)
+        self.assertEqual(otherManager.add_tokens(tokens), 0)
+        self.assertEqual(otherManager.get_user_for_token(tokenA), 'alice@foo.bar')
+        otherManager.lock_on_token(tokenB)
+        otherManager.release_close_token(tokenB)
+
+    def test_create_token_pass_evicts_least_recently_used(self):
+        tokenManager = self.create_token_manager(maxUserTokens = 2)
+        token1 = tokenManager.create_token('alice@foo.bar')
+        token2 = tokenManager.create_token('alice@foo.bar')
+        otherToken = tokenManager.create_token('bob@foo.bar')
+
+        # Use the first token, so the second is the least recently used
+        time.sleep(0.01)
+        tokenManager.lock_on_token(token1)
+        tokenManager.release_token(token1)
+
+        token3 = tokenManager.create_token('alice@foo.bar')
+        self.assertIsNone(tokenManager.introspect_token(token2))
+        self.assertEqual(tokenManager.get_user_for_token(token1), 'alice@foo.bar')
+        self.assertEqual(tokenManager.get_user_for_token(token3), 'alice@foo.bar')
+        self.assertEqual(tokenManager.get_user_for_token(otherToken), 'bob@foo.bar')
+        self.assertEqual(tokenManager.get_expiry_stats()['liveTokens'], 3)
+
+    def test_release_revoke_tokens_pass(self):
+        tokenManager = self.create_token_manager(1, 60, maxUserTokens = 3)
+        tokens = [tokenManager.create_token('alice@foo.bar') for _ in range(3)]
+        otherToken = tokenManager.create_token('bob@foo.bar')
+
+        # Every token of the user is revoked, but held until cleaned up
+        tokenManager.lock_on_token(tokens[0])
+        tokenManager.release_revoke_tokens(tokens[0])
+        for token in tokens:
+            self.assertIsNone(tokenManager.introspect_token(token))
+            self.assertRaises(Exception, tokenManager.lock_on_token, token)
+        self.assertEqual(tokenManager.get_user_for_token(otherToken), 'bob@foo.bar')
+        self.assertEqual(tokenManager.get_expiry_stats()['liveTokens'], 4)
+
+        # New tokens are valid, and clear out the revoked ones on reaching the limit
+        newToken = tokenManager.create_token('alice@foo.bar')
+        self.assertEqual(tokenManager.get_user_for_token(newToken), 'alice@foo.bar')
+        self.assertEqual(tokenManager.get_expiry_stats()['liveTokens'], 2)
+
+        # The reaper cleans up revoked tokens otherwise
+        tokenManager.lock_on_token(newToken)
+        tokenManager.release_revoke_tokens(newToken)
+        time.sleep(1.5)
+        self.assertEqual(tokenManager.reap_expired_tokens(), 2)
+        self.assertEqual(tokenManager.get_expiry_stats()['liveTokens'], 0)
+        self.assertEqual(tokenManager.get_expiry_stats()['liveUsers'], 0)
+
+    def test_release_update_token_pass_revoke_others(self):
+        tokenManager = self.create_token_manager()
+        token1 = tokenManager.create_token('alice@foo.bar')
+        token2 = tokenManager.create_token('alice@foo.bar')
+
+        # The rotated token survives the revocation
+        tokenManager.lock_on_token(token1)
+        token3 = tokenManager.release_update_token(token1, True)
+        self.assertIsNone(tokenManager.introspect_token(token2))
+        self.assertEqual(tokenManager.get_user_for_token(token3), 'alice@foo.bar')
+        tokenManager.lock_on_token(token3)
+        tokenManager.release_close_token(token3)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,92 @@
+import unittest
+import sqlite3
+import time
+from AuthServer.UserCache import UserCache
+from AuthServer.UserManager import UserManager
+from AuthServer.SchemaMigrator import SchemaMigrator
+
+class UserCacheTest(unittest.TestCase):
+
+    def setup_user_manager(self, userCache):
+        db = sqlite3.connect(':memory:')
+        SchemaMigrator(db).migrate()
+        return (db, UserManager(db, None, None, userCache))
+
+    def test_get_put_pass(self):
+        userCache = UserCache()
+        self.assertEqual(userCache.get('alice@foo.bar'), (False, None))
+
+        userCache.put('alice@foo.bar', ('alice', 'alice@foo.bar', 'hash', 'salt'), userCache.get_version())
+        userCache.put('bob@foo.bar', None, userCache.get_version())
+        self.assertEqual(userCache.get('alice@foo.bar'), (True, ('alice', 'alice@foo.bar', 'hash', 'salt')))
+        self.assertEqual(userCache.get('bob@foo.bar'), (True, None))
+        self.assertEqual(userCache.get_stats(), { 'hits' : 2, 'misses' : 1, 'size' : 2 })
+
+    def test_put_pass_evicts_least_recent(self):
+        userCache = UserCache(2)
+        for email in ('a@foo.bar', 'b@foo.bar'):
+            userCache.put(email, None, userCache.get_version())
+        userCache.get('a@foo.bar')
+        userCache.put('c@foo.bar', None, userCache.get_version())
+
+        self.assertEqual(list(userCache.entries), ['a@foo.bar', 'c@foo.bar'])
+
+    def test_get_fail_expired(self):
+        userCache = UserCache(10, 0.1)
+        userCache.put('alice@foo.bar', None, userCache.get_version())
+        time.sleep(0.2)
+        self.assertEqual(userCache.get('alice@foo.bar'), (False, None))
+
+    def test_put_fail_invalidated_since_read(self):
+        # A row read before a write mustn't be cached after it
+        userCache = UserCache()
+        version = userCache.get_version()
+        userCache.invalidate('alice@foo.bar')
+        userCache.put('alice@foo.bar', None, version)
+        self.assertEqual(userCache.get('alice@foo.bar'), (False, None))
+
+    def test_user_manager_pass_cached_lookups(self):
+        userCache = UserCache()
+        (db, userManager) = self.setup_user_manager(userCache)
+        userManager.create_user('alice', 'alice@foo.bar', 'password')
+
+        self.assertTrue(userManager.validate_credentials('alice@foo.bar', 'password'))
+        self.assertFalse(userManager.validate_credentials('bob@foo.bar', 'password'))
+
+        # Repeat lookups, including of the unknown user, skip the database
+        db.execute('DELETE FROM Users')
+        self.assertTrue(userManager.validate_credentials('alice@foo.bar', 'password'))
+        self.assertFalse(userManager.validate_credentials('bob@foo.bar', 'password'))
+        self.assertEqual(userManager.get_user_count('alice@foo.bar'), 1)
+        self.assertEqual(userCache.get_stats()['hits'], 3)
+
+    def test_user_manager_pass_invalidates_on_write(self):
+        (_, userManager) = self.setup_user_manager(UserCache())
+        self.assertEqual(userManager.get_user_count('alice@foo.bar'), 0)
+
+        userManager.create_user('alice', 'alice@foo.bar', 'password')
+        self.assertTrue(userManager.validate_credentials('alice@foo.bar', 'password'))
+
+        userManager.update_user(None, 'alice@foo.bar', 'newpassword')
+        self.assertTrue(userManager.validate_credentials('alice@foo.bar', 'newpassword'))
+
+        userManager.delete_user('alice@foo.bar')
+        self.assertFalse(userManager.validate_credentials('alice@foo.bar', 'newpassword'))
+
+        userBatch = userManager.begin_batch()
+        userManager.create_user('alice', 'alice@foo.bar', 'password')
+        userManager.get_user_row('alice@foo.bar')
+        userBatch.delete_user('alice@foo.bar')
+        userBatch.commit()
+        self.assertEqual(userManager.get_user_count('alice@foo.bar'), 0)
+
+    def test_user_manager_fail_create_cached_user(self):
+        (_, userManager) = self.setup_user_manager(UserCache())
+        userManager.create_user('alice', 'alice@foo.bar', 'password')
+        userManager.get_user_row('alice@foo.bar')
+
+        with self.assertRaises(Exception):
+            userManager.create_user('alice', 'alice@foo.bar', 'password')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import sqlite3
+from AuthServer.HashingExecutor import HashingExecutor
 from AuthServer.UserManager import UserManager
 
 class UserManagerTest(unittest.TestCase):
@@ -57,6 +58,11 @@ class UserManagerTest(unittest.TestCase):
         userManager.update_user(None, 'alice@foo.bar', 'newpassword')
         self.assertTrue(userManager.validate_credentials('alice@foo.bar', 'newpassword'))
 
+    def test_update_user_pass_nothing_to_update(self):
+        userManager = UserManager(self.setup_db())
+        userManager.update_user(None, 'alice@foo.bar', None)
+        self.assertTrue(userManager.validate_credentials('alice@foo.bar', 'password'))
+
     def test_update_user_fail_user_does_not_exists(self):
         userManager = UserManager(self.setup_db())
         with self.assertRaises(Exception):
@@ -67,6 +73,37 @@ class UserManagerTest(unittest.TestCase):
         userManager.delete_user('alice@foo.bar')
         self.assertFalse(userManager.validate_credentials('alice@foo.bar', 'password'))
 
+    def test_begin_batch_pass(self):
+        userManager = UserManager(self.setup_db())
+        userManager.create_user('bob', 'bob@foo.bar', 'password')
+
+        userBatch = userManager.begin_batch()
+        userBatch.update_user(None, 'alice@foo.bar', 'newpassword')
+        userBatch.update_user('carol', 'carol@foo.bar', None)
+        userBatch.delete_user('bob@foo.bar')
+        errors = userBatch.commit()
+
+        self.assertIsNone(errors[0])
+        self.assertIsNotNone(errors[1])
+        self.assertIsNone(errors[2])
+        self.assertTrue(userManager.validate_credentials('alice@foo.bar', 'newpassword'))
+        self.assertEqual(userManager.get_user_count('bob@foo.bar'), 0)
+
+    def test_begin_batch_pass_hashed_ahead(self):
+        userManager = UserManager(self.setup_db(), HashingExecutor(2))
+        self.addCleanup(userManager.hashingExecutor.shutdown)
+        userManager.create_user('bob', 'bob@foo.bar', 'password')
+
+        # The passwords are hashed together, before the batch
+        passwordHashes = userManager.hash_new_passwords(['newpassword', 'otherpassword'])
+        userBatch = userManager.begin_batch()
+        userBatch.update_user(None, 'alice@foo.bar', 'newpassword', passwordHashes[0])
+        userBatch.update_user('bobby', 'bob@foo.bar', 'otherpassword', passwordHashes[1])
+        self.assertEqual(userBatch.commit(), [None, None])
+
+        self.assertTrue(userManager.validate_credentials('alice@foo.bar', 'newpassword'))
+        self.assertTrue(userManager.validate_credentials('bob@foo.bar', 'otherpassword'))
+
     def test_delete_user_fail_user_does_not_exists(self):
         userManager = UserManager(self.setup_db())
         with self.assertRaises(Exception):
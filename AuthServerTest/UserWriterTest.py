@@ -0,0 +1,113 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+from threading import Thread
+from AuthServer.ConnectionPool import ConnectionPool
+from AuthServer.SchemaMigrator import SchemaMigrator
+from AuthServer.UserManager import UserManager
+from AuthServer.UserWriter import UserWriter
+
+class UserWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        (handle, self.dbfile) = tempfile.mkstemp()
+        os.close(handle)
+
+        self.pool = ConnectionPool(self.dbfile)
+        SchemaMigrator(self.pool.get_connection()).migrate()
+        self.userWriter = UserWriter(self.pool, 64, 0.05)
+
+    def tearDown(self):
+        self.userWriter.shutdown()
+        self.pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.dbfile + suffix):
+                os.remove(self.dbfile + suffix)
+
+    def run_writes(self, writeCount):
+        # Run the writes concurrently, collecting each result or error
+        results = [None] * writeCount
+
+        def write(i):
+            try:
+                results[i] = self.userWriter.write("INSERT INTO Users VALUES ('user', ?, 'hash', 'salt')", ('user%d@foo.bar' % (i % 10), ))
+            except Exception as e:
+                results[i] = e
+
+        threads = [Thread(target = write, args = (i, )) for i in range(writeCount)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_write_pass_batched(self):
+        results = self.run_writes(10)
+
+        self.assertEqual(results, [1] * 10)
+        self.assertEqual(self.userWriter.writeCount, 10)
+        self.assertLess(self.userWriter.batchCount, 10)
+
+    def test_write_fail_only_conflicting_writes(self):
+        # Every email is written twice; one write of each pair should fail on the unique index
+        results = self.run_writes(20)
+
+        self.assertEqual(results.count(1), 10)
+        self.assertEqual(len([result for result in results if isinstance(result, sqlite3.IntegrityError)]), 10)
+
+        (count, ) = self.pool.get_connection().execute('SELECT COUNT(*) FROM Users').fetchone()
+        self.assertEqual(count, 10)
+
+    def test_write_many_pass(self):
+        results = self.userWriter.write_many([
+            ("INSERT INTO Users VALUES ('user', 'user1@foo.bar', 'hash', 'salt')", ()),
+            ("INSERT INTO Users VALUES ('user', 'user1@foo.bar', 'hash', 'salt')", ()),
+            ("DELETE FROM Users WHERE Email = 'user2@foo.bar'", ())
+        ])
+
+        self.assertEqual(results[0], (1, None))
+        self.assertIsInstance(results[1][1], sqlite3.IntegrityError)
+        self.assertEqual(results[2], (0, None))
+        self.assertEqual(self.userWriter.batchCount, 1)
+
+    def test_write_fail_timed_out(self):
+        userWriter = UserWriter(self.pool, 64, 0.05, 0.1)
+        self.addCleanup(userWriter.shutdown)
+
+        # Another connection holds the write lock, so the writer waits on it past the timeout
+        db = sqlite3.connect(self.dbfile)
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            with self.assertRaises(Exception) as context:
+                userWriter.write("INSERT INTO Users VALUES ('user', 'user@foo.bar', 'hash', 'salt')", ())
+            self.assertIn('Timed out', context.exception.args[0])
+        finally:
+            db.rollback()
+            db.close()
+
+    def test_user_manager_pass_with_writer(self):
+        userManager = UserManager(self.pool, None, self.userWriter)
+        userManager.create_user('bob', 'bob@foo.bar', 'password')
+        self.assertTrue(userManager.validate_credentials('bob@foo.bar', 'password'))
+
+        userManager.update_user(None, 'bob@foo.bar', 'newpassword')
+        self.assertTrue(userManager.validate_credentials('bob@foo.bar', 'newpassword'))
+
+        userManager.delete_user('bob@foo.bar')
+        self.assertFalse(userManager.validate_credentials('bob@foo.bar', 'newpassword'))
+
+    def test_user_manager_fail_with_writer(self):
+        userManager = UserManager(self.pool, None, self.userWriter)
+        userManager.create_user('bob', 'bob@foo.bar', 'password')
+
+        with self.assertRaises(Exception):
+            userManager.create_user('bob', 'bob@foo.bar', 'password')
+        with self.assertRaises(Exception):
+            userManager.update_user('alice', 'alice@foo.bar', None)
+        with self.assertRaises(Exception):
+            userManager.delete_user('alice@foo.bar')
+
+if __name__ == '__main__':
+    unittest.main()